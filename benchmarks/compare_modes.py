@@ -0,0 +1,131 @@
+"""Check that the staged and streaming ema modes build the same database."""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from server import StandInServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMA_DIR = os.path.join(ROOT, "ema")
+MODES = ["staged", "streaming"]
+
+# Folders of the ema data that both modes must fill the same way
+COMPARED = [
+    os.path.join("raw", "jsons"),
+    os.path.join("raw", "images"),
+    "interim",
+    "processed",
+]
+
+
+def tree(workdir):
+    """Get the sha256 of every compared file, by path under data."""
+    data = os.path.join(workdir, "data")
+    files = {}
+    for folder in COMPARED:
+        for root, _, names in os.walk(os.path.join(data, folder)):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, data)] = hashlib.sha256(
+                        f.read()).hexdigest()
+    return files
+
+
+def worker(args):
+    """Build the database of one mode in the given folder."""
+    os.chdir(args.workdir)
+    sys.path.insert(0, EMA_DIR)
+    # pylint: disable=import-outside-toplevel
+    from helpers import constants
+    import database
+
+    constants.MUSEUM_DICT.clear()
+    constants.MUSEUM_DICT.update(json.loads(args.museum_urls))
+    database.main.main(
+        ["create_model_db", "--mode", args.worker, "--filter", args.filter],
+        standalone_mode=False,
+    )
+
+
+def start_server(args):
+    """Serve the museums to both modes, so they fetch the same urls."""
+    sys.path.insert(0, EMA_DIR)
+    # pylint: disable=import-outside-toplevel
+    from helpers import constants
+
+    acronyms = list(constants.MUSEUM_DICT)[: args.museums]
+    museums = {acr: getattr(constants, f"{acr}_FIELDS") for acr in acronyms}
+    labels = [label for label, _ in constants.TL_JOINED[:8]] + ["objeto"]
+    server = StandInServer(
+        museums,
+        items=args.items,
+        labels=labels,
+        images_per_item=args.images_per_item,
+        seed=args.seed,
+    ).start()
+
+    return server, {acr: server.museum_url(acr) for acr in acronyms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=150,
+                        help="Items per museum (default: 150)")
+    parser.add_argument("--museums", type=int, default=3,
+                        help="Number of EMA museums served (default: 3)")
+    parser.add_argument("--images_per_item", type=int, default=2,
+                        help="Images referenced by each museum item (default: 2)")
+    parser.add_argument("--filter", choices=["all", "model"], default="all",
+                        help="Images downloaded by both modes (default: all)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the stand-in server (default: 0)")
+    parser.add_argument("--ema_python", default=sys.executable,
+                        help="Interpreter with the ema dependencies")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--museum_urls", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return 0
+
+    trees = {}
+    server, museum_urls = start_server(args)
+    with tempfile.TemporaryDirectory(prefix="modes-") as folder:
+        for mode in MODES:
+            print(f"🏁 Building the {mode} database...", flush=True)
+            workdir = os.path.join(folder, mode)
+            os.makedirs(workdir)
+            subprocess.run(
+                [args.ema_python, os.path.abspath(__file__), *sys.argv[1:],
+                 "--worker", mode, "--workdir", workdir,
+                 "--museum_urls", json.dumps(museum_urls)],
+                check=True,
+            )
+            trees[mode] = tree(workdir)
+    server.stop()
+
+    staged, streaming = (trees[mode] for mode in MODES)
+    differences = sorted(
+        path for path in set(staged) | set(streaming)
+        if staged.get(path) != streaming.get(path)
+    )
+    for path in differences:
+        state = ("only staged" if path not in streaming else
+                 "only streaming" if path not in staged else "content differs")
+        print(f"🚨 {path}: {state}")
+    if differences:
+        print(f"❌ {len(differences)} of {len(staged)} files differ.")
+        return 1
+    print(f"✅ Both modes built the same {len(staged)} files.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""Benchmark the crawlers and classifiers against the local stand-in server."""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from server import StandInServer, europeana_urls
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMA_DIR = os.path.join(ROOT, "ema")
+EUROPEANA_DIR = os.path.join(ROOT, "europeana_db", "europeana_crawler")
+REPORTS_DIR = os.path.join(ROOT, "benchmarks", "reports")
+
+# Constants of the europeana crawler pointing at files or urls, redirected
+# to the temporary workspace and the stand-in server
+EUROPEANA_PATHS = [
+    "JSON_DIR", "LOGS_DIR", "STATE_DB", "LOG_FILE", "CACHE_FILE", "CURSOR_FILE",
+]
+
+
+def count_files(path):
+    """Count the files under a folder, recursively."""
+    return sum(len(files) for _, _, files in os.walk(path))
+
+
+def timed(stages, name, func, count):
+    """Run a stage and record its wall time and throughput."""
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    items = count()
+    stages.append(
+        {
+            "stage": name,
+            "seconds": round(seconds, 4),
+            "items": items,
+            "items_per_sec": round(items / seconds, 2) if seconds else None,
+        }
+    )
+    print(f"  {name:<28} {seconds:8.2f}s {items:8d} items", flush=True)
+
+
+def bench_ema(args, workdir):
+    """Drive the ema database commands at the configured corpus size."""
+    os.chdir(workdir)
+    sys.path.insert(0, EMA_DIR)
+    from helpers import constants  # pylint: disable=import-outside-toplevel
+
+    acronyms = list(constants.MUSEUM_DICT)[: args.museums]
+    museums = {acr: getattr(constants, f"{acr}_FIELDS") for acr in acronyms}
+    labels = [label for label, _ in constants.TL_JOINED[:8]] + ["objeto"]
+    server = StandInServer(
+        museums,
+        items=args.items,
+        labels=labels,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        image_size=args.image_size,
+        images_per_item=args.images_per_item,
+        seed=args.seed,
+    ).start()
+    constants.MUSEUM_DICT.clear()
+    constants.MUSEUM_DICT.update({acr: server.museum_url(acr) for acr in acronyms})
+
+    import database  # pylint: disable=import-outside-toplevel
+
+    def command(*argv):
+        return lambda: database.main.main(list(argv), standalone_mode=False)
+
+    stages = []
+    for name, argv, path in [
+        ("fetch_jsons", ["fetch_jsons", "--mode", "async"], constants.DATA_RAW_JSONS),
+        ("fetch_images", ["fetch_images"], constants.DATA_RAW_IMAGES),
+        ("classify_jsons_by_thesaurus", ["classify_jsons_by_thesaurus"],
+         constants.DATA_INTERIM_TEXT),
+        ("classify_imgs_by_thesaurus", ["classify_imgs_by_thesaurus"],
+         constants.DATA_INTERIM_IMAGES),
+        ("classify_jsons_by_labels", ["classify_jsons_by_labels"],
+         constants.DATA_PROCD_TEXT),
+        ("classify_imgs_by_labels", ["classify_imgs_by_labels"],
+         constants.DATA_PROCD_IMAGES),
+        ("create_model_db", ["create_model_db"], constants.DATA_PROCD_MODEL),
+    ]:
+        timed(stages, name, command(*argv), lambda p=path: count_files(p))
+    server.stop()
+
+    return {"stages": stages, "server": server.stats}
+
+
+def bench_europeana(args, workdir):
+    """Drive the europeana collect_data harvest at the configured corpus size."""
+    os.environ.setdefault("EUROPEANA_API_KEY", "benchmark")
+    os.chdir(workdir)
+    sys.path.insert(0, EUROPEANA_DIR)
+    # pylint: disable=import-outside-toplevel
+    from helpers import constants
+    from europeana import api, downloader, state
+
+    server = StandInServer(
+        items=args.items,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    ).start()
+    search_url, record_url = europeana_urls(server)
+    values = {
+        "SEARCH_URL": search_url,
+        "RECORD_URL": record_url,
+        "DATA_DIR": workdir,
+    }
+    values.update({name: os.path.join(workdir, os.path.relpath(
+        getattr(constants, name), constants.DATA_DIR)) for name in EUROPEANA_PATHS
+        if hasattr(constants, name)})
+    for module in (constants, api, downloader, state):
+        for name, value in values.items():
+            if hasattr(module, name):
+                setattr(module, name, value)
+    os.makedirs(values["JSON_DIR"], exist_ok=True)
+    os.makedirs(values["LOGS_DIR"], exist_ok=True)
+    with open(values["CACHE_FILE"], "w", encoding="utf-8") as f:
+        f.write('{"downloaded_count": 0}')
+
+    stages = []
+    timed(
+        stages,
+        "collect_data",
+        lambda: downloader.collect_data(limit=None),
+        lambda: count_files(values["JSON_DIR"]),
+    )
+    server.stop()
+
+    return {"stages": stages, "server": server.stats}
+
+
+def worker(args):
+    """Run one target in this process and write its result."""
+    with tempfile.TemporaryDirectory(prefix=f"bench-{args.worker}-") as workdir:
+        bench = bench_ema if args.worker == "ema" else bench_europeana
+        result = bench(args, workdir)
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+
+
+def git_commit():
+    """Current commit of the repository, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, tolerance):
+    """List the stages whose throughput dropped more than the tolerance."""
+    regressions = []
+    for target, result in report["targets"].items():
+        previous = {
+            s["stage"]: s
+            for s in baseline.get("targets", {}).get(target, {}).get("stages", [])
+        }
+        for stage in result["stages"]:
+            old = previous.get(stage["stage"])
+            if not old or not old["items_per_sec"] or stage["items_per_sec"] is None:
+                continue
+            if stage["items_per_sec"] < old["items_per_sec"] * (1 - tolerance):
+                regressions.append(
+                    f"{target}.{stage['stage']}: {stage['items_per_sec']} items/s "
+                    f"(baseline {old['items_per_sec']} items/s)"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        choices=["ema", "europeana"],
+        default=["ema", "europeana"],
+        help="Projects to benchmark (default: both)",
+    )
+    parser.add_argument("--items", type=int, default=200,
+                        help="Items per museum and Europeana records (default: 200)")
+    parser.add_argument("--museums", type=int, default=17,
+                        help="Number of EMA museums served (default: 17)")
+    parser.add_argument("--images_per_item", type=int, default=2,
+                        help="Images referenced by each museum item (default: 2)")
+    parser.add_argument("--image_size", type=int, default=20000,
+                        help="Bytes of each synthetic image (default: 20000)")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds added to every response (default: 0)")
+    parser.add_argument("--error_rate", type=float, default=0.0,
+                        help="Share of requests answered with a 503 (default: 0)")
+    parser.add_argument("--throttle_rate", type=float, default=0.0,
+                        help="Share of Europeana requests answered with a 429 (default: 0)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the injected failures (default: 0)")
+    parser.add_argument("--ema_python", default=sys.executable,
+                        help="Interpreter with the ema dependencies")
+    parser.add_argument("--europeana_python", default=sys.executable,
+                        help="Interpreter with the europeana_db dependencies")
+    parser.add_argument("--output", default=REPORTS_DIR,
+                        help="Folder where the JSON report is written")
+    parser.add_argument("--baseline",
+                        help="Previous report to compare the throughput with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed throughput drop against the baseline (default: 0.2)")
+    parser.add_argument("--worker", choices=["ema", "europeana"], help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return 0
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("worker", "result", "output", "baseline")},
+        "targets": {},
+    }
+    forwarded = sys.argv[1:]
+    for target in args.targets:
+        print(f"🏁 Benchmarking {target}...", flush=True)
+        python = args.ema_python if target == "ema" else args.europeana_python
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_path = f.name
+        try:
+            subprocess.run(
+                [python, os.path.abspath(__file__), *forwarded,
+                 "--worker", target, "--result", result_path],
+                check=True,
+            )
+            with open(result_path, encoding="utf-8") as f:
+                report["targets"][target] = json.load(f)
+        finally:
+            os.remove(result_path)
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(
+        args.output, f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    print(f"📊 Report saved: {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"🚨 Regression: {regression}")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
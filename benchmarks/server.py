@@ -0,0 +1,309 @@
+"""Local stand-in for the Tainacan and Europeana APIs used by the crawlers."""
+import base64
+import json
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# 16x16 baseline JPEG, padded with comment segments up to the image size
+JPEG = base64.b64decode(
+    '/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9'
+    'PDkzODdASFxOQERXRTc4UG1RV19iZ2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhC'
+    'Y2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2P/wAAR'
+    'CAAQABADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAAAAECAwQFBgcICQoL/8QAtRAA'
+    'AgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAkM2JyggkK'
+    'FhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWG'
+    'h4iJipKTlJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl'
+    '5ufo6erx8vP09fb3+Pn6/8QAHwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREA'
+    'AgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdhcRMiMoEIFEKRobHBCSMzUvAVYnLRChYk'
+    'NOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hpanN0dXZ3eHl6goOE'
+    'hYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk'
+    '5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwDPooormOg//9k=')
+
+PROVIDERS = ['Provider A', 'Provider B', 'Provider C', 'Provider D']
+
+
+def synthetic_jpeg(size):
+    """Build a decodable JPEG of about `size` bytes."""
+    padding = bytearray()
+    missing = max(size - len(JPEG), 0)
+    while missing > 4:
+        chunk = min(missing - 4, 65533)
+        padding += b'\xff\xfe' + (chunk + 2).to_bytes(2, 'big') + b'\0' * chunk
+        missing -= chunk + 4
+    return JPEG[:2] + bytes(padding) + JPEG[2:]
+
+
+def nested(path, value):
+    """Build the dictionary that holds `value` at the key path."""
+    for key in reversed(path):
+        value = {key: value}
+    return value
+
+
+def merge(target, source):
+    """Merge nested dictionaries in place."""
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    HTTP server that mimics both APIs with a synthetic corpus.
+
+    Args:
+        museums: dictionary with the museum acronym and its `*_FIELDS`.
+        items: number of items per museum and of Europeana records.
+        labels: denominations cycled through the museum items.
+        latency: seconds added to every response.
+        error_rate: share of requests answered with a 503.
+        throttle_rate: share of Europeana requests answered with a 429.
+        image_size: bytes of every synthetic image.
+        images_per_item: images referenced by every museum item.
+        perpage: items per Tainacan page.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, museums=None, items=100, labels=('mesa', 'objeto'),
+                 latency=0.0, error_rate=0.0, throttle_rate=0.0,
+                 image_size=20000, images_per_item=2, perpage=96, seed=0):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.museums = museums or {}
+        self.items = items
+        self.labels = list(labels)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.image = synthetic_jpeg(image_size)
+        self.images_per_item = images_per_item
+        self.perpage = perpage
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.thread = None
+
+    @property
+    def url(self):
+        """Base url of the server."""
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def museum_url(self, acr):
+        """Paged items url of a museum, as the MUSEUM_DICT values."""
+        return (f'{self.url}/tainacan/{acr}/wp-json/tainacan/v2/collection/1/'
+                'items/?perpage=96&order=DESC&orderby=date&paged=')
+
+    def start(self):
+        """Serve on a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        self.shutdown()
+        self.server_close()
+
+    def count(self, route, key, value=1):
+        """Add to the statistics of a route."""
+        with self.lock:
+            stats = self.stats.setdefault(
+                route, {'requests': 0, 'bytes': 0, 'errors': 0,
+                        'throttled': 0, 'not_modified': 0})
+            stats[key] += value
+
+    def roll(self, rate):
+        """Draw an injected failure."""
+        with self.lock:
+            return self.random.random() < rate
+
+    # Tainacan
+
+    def museum_item(self, acr, item_id):
+        """Synthetic Tainacan item."""
+        fields = self.museums[acr]
+        day = 1 + item_id % 28
+        images = [f'{self.url}/images/{acr}_{item_id}_{i}.jpg'
+                  for i in range(self.images_per_item)]
+        item = {'id': item_id,
+                'creation_date': f'2020-{1 + item_id // 28 % 12:02d}-{day:02d}'
+                                 f'T{item_id % 24:02d}:00:00',
+                'title': f'Item {item_id}',
+                'document_type': 'attachment',
+                'document': '',
+                'thumbnail': {'full': [images[0], 1024, 768, False],
+                              'medium': [images[0].replace('.jpg', '-300x225.jpg'),
+                                         300, 225, True]},
+                'attachments': [{'url': url} for url in images[1:]]}
+        thesaurus = '05 - Objetos pessoais' if item_id % 2 else '02 - Outros'
+        denomination = self.labels[item_id % len(self.labels)]
+        for field, value in (('classification', thesaurus),
+                             ('denomination', denomination)):
+            if field in fields and fields[field] != ['title']:
+                merge(item, nested(fields[field], value))
+        return item
+
+    def tainacan(self, handler, acr, query):
+        """Answer a paged items request."""
+        total = max((self.items + self.perpage - 1) // self.perpage, 1)
+        etag = f'"{acr}-{self.items}"'
+        if handler.headers.get('If-None-Match') == etag:
+            self.count('tainacan', 'not_modified')
+            return handler.reply(304, b'', {'ETag': etag})
+        page = int(query.get('paged', ['1'])[0])
+        start = (page - 1) * self.perpage
+        ids = range(self.items - start, max(self.items - start - self.perpage, 0), -1)
+        body = json.dumps({'items': [self.museum_item(acr, i) for i in ids]})
+        return handler.reply(200, body.encode(), {
+            'Content-Type': 'application/json', 'ETag': etag,
+            'x-wp-total': str(self.items), 'x-wp-totalpages': str(total)})
+
+    # Europeana
+
+    def record_id(self, index):
+        """Europeana id of a record."""
+        return f'/bench/item_{index}'
+
+    def search_item(self, index, profile):
+        """Synthetic search result, richer with the rich profile."""
+        item = {'id': self.record_id(index), 'type': 'IMAGE',
+                'title': [f'Record {index}'],
+                'dataProvider': [PROVIDERS[index % len(PROVIDERS)]]}
+        if 'rich' in profile:
+            item.update({
+                'dcDescription': [f'Description of record {index}'],
+                'dcTypeLangAware': {'en': ['Furniture']},
+                'edmIsShownBy': [f'{self.url}/images/record_{index}.jpg']})
+        return item
+
+    def europeana_search(self, handler, query):
+        """Answer a cursor paged search request."""
+        if self.roll(self.throttle_rate):
+            self.count('europeana', 'throttled')
+            return handler.reply(429, b'{"error": "rate limit"}',
+                                 {'Retry-After': '1'})
+        indexes = range(self.items)
+        for qf in query.get('qf', []):
+            name, _, value = qf.partition(':')
+            if name == 'DATA_PROVIDER':
+                value = value.strip('"')
+                indexes = [i for i in indexes
+                           if PROVIDERS[i % len(PROVIDERS)] == value]
+        indexes = list(indexes)
+        data = {'success': True, 'totalResults': len(indexes)}
+        if 'facet' in query or 'facets' in query.get('profile', [''])[0]:
+            data['facets'] = [{'name': 'DATA_PROVIDER', 'fields': [
+                {'label': p, 'count': sum(1 for i in range(self.items)
+                                          if PROVIDERS[i % len(PROVIDERS)] == p)}
+                for p in PROVIDERS]}]
+        rows = int(query.get('rows', ['12'])[0])
+        cursor = query.get('cursor', ['*'])[0]
+        offset = 0 if cursor in ('*', 'None') else int(cursor[1:])
+        profile = query.get('profile', [''])[0]
+        data['items'] = [self.search_item(i, profile)
+                         for i in indexes[offset:offset + rows]]
+        data['itemsCount'] = len(data['items'])
+        if offset + rows < len(indexes):
+            data['nextCursor'] = f'c{offset + rows}'
+        return handler.reply(200, json.dumps(data).encode(),
+                             {'Content-Type': 'application/json'})
+
+    def europeana_record(self, handler, record):
+        """Answer a record request."""
+        if self.roll(self.throttle_rate):
+            self.count('europeana', 'throttled')
+            return handler.reply(429, b'{"error": "rate limit"}',
+                                 {'Retry-After': '1'})
+        index = int(record.rsplit('_', 1)[-1])
+        data = {'success': True, 'object': {
+            'about': record,
+            'proxies': [{'dcType': {'en': ['Furniture']},
+                         'dcTitle': {'en': [f'Record {index}']}}],
+            'aggregations': [{
+                'edmIsShownBy': f'{self.url}/images/record_{index}.jpg',
+                'webResources': [{'about': f'{self.url}/images/record_{index}.jpg'}]}]}}
+        return handler.reply(200, json.dumps(data).encode(),
+                             {'Content-Type': 'application/json'})
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Route the requests to the stand-in server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        """Disable Nagle, headers and body are written separately."""
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Keep the benchmark output clean."""
+
+    def reply(self, status, body, headers=None):
+        """Send a response."""
+        route = self.path.split('/')[1]
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.server.count(route, 'requests')
+        self.server.count(route, 'bytes', len(body))
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Answer as GET without the body."""
+        self.do_GET()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Dispatch by path."""
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.split('/') if p]
+        query = parse_qs(url.query)
+        if server.roll(server.error_rate):
+            server.count(parts[0] if parts else '', 'errors')
+            self.reply(503, b'', {'Retry-After': '0'})
+        elif parts[:1] == ['tainacan'] and parts[1] in server.museums:
+            server.tainacan(self, parts[1], query)
+        elif parts[:1] == ['images']:
+            self.image(server.image)
+        elif parts[:2] == ['europeana', 'record'] and parts[-1] == 'search.json':
+            server.europeana_search(self, query)
+        elif parts[:2] == ['europeana', 'record']:
+            server.europeana_record(self, '/' + '/'.join(parts[2:])[:-len('.json')])
+        else:
+            self.reply(404, b'')
+
+    def image(self, body):
+        """Answer an image, honouring a Range request."""
+        start = 0
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes='):
+            start = int(byte_range[6:].split('-')[0] or 0)
+        if start:
+            self.reply(206, body[start:], {
+                'Content-Type': 'image/jpeg',
+                'Content-Range': f'bytes {start}-{len(body) - 1}/{len(body)}'})
+        else:
+            self.reply(200, body, {'Content-Type': 'image/jpeg',
+                                   'Accept-Ranges': 'bytes'})
+
+
+def europeana_urls(server):
+    """Search and record urls, as SEARCH_URL and RECORD_URL."""
+    return (f'{server.url}/europeana/record/v2/search.json',
+            f'{server.url}/europeana/record')
+
+
@@ -1,21 +1,58 @@
 """Creates the project database."""
 
-from os.path import isdir
-from os import listdir, makedirs
-from posixpath import join
-from difPy import dif
+from functools import partial
+from json import dump
+from os.path import isdir, isfile, join
+from os import makedirs
 import click
 
-from modules.classify_jsons import allocate, allocate_img, through_labels
+from modules.classify_jsons import (allocate, build_model_db, in_model_db,
+                                    texts_in_model_db, through_labels)
 from modules.jsons_fetcher import get_jsons
-from modules.images_fetcher import get_images
+from modules.images_fetcher import (check_numbering, get_images, iterate_all,
+                                    renumber, renumbering)
 from modules.classify_images import classify_images
+from modules import catalogue, shards_exporter
+from modules.streaming import stream
 from helpers.auxiliar import read_files
+from helpers import blobstore, packstore, transport
+from helpers.dedup import (ALGORITHMS, find_duplicates, label_folders,
+                           remove_duplicates)
+from helpers.pipeline import Pipeline, Stage
 from helpers.constants import (DATA_INTERIM_IMAGES, DATA_PROCD_MODEL,
                                DATA_RAW_JSONS, DATA_RAW_IMAGES,
                                DATA_INTERIM_TEXT, DATA_PROCD_TEXT,
                                DATA_PROCD_IMAGES, TARGET_LABELS, TESAURO,
-                               TL_JOINED)
+                               TL_JOINED, MAX_CONNECTIONS,
+                               MAX_CONNECTIONS_PER_HOST, IMAGE_WORKERS,
+                               LINK_MODE, LINK_MODES, CLASSIFY_WORKERS,
+                               PACKED, VERIFY_IMAGES, WORKSPACE,
+                               DATA_EXPORT, EXPORT_FORMATS, EXPORT_SIZE,
+                               SHARD_SAMPLES, SPLIT_TEST, SPLIT_VAL,
+                               MUSEUM_DICT, IMAGES_NUMBERING)
+
+
+IMAGES_FILTERS = ['all', 'model', 'backfill']
+
+
+def images_keep(images_filter: str, catalogued: bool = False,
+                **predicates):
+    """
+    Get the function that selects the items whose images are downloaded.
+
+    Args:
+        images_filter: one of IMAGES_FILTERS.
+        catalogued: get a function of the catalogued texts of an item, as
+        catalogue.missing_images takes, instead of its file name and JSON.
+        predicates: thesauro, field and labels given to in_model_db.
+    """
+    model = partial(texts_in_model_db if catalogued else in_model_db,
+                    **predicates)
+    if images_filter == 'model':
+        return model
+    if images_filter == 'backfill':
+        return lambda *item: not model(*item)
+    return None
 
 
 class NaturalOrderGroup(click.Group):
@@ -28,35 +65,122 @@ class NaturalOrderGroup(click.Group):
 
 
 @click.group(cls=NaturalOrderGroup)
-def main():
+@click.option('--timeout', '-T',
+              type=float,
+              default=None,
+              help='Seconds to wait for a museum server before retrying.')
+@click.option('--link_mode', '-L',
+              type=click.Choice(LINK_MODES),
+              default=LINK_MODE,
+              help='How the classified files are placed from the blob store.')
+@click.option('--packed', '-P',
+              is_flag=True,
+              default=PACKED,
+              help='Save the fetched JSON items in compressed shards per museum.')
+def main(timeout, link_mode, packed):
     """Create database."""
+    transport.configure(timeout=timeout)
+    blobstore.configure(mode=link_mode)
+    packstore.configure(packed=packed)
 
 
 @main.command('fetch_jsons')
-def fetch_jsons():
+@click.option('--mode', '-m',
+              type=click.Choice(['sequential', 'async']),
+              default='sequential',
+              help='Fetch one page at a time or many museums at once.')
+@click.option('--max_connections', '-c',
+              default=MAX_CONNECTIONS,
+              help='Maximum number of requests in flight on async mode.')
+@click.option('--max_per_host', '-p',
+              default=MAX_CONNECTIONS_PER_HOST,
+              help='Maximum number of requests in flight per host on async mode.')
+@click.option('--incremental', '-i',
+              is_flag=True,
+              help='Download only the items added since the last refresh.')
+def fetch_jsons(mode, max_connections, max_per_host, incremental):
     """Download JSON files from museum's web page."""
     print("Downloading JSON files...")
-    get_jsons()
+    get_jsons(mode == 'async', max_connections, max_per_host, incremental)
+    catalogue.ingest(DATA_RAW_JSONS)
     print(f"JSON files download has been completed - # files: {len(read_files(DATA_RAW_JSONS))} .\n")
 
 
+@main.command('export_jsons')
+@click.option('--dest', '-d',
+              default=DATA_RAW_JSONS,
+              help='Folder where the packed items are written as JSON files.')
+def export_jsons(dest):
+    """Write the packed JSON items as one file per item."""
+    print("Exporting packed JSON files...")
+    count = packstore.export(DATA_RAW_JSONS, dest)
+    print(f"JSON files export has been completed - # files: {count} .\n")
+
+
 @main.command('fetch_images')
-def fetch_images():
+@click.option('--workers', '-w',
+              default=IMAGE_WORKERS,
+              help='Number of simultaneous image transfers.')
+@click.option('--verify', '-v',
+              is_flag=True,
+              default=VERIFY_IMAGES,
+              help='Keep only the images that can be decoded, the saved ones too.')
+@click.option('--filter', '-F', 'images_filter',
+              type=click.Choice(IMAGES_FILTERS),
+              default='all',
+              help='Download the images of all items, only of the ones that can end up in the model database, or only of the others.')
+def fetch_images(workers, verify, images_filter):
     """
     Download images from museum's web page.
 
     The images comes from each museum based on the URLs at the
-    downloaded JSON files.
+    downloaded JSON files. Each image is downloaded to a partial file and
+    renamed when complete, the interrupted ones are resumed by the next run.
+    The model filter checks the thesaurus and labels of each JSON first and
+    the backfill one downloads the rest later.
     """
     print("Downloading images...")
-    get_images()
+    get_images(workers, verify, images_keep(images_filter))
     print("Images download has been completed successifully.\n")
 
 
+@main.command('renumber_images')
+@click.option('--yes', '-y',
+              is_flag=True,
+              help='Remove the images that cannot be renamed without asking.')
+def renumber_images(yes):
+    """
+    Rename the images saved with the numbering of older versions.
+
+    The older versions numbered the images of an item in an order that
+    changed between runs. Each saved image is mapped to its url, by the
+    extension or the thumbnail dimensions, and renamed to the stable number
+    of that url in the raw, interim, processed and model database folders.
+    The images that cannot be mapped, and the smaller thumbnail sizes, are
+    removed only after confirmation, and downloaded again by fetch_images.
+    """
+    if isfile(IMAGES_NUMBERING):
+        print("The images already follow the stable numbering.\n")
+        return
+    renames, stale = renumbering(DATA_RAW_JSONS, DATA_RAW_IMAGES)
+    print(f'{len(renames)} images will be renamed and {len(stale)} '
+          'cannot be mapped to a stable number.')
+    if stale and not yes and not click.confirm(
+            f'Will remove {len(stale)} images from every folder they were '
+            'placed in. Would you like to continue?', default=False):
+        print("Nothing has been changed.\n")
+        return
+    renumber(renames, stale, DATA_RAW_IMAGES)
+    print("Images renumbering has been completed successifully.\n")
+
+
 @main.command('classify_jsons_by_thesaurus')
 @click.option('--thesauro', '-t', type=click.Choice(TESAURO), default='05')
+@click.option('--workers', '-w',
+              help='Number of processes parsing the JSON files.',
+              default=CLASSIFY_WORKERS)
 @click.pass_context
-def classify_jsons_by_thesaurus(ctx, thesauro):
+def classify_jsons_by_thesaurus(ctx, thesauro, workers):
     """
     Classify JSON files that matches the thesaurus type.
 
@@ -67,7 +191,9 @@ def classify_jsons_by_thesaurus(ctx, thesauro):
         ctx.invoke(fetch_jsons)
     try:
         print(f"Classifying JSON files by thesaurus {thesauro}...")
-        allocate(thesauro, 'classification', DATA_RAW_JSONS, DATA_INTERIM_TEXT)
+        catalogue.ingest(DATA_RAW_JSONS)
+        allocate(thesauro, 'classification', DATA_RAW_JSONS, DATA_INTERIM_TEXT,
+                 workers=workers)
         print(f"JSON files classification by thesaurus {thesauro} has been completed successifully.\n")
     except FileNotFoundError:
         print("There's no data to parse.\n")
@@ -98,8 +224,11 @@ def classify_imgs_by_thesaurus(ctx):
 @click.option('--field', '-f',
               default='denomination',
               help='Field containing the target text to compare with target labels.')
+@click.option('--workers', '-w',
+              help='Number of processes parsing the JSON files.',
+              default=CLASSIFY_WORKERS)
 @click.pass_context
-def classify_jsons_by_labels(ctx, label_list, field):
+def classify_jsons_by_labels(ctx, label_list, field, workers):
     """
     Classifies the interim JSON files accordingly to the labels list.
 
@@ -110,7 +239,7 @@ def classify_jsons_by_labels(ctx, label_list, field):
         ctx.invoke(classify_jsons_by_thesaurus)
     try:
         print("Classifying JSON files by labels...")
-        through_labels(label_list, field)
+        through_labels(label_list, field, workers)
         print("JSON files classification by labels has been completed successifully.\n")
     except FileNotFoundError:
         print("There's no data to parse.\n")
@@ -143,31 +272,101 @@ def classify_imgs_by_labels(ctx):
 
 
 @main.command('duplicate_remover')
-@click.option('--rm_path', '-d', 
+@click.option('--rm_path', '-d',
               help='Path of the directory containing folders with the duplicated images',
               default=DATA_PROCD_MODEL)
-def duplicate_remover(rm_path):
+@click.option('--scope', '-s',
+              type=click.Choice(['label', 'all']),
+              default='label',
+              help='Search duplicates within each label folder or across all of them.')
+@click.option('--threshold', '-t',
+              default=4,
+              help='Maximum Hamming distance of two duplicated images.')
+@click.option('--algorithm', '-a',
+              type=click.Choice(ALGORITHMS),
+              default='phash',
+              help='Perceptual hash used to compare the images.')
+@click.option('--action',
+              type=click.Choice(['report', 'delete', 'hardlink']),
+              default='report',
+              help='Only report the duplicates, delete them or replace them by a link.')
+@click.option('--workers', '-w',
+              help='Number of processes hashing the images.',
+              default=CLASSIFY_WORKERS)
+def duplicate_remover(rm_path, scope, threshold, algorithm, action, workers):
     """
     Remove duplicated images on a specified folder.
 
+    The images are compared by perceptual hash, cached by content, and the
+    duplicates are written to workspace/duplicates.json. They are only
+    reported unless another action is given.
     Args:
-        rm_path: directory containing all labeled folders with the processed 
+        rm_path: directory containing all labeled folders with the processed
         images with possible duplicated ones, in data/processed/modeldb.
     """
     if isdir(rm_path):
-        for folder in listdir(rm_path):
-            if click.confirm(
-                    'Will remove all duplicated images. Would you like to continue?',
-                    default=True):
-                print('Removing duplicated images...')
-                dif(folder, delete=True)  # pylint: disable=no-member
-                print('Duplicated images have been removed successifully.\n')
+        print('Searching duplicated images...')
+        duplicates = find_duplicates(label_folders(rm_path, scope), threshold,
+                                     algorithm, workers)
+        makedirs(WORKSPACE, exist_ok=True)
+        with open(join(WORKSPACE, 'duplicates.json'), 'w', encoding='utf-8') as f:
+            dump(duplicates, f, indent=4)
+        print(f'{len(duplicates)} duplicated images found.')
+        if duplicates and action != 'report' and click.confirm(
+                f'Will {action} all duplicated images. Would you like to continue?',
+                default=True):
+            print('Removing duplicated images...')
+            remove_duplicates(duplicates, action)
+            print('Duplicated images have been removed successifully.\n')
     else:
         print(
             'Target folder does not exist.'
             'Make the database download and preprocessing first.\n')
 
 
+@main.command('export_shards')
+@click.option('--format', '-F', 'fmt',
+              type=click.Choice(EXPORT_FORMATS),
+              default='webdataset',
+              help='WebDataset tar shards or memory-mapped uint8 arrays.')
+@click.option('--dest', '-d',
+              default=DATA_EXPORT,
+              help='Folder where the shards are written.')
+@click.option('--size', '-s',
+              default=EXPORT_SIZE,
+              help='Side of the square images, in pixels.')
+@click.option('--shard_samples',
+              default=SHARD_SAMPLES,
+              help='Number of images of each tar shard.')
+@click.option('--val',
+              default=SPLIT_VAL,
+              help='Share of the items in the validation split.')
+@click.option('--test',
+              default=SPLIT_TEST,
+              help='Share of the items in the test split.')
+@click.option('--workers', '-w',
+              help='Number of processes preparing the images.',
+              default=CLASSIFY_WORKERS)
+def export_shards(fmt, dest, size, shard_samples, val, test, workers):
+    """
+    Export the model database as training shards.
+
+    The images of data/processed/modeldb are resized and written with their
+    label ids and captions, split in train, val and test by the hash of
+    their item id.
+    """
+    if not isdir(DATA_PROCD_MODEL):
+        print("There's no model database to export.\n")
+        return
+    print(f"Exporting the model database as {fmt} shards...")
+    meta = shards_exporter.export(fmt, dest, DATA_PROCD_MODEL, {
+        'size': size, 'shard_samples': shard_samples, 'val': val,
+        'test': test, 'workers': workers})
+    splits = ', '.join(f"{split}: {info['samples']}"
+                       for split, info in meta['splits'].items())
+    print(f"Shards export has been completed - {splits} .\n")
+
+
 @main.command('create_model_db')
 @click.option('--labels', '-j',
               help='List of labels that will be the classified folders.',
@@ -176,50 +375,122 @@ def duplicate_remover(rm_path):
 @click.option('--field', '-f',
               help='Text field to compare with the target labels.',
               default='denomination')
-@click.pass_context
-def create_model_db(ctx, labels, field):
+@click.option('--workers', '-w',
+              help='Number of processes parsing the JSON files.',
+              default=CLASSIFY_WORKERS)
+@click.option('--remove_duplicates', '-r', 'dedup',
+              is_flag=True,
+              help='Delete the near-duplicate images of each label folder at the end.')
+@click.option('--mode', '-m',
+              type=click.Choice(['staged', 'streaming']),
+              default='staged',
+              help='Run the stages one after another or all at once per item.')
+@click.option('--filter', '-F', 'images_filter',
+              type=click.Choice(IMAGES_FILTERS[:2]),
+              default='all',
+              help='Download the images of all items or only of the ones that can end up in the model database.')
+def create_model_db(labels, field, workers, dedup, mode, images_filter):
     """
     Model database creation by each folder label.
 
-    Aims to create the database input version for the model.
+    Aims to create the database input version for the model. The stages run
+    in dependency order, the independent ones at the same time, and a stage
+    is skipped when its inputs did not change since its last complete run.
+    The JSON files are always fetched again, incrementally, and the images
+    that failed before are retried.
+    On streaming mode every item is classified and its images downloaded as
+    soon as it is fetched, see modules.streaming.
     """
     print("-----------------------------------------------------------------------")
     print("-                    Building the whole database                      -")
     print("-----------------------------------------------------------------------\n")
-    if not isdir(DATA_RAW_JSONS):
-        makedirs(DATA_RAW_JSONS, exist_ok=True)
-        ctx.invoke(fetch_jsons)
-    if not isdir(DATA_INTERIM_TEXT):
-        makedirs(DATA_INTERIM_TEXT, exist_ok=True)
-        ctx.invoke(classify_jsons_by_labels)
-    if not isdir(DATA_INTERIM_IMAGES):
-        makedirs(DATA_INTERIM_IMAGES, exist_ok=True)
-        ctx.invoke(classify_imgs_by_labels)
-    if not isdir(DATA_PROCD_TEXT):
-        makedirs(DATA_PROCD_TEXT, exist_ok=True)
-        ctx.invoke(classify_jsons_by_labels)
-    if not isdir(DATA_PROCD_IMAGES):
-        makedirs(DATA_PROCD_IMAGES, exist_ok=True)
-        print("Classifying images by labels...")
-        classify_images(DATA_RAW_IMAGES, DATA_PROCD_TEXT, DATA_PROCD_IMAGES)
-        print("Images classification by labels has been completed successifully.\n")
-    if not isdir(DATA_PROCD_MODEL):
-        makedirs(DATA_PROCD_MODEL, exist_ok=True)
-        print("Creating the images database by folders...")
-        for item in labels:
-            dest_folder = join(DATA_PROCD_MODEL, item[1])
-            if not isdir(dest_folder):
-                makedirs(dest_folder, exist_ok=True)
-            allocate_img(item[0], field, DATA_PROCD_TEXT, DATA_PROCD_IMAGES, dest_folder)
-        print("Images database by folders has been created successifully.\n")
-    else:
-        print('Processed model database already exists.')
-
-    print('Removing duplicated images...')
-    ctx.invoke(classify_jsons_by_labels)
-    print('Duplicated images has been removed successifully.')
+    thesauro = TESAURO[0]
+    keep, keep_catalogued = (
+        images_keep(images_filter, catalogued, thesauro=thesauro, field=field,
+                    labels=labels)
+        for catalogued in (False, True))
+
+    def jsons_run():
+        get_jsons()
+        catalogue.ingest(DATA_RAW_JSONS)
+
+    def jsons_update(_):
+        get_jsons(incremental=True)
+        catalogue.ingest(DATA_RAW_JSONS)
+
+    def images_update(changed):
+        files = set(changed[DATA_RAW_JSONS])
+        files.update(catalogue.missing_images(DATA_RAW_IMAGES,
+                                              keep_catalogued))
+        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES, files=sorted(files),
+                    keep=keep)
+
+    def dedup_run():
+        remove_duplicates(find_duplicates(label_folders(DATA_PROCD_MODEL),
+                                          workers=workers))
+
+    if mode == 'streaming':
+        check_numbering(DATA_RAW_IMAGES)
+        stream(MUSEUM_DICT, {'thesauro': thesauro, 'field': field,
+                             'labels': labels},
+               {'only_model': images_filter == 'model'})
+        catalogue.ingest(DATA_RAW_JSONS)
+        if dedup:
+            dedup_run()
+        print("DONE: Database has been completed successifully.\n")
+        return
+
+    model_folders = sorted({join(DATA_PROCD_MODEL, folder)
+                            for _, folder in labels})
+    stages = [
+        Stage('fetch_jsons', jsons_run,
+              outputs=[DATA_RAW_JSONS], update=jsons_update),
+        Stage('classify_jsons_by_thesaurus',
+              lambda: allocate(thesauro, 'classification', DATA_RAW_JSONS,
+                               DATA_INTERIM_TEXT, workers=workers),
+              inputs=[DATA_RAW_JSONS], outputs=[DATA_INTERIM_TEXT],
+              params={'thesauro': thesauro},
+              update=lambda changed: allocate(
+                  thesauro, 'classification', DATA_RAW_JSONS,
+                  DATA_INTERIM_TEXT, changed[DATA_RAW_JSONS], workers)),
+        Stage('fetch_images',
+              lambda: iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES, keep=keep),
+              inputs=[DATA_RAW_JSONS], outputs=[DATA_RAW_IMAGES],
+              update=images_update,
+              pending=lambda: bool(catalogue.missing_images(
+                  DATA_RAW_IMAGES, keep_catalogued)),
+              params={'filter': images_filter, 'field': field,
+                      'labels': labels}),
+        Stage('classify_imgs_by_thesaurus',
+              lambda: classify_images(DATA_RAW_IMAGES, DATA_INTERIM_TEXT,
+                                      DATA_INTERIM_IMAGES),
+              inputs=[DATA_RAW_IMAGES, DATA_INTERIM_TEXT],
+              outputs=[DATA_INTERIM_IMAGES]),
+        Stage('classify_jsons_by_labels',
+              lambda: through_labels(TARGET_LABELS, field, workers),
+              inputs=[DATA_INTERIM_TEXT], outputs=[DATA_PROCD_TEXT],
+              params={'field': field}),
+        Stage('classify_imgs_by_labels',
+              lambda: classify_images(DATA_RAW_IMAGES, DATA_PROCD_TEXT,
+                                      DATA_PROCD_IMAGES),
+              inputs=[DATA_RAW_IMAGES, DATA_PROCD_TEXT],
+              outputs=[DATA_PROCD_IMAGES]),
+        Stage('create_model_db',
+              lambda: build_model_db(labels, field, DATA_PROCD_TEXT,
+                                     DATA_PROCD_IMAGES, DATA_PROCD_MODEL,
+                                     workers),
+              inputs=[DATA_PROCD_TEXT, DATA_PROCD_IMAGES],
+              outputs=model_folders,
+              params={'field': field, 'labels': labels})
+        ]
+
+    if dedup:
+        stages.append(Stage('duplicate_remover', dedup_run,
+                            inputs=model_folders, outputs=model_folders))
+    Pipeline(stages).run()
 
     print("DONE: Database has been completed successifully.\n")
 
+
 if __name__ == '__main__':
     main()  # pylint: disable=no-value-for-parameter
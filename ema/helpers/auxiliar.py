@@ -1,23 +1,65 @@
 """Auxiliar functions."""
-from json import load
-from os.path import isdir, isfile, join
+from concurrent.futures import ThreadPoolExecutor
+from json import dump, load, loads
+from os.path import dirname, isdir, isfile, join, split
 from os import listdir, makedirs
-from shutil import copy
-from requests import get
-from difPy import dif
+from time import time
+from helpers import blobstore, packstore, transport
+from helpers.dedup import find_duplicates, remove_duplicates
+from helpers.constants import MAX_CONNECTIONS, PAGES_CACHE, PAGES_CACHE_TTL
 
-def pages(museum_dict) -> int:
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def __probe(url):
+    return transport.get(f'{url}1')
+
+
+def pages(museum_dict, first_pages=None, ttl=PAGES_CACHE_TTL) -> dict:
     """
     Get the total number of pages for each museum.
 
+    The first page of every museum is requested at once and the totals are
+    cached for `ttl` seconds, so the repeated calls do not probe the sites.
     Args:
         museum_dict: a dictionary with the Museum acronym and base url.
+        first_pages: dictionary that receives the items of the first page of
+        each probed museum, so it does not need to be downloaded again.
+        ttl: seconds a cached total is valid.
     """
+    cache = {}
+    if isfile(PAGES_CACHE):
+        with open(PAGES_CACHE, encoding='utf-8') as f:
+            cache = load(f)
+    now = time()
     total_pages = {}
+    missing = {}
     for acr, url in museum_dict.items():
-        first_response = get(f'{url}1')
-        num_pages = first_response.headers['x-wp-totalpages']
-        total_pages[acr] = num_pages
+        cached = cache.get(acr, {})
+        if cached.get('url') == url and now - cached.get('time', 0) < ttl:
+            total_pages[acr] = cached['total']
+        else:
+            missing[acr] = url
+
+    with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+        responses = executor.map(__probe, missing.values())
+        for (acr, url), first_response in zip(missing.items(), responses):
+            assert first_response is not None and \
+                    first_response.status_code == 200, (
+                            f"Não foi possível acessar o acervo {acr} - {url}1")
+            num_pages = first_response.headers['x-wp-totalpages']
+            total_pages[acr] = num_pages
+            cache[acr] = {'url': url, 'total': num_pages, 'time': now}
+            if first_pages is not None:
+                first_pages[acr] = first_response.json()['items']
+
+    if missing:
+        makedirs(dirname(PAGES_CACHE), exist_ok=True)
+        with open(PAGES_CACHE, 'w', encoding='utf-8') as f:
+            dump(cache, f, indent=4)
 
     return total_pages
 
@@ -26,10 +68,15 @@ def read_files(path: str) -> list:
     """
     Read all files in a directory.
 
+    The items of the packed shards are listed as files too, see
+    helpers.packstore.
     Args:
         path: directory where the files are located.
     """
-    files = [f for f in listdir(path) if isfile(join(path, f))]
+    files = [f for f in listdir(path)
+             if isfile(join(path, f)) and not packstore.is_pack_file(f)]
+    loose = set(files)
+    files.extend(f for f in packstore.names(path) if f not in loose)
 
     return files
 
@@ -38,6 +85,8 @@ def copy_files(file, dest):
     """
     Copy a file to a specified folder.
 
+    The file is materialized from the blob store with the configured link
+    mode, see helpers.blobstore. A packed item is exported as a JSON file.
     Args:
         file: origin file.
         dest: destination folder that the file will be placed.
@@ -45,19 +94,35 @@ def copy_files(file, dest):
     if not isdir(dest):
         makedirs(dest, exist_ok=True)
 
-    copy(file, dest)
+    folder, name = split(file)
+    if not isfile(file) and packstore.contains(folder, name):
+        packstore.export(folder, dest, [name])
+    else:
+        blobstore.materialize(file, dest)
 
 
 def load_json(jsons_path: str, file_name: str):
     """Load a JSON file.
 
+    The file is decoded with orjson when it is installed, and with the json
+    module when it is not or cannot decode the file. A file missing from the
+    path is read from the packed shards.
     Args:
         jsons_path: the path os jsons.
         file_name: name of the file that will be loaded.
     """
     file_path = join(jsons_path, file_name)
-    with open(file_path, encoding='utf-8') as f:
-        data = load(f)
+    if not isfile(file_path) and packstore.contains(jsons_path, file_name):
+        raw = packstore.read(jsons_path, file_name)
+    else:
+        with open(file_path, 'rb') as f:
+            raw = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    data = loads(raw.decode('utf-8'))
 
     return data
 
@@ -104,9 +169,12 @@ def check_bad_words(bw_dict, label, target_string):
 
 def remove_duplicated_img(images_path):
     """
-    Remove duplicated images via mean square error.
+    Remove duplicated images via perceptual hash.
 
     Args:
         images_path: path of the folder containing all images.
     """
-    dif.compare_images(images_path, delete=True)
+    duplicates = find_duplicates([[images_path]])
+    remove_duplicates(duplicates)
+
+    return duplicates
@@ -0,0 +1,146 @@
+"""Content-addressed store for the files placed by the classification stages."""
+from hashlib import sha256
+import os
+import threading
+from uuid import uuid4
+from os.path import basename, exists, join, lexists, relpath, samefile
+from shutil import copy, copyfile
+from helpers.constants import CHUNK_SIZE, DATA_BLOBS, LINK_MODE, LINK_MODES
+
+# ioctl request of linux to clone a file, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+SETTINGS = {'mode': LINK_MODE}
+
+_HASHES = {}
+
+
+def configure(mode=None):
+    """
+    Change how the files are materialized.
+
+    Args:
+        mode: one of LINK_MODES.
+    """
+    if mode is not None:
+        assert mode in LINK_MODES, f'Unknown link mode {mode}'
+        SETTINGS['mode'] = mode
+
+
+def file_hash(path: str) -> str:
+    """
+    Get the sha256 of a file.
+
+    The hash is remembered by inode, so the links of a file already stored
+    are not read again.
+    Args:
+        path: file to be hashed.
+    """
+    st = os.stat(path)
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    if key not in _HASHES:
+        digest = sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        _HASHES[key] = digest.hexdigest()
+
+    return _HASHES[key]
+
+
+def blob_path(digest: str) -> str:
+    """
+    Get the path of a blob in the store.
+
+    Args:
+        digest: sha256 of the blob content.
+    """
+    return join(DATA_BLOBS, digest[:2], digest[2:])
+
+
+def put(path: str) -> str:
+    """
+    Add a file to the store and return its blob path.
+
+    The file is hardlinked into the store when possible and copied
+    otherwise. A blob that already exists is kept as it is. Every call
+    writes to its own temporary name, so concurrent puts of the same
+    content from threads or processes do not clash; the one that loses
+    the rename keeps the blob the other placed.
+    Args:
+        path: file to be stored.
+    """
+    blob = blob_path(file_hash(path))
+    if exists(blob):
+        return blob
+
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    tmp = f'{blob}.{os.getpid()}.{threading.get_ident()}.{uuid4().hex}.tmp'
+    try:
+        try:
+            os.link(path, tmp)
+        except OSError:
+            copyfile(path, tmp)
+        os.replace(tmp, blob)
+    except OSError:
+        if not exists(blob):
+            raise
+    finally:
+        if lexists(tmp):
+            os.remove(tmp)
+
+    return blob
+
+
+def reflink(src: str, dest: str):
+    """
+    Clone a file sharing its blocks, on filesystems that support it.
+
+    Args:
+        src: origin file.
+        dest: file that will be created.
+    """
+    import fcntl  # pylint: disable=import-outside-toplevel
+    with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdest.close()
+            os.remove(dest)
+            raise
+
+
+def materialize(path: str, dest: str, mode: str = None) -> str:
+    """
+    Place a file in a folder through the blob store.
+
+    The file is stored by its content hash and the destination links to the
+    blob, so the stages do not hold one copy of the same bytes each. It falls
+    back to a plain copy when the link cannot be made.
+    Args:
+        path: origin file.
+        dest: destination folder that the file will be placed.
+        mode: one of LINK_MODES, the configured one by default.
+    """
+    mode = mode or SETTINGS['mode']
+    target = join(dest, basename(path))
+    if lexists(target):
+        if exists(target) and samefile(path, target):
+            return target
+        os.remove(target)
+    if mode == 'copy':
+        copy(path, target)
+        return target
+
+    blob = put(path)
+    try:
+        if mode == 'hardlink':
+            os.link(blob, target)
+        elif mode == 'reflink':
+            reflink(blob, target)
+        else:
+            os.symlink(relpath(blob, dest), target)
+    except (OSError, ImportError):
+        copy(blob, target)
+
+    return target
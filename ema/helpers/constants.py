@@ -1,5 +1,5 @@
 """Constants for the project."""
-from os import getcwd, path
+from os import cpu_count, getcwd, path
 from os.path import join
 
 PATH = path.abspath(getcwd())
@@ -15,9 +15,65 @@ DATA_PROCD = join(DATA, 'processed')
 DATA_PROCD_TEXT = join(DATA_PROCD, 'jsons')
 DATA_PROCD_IMAGES = join(DATA_PROCD, 'images')
 DATA_PROCD_MODEL = join(DATA_PROCD, 'modeldb')
+DATA_BLOBS = join(DATA, 'blobs')
+DATA_CATALOGUE = join(DATA, 'catalogue.sqlite')
+PHASH_CACHE = join(DATA, 'phash_cache.json')
+DATA_MANIFESTS = join(DATA, 'manifests')
+DATA_EXPORT = join(DATA, 'export')
+HARVEST_STATE = join(DATA_RAW, 'harvest_state.json')
+PAGES_CACHE = join(DATA_RAW, 'pages_cache.json')
+IMAGES_NUMBERING = join(DATA_RAW, 'images_numbering')
 
 TESAURO = ['05']
 
+# concurrency caps for the asynchronous harvester
+MAX_CONNECTIONS = 16
+MAX_CONNECTIONS_PER_HOST = 4
+
+# shared HTTP transport: timeout in seconds as (connect, read), number of
+# retries and the exponential backoff base and ceiling in seconds
+REQUEST_TIMEOUT = (10, 60)
+REQUEST_RETRIES = 10
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+
+# seconds the number of pages of a museum is reused before probing again
+PAGES_CACHE_TTL = 24 * 60 * 60
+
+# how the classification stages place their files: the blob is linked with
+# a hardlink, a reflink (copy-on-write clone) or a symlink, or copied
+LINK_MODES = ['hardlink', 'reflink', 'symlink', 'copy']
+LINK_MODE = 'hardlink'
+
+# items and images waiting between the stages of the streaming mode
+STREAM_QUEUE = 256
+
+# processes used by the classification stages
+CLASSIFY_WORKERS = cpu_count() or 1
+# JSON files parsed by a process at a time
+CLASSIFY_CHUNK = 256
+
+# packed storage of the raw JSON files
+PACKED = False
+PACK_LEVEL = 3
+
+# image download engine
+IMAGE_WORKERS = 16
+CHUNK_SIZE = 64 * 1024
+# decode every downloaded image before keeping it
+VERIFY_IMAGES = False
+# suffix of the images still being downloaded
+PART_EXT = '.part'
+
+# training shards: formats, side of the square images, samples per tar
+# shard, JPEG quality of the tar shards and validation and test shares
+EXPORT_FORMATS = ['webdataset', 'memmap']
+EXPORT_SIZE = 224
+SHARD_SAMPLES = 1000
+JPEG_QUALITY = 90
+SPLIT_VAL = 0.1
+SPLIT_TEST = 0.1
+
 HEADERS = {"User-Agent": "Mozilla/5.0 (X11; CrOS x86_64 12871.102.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.141 Safari/537.36"}
 
 
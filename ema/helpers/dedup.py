@@ -0,0 +1,230 @@
+"""Near-duplicate images detection with perceptual hashes."""
+from concurrent.futures import ProcessPoolExecutor
+from json import dump, load
+import os
+from os.path import basename, dirname, isdir, isfile, join, samefile
+import cv2
+import numpy as np
+from tqdm import tqdm
+from helpers.blobstore import file_hash
+from helpers.constants import CLASSIFY_WORKERS, PHASH_CACHE
+
+ALGORITHMS = ['phash', 'dhash']
+
+
+def dhash(gray) -> int:
+    """
+    Difference hash, the brightness gradient of a 9x8 thumbnail.
+
+    Args:
+        gray: grayscale image.
+    """
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def phash(gray) -> int:
+    """
+    Perceptual hash, the low frequencies of the DCT of a 32x32 thumbnail.
+
+    Args:
+        gray: grayscale image.
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(small))[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int(''.join('1' if b else '0' for b in bits), 2)
+
+
+def image_hashes(path: str) -> dict:
+    """
+    Compute the perceptual hashes of an image, None if it cannot be read.
+
+    Args:
+        path: image file.
+    """
+    gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    return {'phash': phash(gray), 'dhash': dhash(gray)}
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of different bits of two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree to find the hashes within a Hamming distance.
+
+    Only the branches whose distance to the node can hold a match are
+    visited, instead of comparing every pair of images.
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, value: int, item):
+        """Add a hash and the item it belongs to."""
+        if self.root is None:
+            self.root = (value, item, {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance not in node[2]:
+                node[2][distance] = (value, item, {})
+                return
+            node = node[2][distance]
+
+    def search(self, value: int, radius: int) -> list:
+        """Get the (distance, item) of every hash within the radius."""
+        found = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node_value, item, children = nodes.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.append((distance, item))
+            nodes.extend(child for d, child in children.items()
+                         if distance - radius <= d <= distance + radius)
+        return sorted(found)
+
+
+def load_cache(cache_path: str = PHASH_CACHE) -> dict:
+    """Load the perceptual hashes by content hash."""
+    if not isfile(cache_path):
+        return {}
+    with open(cache_path, encoding='utf-8') as f:
+        return {key: {name: int(value, 16) for name, value in hashes.items()}
+                for key, hashes in load(f).items()}
+
+
+def save_cache(cache: dict, cache_path: str = PHASH_CACHE):
+    """Save the perceptual hashes by content hash."""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        dump({key: {name: f'{value:016x}' for name, value in hashes.items()}
+              for key, hashes in cache.items()}, f)
+
+
+def hash_images(paths: list, workers: int = CLASSIFY_WORKERS,
+                cache_path: str = PHASH_CACHE) -> dict:
+    """
+    Get the perceptual hashes of the images.
+
+    The hashes are cached by the file content hash, so only new images are
+    decoded, in a process pool.
+    Args:
+        paths: image files.
+        workers: number of processes decoding the images.
+        cache_path: path of the hashes cache.
+    """
+    cache = load_cache(cache_path)
+    contents = {path: file_hash(path) for path in paths}
+    missing = list({c: p for p, c in contents.items() if c not in cache}.items())
+    if missing:
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(image_hashes, [p for _, p in missing],
+                                   chunksize=16)
+            for (content, _), hashes in tqdm(zip(missing, results),
+                                             total=len(missing),
+                                             desc='Hashing images'):
+                if hashes is not None:
+                    cache[content] = hashes
+        save_cache(cache, cache_path)
+
+    return {path: cache[content] for path, content in contents.items()
+            if content in cache}
+
+
+def same_item(path: str, other: str) -> bool:
+    """
+    Check if two images of different label folders are the same item image.
+
+    An image placed in several label folders keeps its name, and it is the
+    same file when it was linked to the same blob.
+    Args:
+        path: image file.
+        other: image file.
+    """
+    return dirname(path) != dirname(other) and (
+        basename(path) == basename(other) or samefile(path, other))
+
+
+def find_duplicates(folders: list, threshold: int = 4,
+                    algorithm: str = 'phash',
+                    workers: int = CLASSIFY_WORKERS) -> list:
+    """
+    Find the near-duplicate images of each folder.
+
+    The images are visited in name order and each one is looked up among the
+    ones kept before it, it is a duplicate of the closest one within the
+    threshold. Searching across folders, the copies of the same item image
+    in other labels are not duplicates.
+    Args:
+        folders: list of folders, each one searched on its own. A single
+        folder with the images of all labels searches across them.
+        threshold: maximum Hamming distance of two duplicated images.
+        algorithm: one of ALGORITHMS.
+        workers: number of processes decoding the images.
+    """
+    groups = [sorted(join(folder, f) for folder in group for f in os.listdir(folder)
+                     if isfile(join(folder, f)))
+              for group in folders]
+    hashes = hash_images([p for group in groups for p in group], workers)
+    duplicates = []
+    for group in groups:
+        tree = BKTree()
+        for path in group:
+            if path not in hashes:
+                continue
+            value = hashes[path][algorithm]
+            found = [(distance, kept) for distance, kept
+                     in tree.search(value, threshold)
+                     if not same_item(path, kept)]
+            if found:
+                distance, kept = found[0]
+                duplicates.append({'kept': kept, 'duplicate': path,
+                                   'distance': distance})
+            else:
+                tree.add(value, path)
+
+    return duplicates
+
+
+def remove_duplicates(duplicates: list, action: str = 'delete'):
+    """
+    Act on the duplicated images.
+
+    Args:
+        duplicates: list from find_duplicates.
+        action: "delete" removes the duplicates, "hardlink" replaces them with
+        a link to the kept image.
+    """
+    for dup in duplicates:
+        if not isfile(dup['duplicate']):
+            continue
+        if action == 'hardlink':
+            tmp = f"{dup['duplicate']}.tmp"
+            os.link(dup['kept'], tmp)
+            os.replace(tmp, dup['duplicate'])
+        else:
+            os.remove(dup['duplicate'])
+
+
+def label_folders(model_db: str, scope: str = 'label') -> list:
+    """
+    Get the folder groups of the model database to be searched.
+
+    Args:
+        model_db: path with the label folders, or a folder of images.
+        scope: "label" searches each label folder on its own and "all"
+        searches across all of them.
+    """
+    folders = [join(model_db, f) for f in sorted(os.listdir(model_db))
+               if isdir(join(model_db, f))] or [model_db]
+
+    return [[f] for f in folders] if scope == 'label' else [folders]
@@ -0,0 +1,125 @@
+"""Multi-pattern matching of the target labels and their bad words."""
+from collections import deque
+from functools import lru_cache
+from helpers.constants import TL_BW
+
+
+def fold(text) -> str:
+    """
+    Lowercase a text as the labels are compared.
+
+    The accents are kept, so 'taça' is not found in 'estaca', as with
+    the `in` checks the matcher replaces.
+    Args:
+        text: text to be folded, converted with str.
+    """
+    return str(text).lower()
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton that finds every pattern of a text in one pass.
+
+    Args:
+        patterns: list of strings to be found.
+    """
+
+    def __init__(self, patterns: list):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [set()]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.out[state].add(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] |= self.out[self.fail[child]]
+
+    def find(self, text: str) -> set:
+        """
+        Get the index of every pattern found in a text.
+
+        Args:
+            text: text to be scanned.
+        """
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            found |= self.out[state]
+
+        return found
+
+
+class LabelMatcher:
+    """
+    Compiled matcher of the target labels and their bad words.
+
+    The labels and bad words are found with a single automaton over the
+    lowercased text. A label is discarded when one of its bad
+    words is in the text or the text is part of one of its bad words.
+    Args:
+        labels: list of (label, folder) tuples, as TL_JOINED.
+        bad_words: dictionary of bad words by label, as TL_BW.
+    """
+
+    def __init__(self, labels: list, bad_words: dict = None):
+        bad_words = bad_words or {}
+        self.folders = [folder for _, folder in labels]
+        self.bad_words = [[fold(bw) for bw in bad_words.get(label, [])]
+                          for label, _ in labels]
+        patterns = [fold(label) for label, _ in labels]
+        self.bad_index = {}
+        for index, words in enumerate(self.bad_words):
+            for word in words:
+                self.bad_index.setdefault(word, set()).add(index)
+        self.size = len(patterns)
+        self.automaton = Automaton(patterns + list(self.bad_index))
+        self.bad_patterns = list(self.bad_index)
+
+    def match(self, text) -> list:
+        """
+        Get the folder of every label found in a text.
+
+        Args:
+            text: the text of the JSON field.
+        """
+        tgt = fold(text)
+        found = self.automaton.find(tgt)
+        excluded = set()
+        for index in found:
+            if index >= self.size:
+                excluded |= self.bad_index[self.bad_patterns[index - self.size]]
+
+        return [self.folders[index] for index in sorted(found)
+                if index < self.size and index not in excluded and
+                not any(tgt in bw for bw in self.bad_words[index])]
+
+
+@lru_cache(maxsize=None)
+def compiled(labels: tuple, bad_words: bool = True) -> LabelMatcher:
+    """
+    Get the matcher of a labels list, built once per process.
+
+    Args:
+        labels: tuple of (label, folder) tuples, as TL_JOINED.
+        bad_words: apply the TL_BW bad words.
+    """
+    return LabelMatcher(list(labels), TL_BW if bad_words else None)
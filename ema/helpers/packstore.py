@@ -0,0 +1,256 @@
+"""Packed storage of the raw JSON items, one compressed shard per museum."""
+from functools import lru_cache
+from json import dump, dumps, loads
+import os
+from os.path import isdir, isfile, join
+from threading import Lock
+from helpers.constants import PACKED, PACK_LEVEL
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SHARD_EXT = '.jsonl.zst'
+INDEX_EXT = '.idx'
+
+SETTINGS = {'packed': PACKED}
+
+# indexes of every packed folder, see index
+_INDEXES = {}
+_LOCK = Lock()
+
+
+def configure(packed=None):
+    """
+    Change where the new items are saved.
+
+    Args:
+        packed: append the items to the museum shards instead of saving one
+        file per item.
+    """
+    if packed is not None:
+        SETTINGS['packed'] = packed
+
+
+def enabled() -> bool:
+    """Whether the new items are appended to the shards."""
+    return SETTINGS['packed']
+
+
+def is_pack_file(name: str) -> bool:
+    """Whether a file name is a shard or a shard index."""
+    return name.endswith(SHARD_EXT) or name.endswith(SHARD_EXT + INDEX_EXT)
+
+
+def shard_path(folder: str, acr: str) -> str:
+    """Path of the shard of a museum."""
+    return join(folder, f'{acr}{SHARD_EXT}')
+
+
+def __require_zstandard():
+    assert zstandard is not None, (
+        'The packed storage needs zstandard: poetry install -E packed')
+
+
+def __read_index(path: str) -> dict:
+    entries = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            # a line cut by an interrupted append is ignored
+            if len(fields) == 5 and fields[-1].isdigit():
+                file, offset, size, row, length = fields
+                entries[file] = (int(offset), int(size), int(row), int(length))
+
+    return entries
+
+
+def __cut_line(path: str) -> str:
+    """Newline that ends an index line cut by an interrupted append."""
+    if not isfile(path) or not os.path.getsize(path):
+        return ''
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return '' if f.read(1) == b'\n' else '\n'
+
+
+def index(folder: str) -> dict:
+    """
+    Get the packed items of a folder.
+
+    The sidecar index of each shard has a line per item with its file name,
+    the offset and size of its compressed frame, its line in the frame and
+    its length. The indexes are read again only when they change.
+    Args:
+        folder: path of the shards.
+    Returns:
+        dictionary with the item file name, as {ACR}_{ID}.json, and its
+        (shard, offset, size, line, length).
+    """
+    if not isdir(folder):
+        return {}
+    with _LOCK:
+        cached = _INDEXES.setdefault(folder, {'dir': None, 'shards': {},
+                                              'items': {}})
+        dir_stamp = os.stat(folder).st_mtime_ns
+        if cached['dir'] != dir_stamp:
+            cached['dir'] = dir_stamp
+            found = {entry.path for entry in os.scandir(folder)
+                     if entry.name.endswith(SHARD_EXT + INDEX_EXT)}
+            for path in set(cached['shards']) - found:
+                del cached['shards'][path]
+                cached['items'] = None
+            for path in found - set(cached['shards']):
+                cached['shards'][path] = (None, {})
+        for path, (stamp, _) in list(cached['shards'].items()):
+            st = os.stat(path)
+            if stamp != (st.st_size, st.st_mtime_ns):
+                cached['shards'][path] = ((st.st_size, st.st_mtime_ns),
+                                          __read_index(path))
+                cached['items'] = None
+        if cached['items'] is None:
+            cached['items'] = {
+                file: (path[:-len(INDEX_EXT)], *item)
+                for path, (_, items) in cached['shards'].items()
+                for file, item in items.items()}
+
+        return cached['items']
+
+
+def names(folder: str) -> list:
+    """
+    Get the file names of the packed items of a folder.
+
+    Args:
+        folder: path of the shards.
+    """
+    return list(index(folder))
+
+
+def entries(folder: str) -> dict:
+    """
+    Get the fingerprint of every packed item, its length and offset.
+
+    Args:
+        folder: path of the shards.
+    """
+    return {file: [length, offset]
+            for file, (_, offset, _, _, length) in index(folder).items()}
+
+
+def contains(folder: str, file: str) -> bool:
+    """
+    Check if an item is packed in a folder.
+
+    Args:
+        folder: path of the shards.
+        file: item file name, as {ACR}_{ID}.json.
+    """
+    return file in index(folder)
+
+
+def append(folder: str, acr: str, items: list) -> int:
+    """
+    Append the new items of a museum to its shard.
+
+    The items are written as JSON lines in a single zstd frame at the end of
+    the shard, and indexed after the frame is written, so an interrupted
+    append leaves no item half-written. An index line cut by an interrupted
+    append is ended before the new ones. Items already packed are skipped.
+    Args:
+        folder: path of the shards.
+        acr: museum acronym.
+        items: list of items from the museum's page response.
+    Returns:
+        number of items appended.
+    """
+    __require_zstandard()
+    os.makedirs(folder, exist_ok=True)
+    index(folder)
+    with _LOCK:
+        path = shard_path(folder, acr)
+        cached = _INDEXES[folder]
+        known = cached['shards'].get(path + INDEX_EXT, (None, {}))[1]
+        new, lines = [], []
+        for data in items:
+            file = f'{acr}_{data["id"]}.json'
+            if file in known or file in new:
+                continue
+            new.append(file)
+            lines.append(dumps(data, sort_keys=True,
+                               ensure_ascii=False).encode('utf-8'))
+        if not new:
+            return 0
+
+        frame = zstandard.ZstdCompressor(level=PACK_LEVEL).compress(
+            b'\n'.join(lines))
+        with open(path, 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(frame)
+        rows = [(file, (offset, len(frame), row, len(line)))
+                for row, (file, line) in enumerate(zip(new, lines))]
+        cut = __cut_line(path + INDEX_EXT)
+        with open(path + INDEX_EXT, 'a', encoding='utf-8') as f:
+            f.write(cut)
+            f.writelines(f'{file}\t' + '\t'.join(map(str, entry)) + '\n'
+                         for file, entry in rows)
+        st = os.stat(path + INDEX_EXT)
+        known.update(rows)
+        cached['shards'][path + INDEX_EXT] = ((st.st_size, st.st_mtime_ns),
+                                              known)
+        if cached['items'] is not None:
+            cached['items'].update((file, (path, *entry))
+                                   for file, entry in rows)
+
+    return len(new)
+
+
+@lru_cache(maxsize=32)
+def __frame(shard: str, offset: int, size: int) -> list:
+    with open(shard, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+
+    return zstandard.ZstdDecompressor().decompress(data).split(b'\n')
+
+
+def read(folder: str, file: str) -> bytes:
+    """
+    Read the JSON of a packed item.
+
+    The frames are immutable, the last ones read are kept decompressed.
+    Args:
+        folder: path of the shards.
+        file: item file name, as {ACR}_{ID}.json.
+    """
+    __require_zstandard()
+    shard, offset, size, row, _ = index(folder)[file]
+
+    return __frame(shard, offset, size)[row]
+
+
+def export(folder: str, dest: str, files: list = None) -> int:
+    """
+    Write packed items as loose JSON files, as the fetcher saves them.
+
+    Args:
+        folder: path of the shards.
+        dest: folder where the files are written, the files already there
+        are kept.
+        files: only these items, all of them by default.
+    Returns:
+        number of files written.
+    """
+    os.makedirs(dest, exist_ok=True)
+    count = 0
+    for file in names(folder) if files is None else files:
+        filename = join(dest, file)
+        if isfile(filename):
+            continue
+        with open(filename, 'w', encoding='utf-8') as f:
+            dump(loads(read(folder, file)), f, sort_keys=True,
+                 ensure_ascii=False, indent=4)
+        count += 1
+
+    return count
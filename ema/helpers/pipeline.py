@@ -0,0 +1,203 @@
+"""Incremental executor of the database stages."""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from json import dump, dumps, load, loads
+import os
+from os.path import exists, isdir, isfile, join
+from helpers.constants import DATA_MANIFESTS
+from helpers import packstore
+
+
+class Stage:
+    """
+    A database stage with its declared inputs and outputs.
+
+    A stage runs after the stages that write its inputs. A stage that
+    rewrites the outputs of another one in place, as the duplicates removal,
+    reads and writes them, and the manifest of that stage is refreshed when
+    it finishes, so the files it removed do not make that stage run again.
+    Args:
+        name: stage name, also the name of its manifest.
+        run: function that builds the outputs from all the inputs.
+        inputs: folders read by the stage.
+        outputs: folders written by the stage.
+        options: how the stage is refreshed, any of
+            update: function that receives the changed input files, as a
+            dictionary of input folder and file names, and processes only
+            them. When missing, the stage runs in full whenever an input
+            changes.
+            params: JSON values the outputs depend on besides the inputs,
+            the stage runs in full when they change.
+            pending: function that tells if the stage has work left although
+            its inputs did not change, as downloads that failed, it is
+            updated then instead of skipped.
+
+    A stage without inputs reads an outside source that cannot be
+    fingerprinted, as the museum servers, so it is never skipped: it runs in
+    full the first time and is updated on the next runs.
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), **options):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.update = options.pop('update', None)
+        self.params = loads(dumps(options.pop('params', None)))
+        self.pending = options.pop('pending', None)
+        assert not options, f'Stage {name} has unknown options {set(options)}'
+
+    def reads(self, other) -> bool:
+        """Whether the stage reads the outputs of another one."""
+        return other is not self and bool(set(other.outputs) & set(self.inputs))
+
+    def edits(self, other) -> bool:
+        """Whether the stage changes the outputs of another one in place."""
+        return other is not self and bool(set(other.outputs) & set(self.outputs))
+
+
+def fingerprint(folders: list) -> dict:
+    """
+    Get the size and modification time of every file of the folders.
+
+    The packed items are fingerprinted by their length and offset instead of
+    their shards, see helpers.packstore.
+    Args:
+        folders: folders to be fingerprinted.
+    """
+    prints = {}
+    for folder in folders:
+        prints[folder] = packstore.entries(folder)
+        if isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.is_file() and not packstore.is_pack_file(entry.name):
+                    st = entry.stat()
+                    prints[folder][entry.name] = [st.st_size, st.st_mtime_ns]
+
+    return prints
+
+
+class Pipeline:
+    """
+    Run the stages in dependency order, skipping the ones already done.
+
+    Each finished stage records a manifest with the fingerprint of its
+    inputs and outputs. A stage is skipped when its inputs did not change and
+    none of its output files was removed since, is updated with only the
+    changed files when it supports it, and runs in full otherwise. A stage
+    that did not finish has no manifest, so it runs again. Stages whose
+    inputs are written by the finished stages only run concurrently.
+    Args:
+        stages: list of Stage.
+        manifests: folder where the manifests are kept.
+    """
+
+    def __init__(self, stages: list, manifests: str = DATA_MANIFESTS):
+        self.stages = {stage.name: stage for stage in stages}
+        self.manifests = manifests
+        self.deps = {stage.name: [other.name for other in stages
+                                  if stage.reads(other)]
+                     for stage in stages}
+
+    def manifest_path(self, stage: Stage) -> str:
+        """Path of the manifest of a stage."""
+        return join(self.manifests, f'{stage.name}.json')
+
+    def load_manifest(self, stage: Stage) -> dict:
+        """Load the manifest of the last finished run of a stage."""
+        path = self.manifest_path(stage)
+        if not isfile(path):
+            return None
+        with open(path, encoding='utf-8') as f:
+            return load(f)
+
+    def save_manifest(self, stage: Stage, manifest: dict):
+        """Save the manifest of a finished run of a stage."""
+        os.makedirs(self.manifests, exist_ok=True)
+        with open(self.manifest_path(stage), 'w', encoding='utf-8') as f:
+            dump(manifest, f)
+
+    def refresh(self, stage: Stage):
+        """
+        Fingerprint again the outputs of a stage edited by another one.
+
+        Args:
+            stage: the stage whose outputs were edited.
+        """
+        manifest = self.load_manifest(stage)
+        if manifest is not None:
+            manifest['outputs'] = fingerprint(stage.outputs)
+            self.save_manifest(stage, manifest)
+
+    def execute(self, stage: Stage) -> str:
+        """
+        Run, update or skip a stage.
+
+        Args:
+            stage: the stage to be executed.
+        """
+        current = fingerprint(stage.inputs)
+        manifest = self.load_manifest(stage)
+        outputs = fingerprint(stage.outputs)
+        outputs_exist = all(exists(output) for output in stage.outputs) and \
+            not any(set(files) - set(outputs.get(folder, {}))
+                    for folder, files in manifest.get('outputs', {}).items()) \
+            if manifest else False
+        if manifest is None or not outputs_exist or \
+                manifest.get('params') != stage.params:
+            action = 'run'
+        else:
+            previous = manifest['inputs']
+            changed = {folder: {name for name, fp in files.items()
+                                if previous.get(folder, {}).get(name) != fp}
+                       for folder, files in current.items()}
+            removed = any(set(files) - set(current.get(folder, {}))
+                          for folder, files in previous.items())
+            if stage.inputs and not removed and not any(changed.values()) \
+                    and not (stage.pending and stage.pending()):
+                return 'skipped'
+            action = 'update' if stage.update and not removed else 'run'
+
+        path = self.manifest_path(stage)
+        if isfile(path):
+            os.remove(path)
+        for output in stage.outputs:
+            os.makedirs(output, exist_ok=True)
+        if action == 'update':
+            stage.update(changed)
+        else:
+            stage.run()
+
+        if set(stage.inputs) & set(stage.outputs):
+            current = fingerprint(stage.inputs)
+        self.save_manifest(stage, {'inputs': current, 'params': stage.params,
+                                   'outputs': fingerprint(stage.outputs)})
+        for other in self.stages.values():
+            if stage.edits(other):
+                self.refresh(other)
+
+        return action
+
+    def run(self, workers: int = None) -> dict:
+        """
+        Execute every stage after the ones that write its inputs.
+
+        Args:
+            workers: maximum number of stages running at once.
+        """
+        done = {}
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=workers or len(pending)) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dep in done for dep in self.deps[name]):
+                        running[executor.submit(self.execute, stage)] = name
+                        del pending[name]
+                assert running, f'Stages with circular dependencies: {list(pending)}'
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    done[name] = future.result()
+                    print(f'Stage {name}: {done[name]}.')
+
+        return done
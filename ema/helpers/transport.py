@@ -0,0 +1,130 @@
+"""Shared HTTP transport for the museum fetchers."""
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from helpers.constants import (HEADERS, MAX_CONNECTIONS,
+                               MAX_CONNECTIONS_PER_HOST, REQUEST_TIMEOUT,
+                               REQUEST_RETRIES, BACKOFF_BASE, BACKOFF_MAX)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+SETTINGS = {
+        'timeout': REQUEST_TIMEOUT,
+        'retries': REQUEST_RETRIES,
+        'per_host': MAX_CONNECTIONS_PER_HOST
+        }
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+
+def configure(timeout=None, retries=None, per_host=None):
+    """
+    Change the transport settings.
+
+    The pooled session is rebuilt on the next request.
+    Args:
+        timeout: seconds to wait for the server, a number or a
+        (connect, read) tuple.
+        retries: number of attempts before giving up a request.
+        per_host: maximum number of open connections to the same host.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        for key, value in (('timeout', timeout), ('retries', retries),
+                           ('per_host', per_host)):
+            if value is not None:
+                SETTINGS[key] = value
+        _SESSION = None
+
+
+def session() -> requests.Session:
+    """
+    Get the shared session.
+
+    Connections are kept alive and reused, and each host pool blocks once
+    `per_host` connections are open instead of opening new ones. The
+    session is built once even when many threads ask for it at the same time.
+    """
+    global _SESSION  # pylint: disable=global-statement
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_CONNECTIONS,
+                                  pool_maxsize=SETTINGS['per_host'],
+                                  pool_block=True)
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            s.headers.update(HEADERS)
+            _SESSION = s
+
+        return _SESSION
+
+
+def retry_after(response) -> float:
+    """
+    Read the Retry-After header as seconds, None when missing.
+
+    Args:
+        response: the server response.
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    """
+    Jittered exponential backoff in seconds.
+
+    Args:
+        attempt: number of the failed attempt, starting at 0.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def get(url: str, headers: dict = None, stream: bool = False):
+    """
+    Request an url through the shared session.
+
+    Connection errors, timeouts and the RETRY_STATUS codes are retried with
+    a jittered exponential backoff, waiting what the server asks for on
+    Retry-After. The last response is returned when the retries run out
+    and None if the server could not be reached at all.
+    Args:
+        url: the url to be requested.
+        headers: headers added to the shared ones.
+        stream: do not download the body right away.
+    """
+    tries = SETTINGS['retries']
+    r = None
+    for attempt in range(tries):
+        try:
+            r = session().get(url, headers=headers, stream=stream,
+                              timeout=SETTINGS['timeout'])
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as e:
+            print(f'Cannot connect to url {url} '
+                  f'({attempt + 1}/{tries} - {e})')
+            if attempt < tries - 1:
+                time.sleep(backoff(attempt))
+            continue
+        if r.status_code not in RETRY_STATUS or attempt == tries - 1:
+            return r
+        wait = retry_after(r)
+        wait = backoff(attempt) if wait is None else min(wait, BACKOFF_MAX)
+        r.close()
+        time.sleep(wait)
+
+    return r
@@ -0,0 +1,214 @@
+"""SQLite catalogue of the harvested museum items."""
+from hashlib import sha256
+from json import dumps, loads
+import os
+from os.path import basename, isdir, isfile, join
+import sqlite3
+from tqdm import tqdm
+from helpers.auxiliar import get_nested, load_json
+from helpers.blobstore import file_hash
+from helpers.constants import DATA_CATALOGUE, DATA_RAW_JSONS
+from helpers.matcher import fold
+from helpers import constants, packstore
+from modules.images_fetcher import image_files, image_urls
+
+FIELDS = ('classification', 'denomination', 'title')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    file TEXT PRIMARY KEY,
+    acr TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    classification TEXT,
+    denomination TEXT,
+    title TEXT,
+    image_urls TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_acr ON items (acr, item_id);
+'''
+
+
+def connect(db_path: str = DATA_CATALOGUE) -> sqlite3.Connection:
+    """
+    Open the catalogue, creating it if needed.
+
+    Args:
+        db_path: path of the SQLite file.
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    con = sqlite3.connect(db_path)
+    con.executescript(SCHEMA)
+    con.create_function('fold', 1, fold, deterministic=True)
+
+    return con
+
+
+def field_text(data: dict, acr: str, field: str):
+    """
+    Get the text of a field as the classification stages compare it.
+
+    Args:
+        data: the item JSON.
+        acr: museum acronym.
+        field: one of FIELDS.
+    """
+    acr_fields = getattr(constants, f'{acr}_FIELDS')
+    try:
+        return str(get_nested(data, acr_fields[field]))
+    except (KeyError, TypeError, IndexError):
+        return None
+
+
+def item_row(jsons_path: str, file: str, stamp: tuple) -> tuple:
+    """
+    Parse a JSON file into a catalogue row.
+
+    Args:
+        jsons_path: path of the JSON files.
+        file: JSON file name, as {museum_acr}_{item_id}.json.
+        stamp: size and modification time of the file, or length and offset
+        of a packed item.
+    """
+    acr, item_id = file.split('.')[0].split('_', 1)
+    data = load_json(jsons_path, file)
+    path = join(jsons_path, file)
+    if isfile(path):
+        content_hash = file_hash(path)
+    else:
+        path = packstore.shard_path(jsons_path, acr)
+        content_hash = sha256(packstore.read(jsons_path, file)).hexdigest()
+    urls = image_urls(data)
+
+    return (file, acr, item_id,
+            *(field_text(data, acr, field) for field in FIELDS),
+            dumps(urls), path, *stamp, content_hash)
+
+
+def ingest(jsons_path: str = DATA_RAW_JSONS,
+           db_path: str = DATA_CATALOGUE) -> int:
+    """
+    Add the new and changed JSON files to the catalogue.
+
+    Only the files whose size or modification time differ from the
+    catalogued ones are parsed, and the rows of removed files are dropped.
+    The packed items are catalogued by their length and offset in the shard.
+    Args:
+        jsons_path: path of the JSON files.
+        db_path: path of the SQLite file.
+    """
+    if not isdir(jsons_path):
+        return 0
+    con = connect(db_path)
+    with con:
+        known = {row[0]: row[1:] for row in con.execute(
+            'SELECT file, size, mtime FROM items WHERE path LIKE ?',
+            (join(jsons_path, '%'),))}
+        stamps = {name: tuple(stamp)
+                  for name, stamp in packstore.entries(jsons_path).items()}
+        for e in os.scandir(jsons_path):
+            if e.is_file() and e.name.endswith('.json'):
+                st = e.stat()
+                stamps[e.name] = (st.st_size, st.st_mtime_ns)
+        changed = [(name, stamp) for name, stamp in stamps.items()
+                   if known.get(name) != stamp]
+        con.executemany(
+            f'INSERT OR REPLACE INTO items VALUES ({", ".join("?" * 11)})',
+            (item_row(jsons_path, name, stamp) for name, stamp in
+             tqdm(changed, desc='Cataloguing', disable=not changed)))
+        removed = set(known) - set(stamps)
+        con.executemany('DELETE FROM items WHERE file = ?',
+                        ((file,) for file in removed))
+    con.close()
+
+    return len(changed)
+
+
+def lookup(field: str, files: list, db_path: str = DATA_CATALOGUE) -> dict:
+    """
+    Get the text of a field for the catalogued files.
+
+    Files that are not in the catalogue are left out, so the caller can
+    parse them. A missing field gives an empty text. Only the rows of the
+    files asked are read, joined by the primary key.
+    Args:
+        field: one of FIELDS.
+        files: JSON file names.
+        db_path: path of the SQLite file.
+    """
+    assert field in FIELDS, f'Field {field} is not catalogued'
+    if not os.path.exists(db_path):
+        return {}
+    con = connect(db_path)
+    with con:
+        con.execute('CREATE TEMP TABLE wanted (file TEXT PRIMARY KEY)')
+        con.executemany('INSERT OR IGNORE INTO wanted VALUES (?)',
+                        ((file,) for file in files))
+        texts = {file: text or '' for file, text in con.execute(
+            f'SELECT items.file, {field} FROM wanted '
+            'JOIN items ON items.file = wanted.file')}
+    con.close()
+
+    return texts
+
+
+def select(field: str, patterns: list, db_path: str = DATA_CATALOGUE):
+    """
+    Get the text of a field for the catalogued files that may match.
+
+    The query keeps the items whose lowercased text contains one of the
+    patterns, so the caller matches only these candidates. The text is
+    lowercased by a Python function on every row, so the query scans the
+    whole table instead of using an index. It gives None when there is no
+    catalogue yet.
+    Args:
+        field: one of FIELDS.
+        patterns: strings searched in the field text.
+        db_path: path of the SQLite file.
+    """
+    assert field in FIELDS, f'Field {field} is not catalogued'
+    if not os.path.exists(db_path):
+        return None
+    patterns = [fold(pattern) for pattern in patterns]
+    if not patterns:
+        return {}
+    where = ' OR '.join([f'instr(fold({field}), ?)'] * len(patterns))
+    con = connect(db_path)
+    texts = dict(con.execute(
+        f'SELECT file, {field} FROM items '
+        f'WHERE {field} IS NOT NULL AND ({where}) ORDER BY acr, item_id',
+        patterns))
+    con.close()
+
+    return texts
+
+
+def missing_images(images_path: str, keep=None,
+                   db_path: str = DATA_CATALOGUE) -> list:
+    """
+    Get the catalogued files that have an image not saved yet.
+
+    The images URLs are read from the catalogue, so the JSON files are not
+    parsed to find the images that failed or were never downloaded.
+    Args:
+        images_path: path where the images are saved.
+        keep: function of the catalogued texts of an item, as a dictionary
+        of FIELDS, that tells if its images are downloaded, all of them by
+        default. The items left out on purpose are not missing.
+        db_path: path of the SQLite file.
+    """
+    if not os.path.exists(db_path):
+        return []
+    saved = set(os.listdir(images_path)) if isdir(images_path) else set()
+    con = connect(db_path)
+    rows = con.execute(
+        f'SELECT file, image_urls, {", ".join(FIELDS)} FROM items').fetchall()
+    con.close()
+
+    return [file for file, urls, *texts in rows
+            if any(basename(img) not in saved for img in
+                   image_files(file.split('.')[0], loads(urls), images_path))
+            and (keep is None or keep(dict(zip(FIELDS, texts))))]
@@ -1,6 +1,7 @@
 """Classify images according to thesaurus or label."""
 from os.path import join
 from helpers.auxiliar import read_files, copy_files
+from helpers.constants import PART_EXT
 from typing import List, NoReturn
 
 
@@ -22,19 +23,32 @@ def target_jsons_id(jsons_path: str) -> List[str]:
     return item_json
 
 
+def image_item_id(image_name: str) -> str:
+    """
+    Get the acronym and id part of an image file name.
+
+    Example: MINC_9999_0.jpg gives MINC_9999.
+    Args:
+        image_name: image file name as {museum_acr}_{item_id}_{item_number}.{format}.
+    """
+    return image_name.rsplit('_', 1)[0]
+
+
 def classify_images(raw_img_path: str, json_path: str, dest: str) -> NoReturn:
     """
     Get images based in a classification.
 
     The classification can be thesaurus or labels.
-    Correspondent ones will be checked with the target one, from target_jsons_id.
+    Correspondent ones will be checked with the target one, from target_jsons_id,
+    by their exact acronym and id, so MINC_12 does not match MINC_123_0.jpg.
+    The images still being downloaded are left out.
     Args:
         raw_img_path: path of all the images (data_raw_images).
         json_path: path to interim JSON files.
         dest: path to the processed images.
     """
-    files = read_files(raw_img_path)
-    tg_files = target_jsons_id(json_path)
-    matches = [i for i in files for j in tg_files if j in i]
+    files = [f for f in read_files(raw_img_path) if not f.endswith(PART_EXT)]
+    tg_files = set(target_jsons_id(json_path))
+    matches = [i for i in files if image_item_id(i) in tg_files]
     for item in matches:
         copy_files(join(raw_img_path, item), dest)
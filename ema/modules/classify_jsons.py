@@ -1,18 +1,195 @@
 """Refine the raw json files by it's categories."""
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from os import makedirs
 from os.path import join
+from tqdm import tqdm
 from helpers.auxiliar import (copy_files, get_nested, load_json,
                               read_files, check_bad_words)
 from helpers.constants import (DATA_INTERIM_TEXT, DATA_PROCD_TEXT,
-                               TARGET_LABELS, TL_BW)
+                               TARGET_LABELS, CLASSIFY_CHUNK,
+                               CLASSIFY_WORKERS, TESAURO, TL_JOINED)
+from helpers.matcher import compiled
 from helpers import constants
+from modules.classify_images import image_item_id
+from modules import catalogue
 
 
-def allocate(str_compare, field, origin_path, dest_path):
+def contains(str_compare: str, str_target) -> list:
+    """
+    Get the compared string when it is part of the lowercased text.
+
+    Args:
+        str_compare: the string compared, as the thesaurus.
+        str_target: the text of the JSON field.
+    """
+    return [str_compare] if str_compare in str(str_target).lower() else []
+
+
+def match_labels(str_target, labels: list, bad_words: bool = True) -> list:
+    """
+    Get the folder of every label found in a text.
+
+    A label matches as in allocate_img, discarding the text when it is related
+    to one of the label's bad words. The labels are matched in one pass by
+    the compiled matcher of helpers.matcher.
+    Args:
+        str_target: the text of the JSON field.
+        labels: list of (label, folder) tuples, as TL_JOINED.
+        bad_words: discard the texts related to the bad words.
+    """
+    return compiled(tuple(map(tuple, labels)), bad_words).match(str_target)
+
+
+def classify_texts(classification: str, text: str, thesauro: str,
+                   labels: list) -> tuple:
+    """
+    Get how far the texts of an item go through the classification stages.
+
+    The texts are checked as the files are by allocate, through_labels and
+    build_model_db, one filter after the other.
+    Args:
+        classification: text of the classification field.
+        text: text of the field compared with the labels.
+        thesauro: thesaurus compared with the classification field.
+        labels: list of (label, folder) tuples of the model database.
+    Returns:
+        whether it matches the thesaurus and the target labels, and the
+        folders of the model database labels it matches.
+    """
+    if not contains(thesauro, classification or ''):
+        return False, False, []
+    targets = tuple((label, label) for label in TARGET_LABELS)
+    if not match_labels(text or '', targets, bad_words=False):
+        return True, False, []
+
+    return True, True, match_labels(text or '', labels)
+
+
+def classify_item(acr: str, data: dict, thesauro: str, field: str,
+                  labels: list) -> tuple:
+    """
+    Get how far an item goes through the classification stages.
+
+    Args:
+        acr: museum acronym.
+        data: the item JSON.
+        thesauro: thesaurus compared with the classification field.
+        field: text field compared with the labels.
+        labels: list of (label, folder) tuples of the model database.
+    Returns:
+        the same as classify_texts.
+    """
+    return classify_texts(catalogue.field_text(data, acr, 'classification'),
+                          catalogue.field_text(data, acr, field),
+                          thesauro, labels)
+
+
+def in_model_db(file: str, data: dict, thesauro: str = TESAURO[0],
+                field: str = 'denomination', labels: list = TL_JOINED) -> bool:
+    """
+    Check if an item can end up in the model database.
+
+    Args:
+        file: JSON file name, as {museum_acr}_{item_id}.json.
+        data: the item JSON.
+        thesauro: thesaurus compared with the classification field.
+        field: text field compared with the labels.
+        labels: list of (label, folder) tuples of the model database.
+    """
+    acr = file.split('.')[0].split('_')[0]
+
+    return bool(classify_item(acr, data, thesauro, field, labels)[2])
+
+
+def texts_in_model_db(texts: dict, thesauro: str = TESAURO[0],
+                      field: str = 'denomination',
+                      labels: list = TL_JOINED) -> bool:
+    """
+    Check if a catalogued item can end up in the model database.
+
+    The catalogue keeps the field texts as classify_item reads them, so the
+    answer is the same as in_model_db without parsing the JSON file.
+    Args:
+        texts: the catalogued texts of the item by field.
+        thesauro: thesaurus compared with the classification field.
+        field: text field compared with the labels, one of catalogue.FIELDS.
+        labels: list of (label, folder) tuples of the model database.
+    """
+    return bool(classify_texts(texts['classification'], texts[field],
+                               thesauro, labels)[2])
+
+
+def label_chunk(origin_path: str, field: str, match, files: list) -> list:
+    """
+    Parse a chunk of JSON files and get the labels of each one.
+
+    Args:
+        origin_path: the path of the JSON files.
+        field: the specific field inside the json that will be the target.
+        match: function that gets the labels of the field text.
+        files: JSON file names.
+    """
+    results = []
+    for file in files:
+        acr = file.split('.')[0].split('_')[0]
+        acr_fields = getattr(constants, f'{acr}_FIELDS')
+        data = load_json(origin_path, file)
+        results.append((file, match(get_nested(data, acr_fields[field]))))
+
+    return results
+
+
+def classify_files(origin_path: str, field: str, match, files: list = None,
+                   workers: int = CLASSIFY_WORKERS, patterns: list = None):
+    """
+    Get the labels of every JSON file, as (file, labels) tuples.
+
+    The field is read from the catalogue and the files not catalogued yet are
+    split in chunks of CLASSIFY_CHUNK files, parsed and matched in a process
+    pool. The processes only return the labels, the files are placed by the
+    caller.
+    Args:
+        origin_path: the path of the JSON files.
+        field: the specific field inside the json that will be the target,
+        for example "classification", "denomination".
+        match: function that gets the labels of the field text, it must be
+        picklable, as a module function or a partial of one.
+        files: only these files of the origin path, all of them by default.
+        workers: number of processes parsing the JSON files.
+        patterns: strings that a matching text always contains. When given,
+        only the catalogued files whose text contains one of them are
+        matched, the files not catalogued yet are still parsed.
+    """
+    files = read_files(origin_path) if files is None else list(files)
+    texts = catalogue.lookup(field, files)
+    missing = [file for file in files if file not in texts]
+    selected = None if patterns is None else catalogue.select(field, patterns)
+    for file, text in texts.items():
+        if selected is None or file in selected:
+            yield file, match(text)
+
+    chunks = [missing[i:i + CLASSIFY_CHUNK]
+              for i in range(0, len(missing), CLASSIFY_CHUNK)]
+    worker = partial(label_chunk, origin_path, field, match)
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(min(workers, len(chunks))) as executor:
+            for results in executor.map(worker, chunks):
+                yield from results
+    else:
+        for chunk in chunks:
+            yield from worker(chunk)
+
+
+def allocate(str_compare, field, origin_path, dest_path, files=None,
+             workers=CLASSIFY_WORKERS):
     """
     Allocate files from a specific path to another.
 
     The allocation is intended to separate the required data
-    in specific folders.
+    in specific folders. The files are classified in parallel by
+    classify_files, which skips the catalogued ones without the string.
     Args:
         str_compare: the string that will be compared with the existent in the
         json data.
@@ -20,20 +197,19 @@ def allocate(str_compare, field, origin_path, dest_path):
         for example "classification", "denomination".
         origin_path: the root path of all files.
         dest_path: destination path where the classified files will be saved.
+        files: only these files of the origin path, all of them by default.
+        workers: number of processes parsing the JSON files.
     """
-    files = read_files(origin_path)
-    for file in files:
-        acr = file.split('.')[0].split('_')[0]
-        acr_fields = getattr(constants, f'{acr}_FIELDS')
-        data = load_json(origin_path, file)
+    for file, found in classify_files(origin_path, field,
+                                      partial(contains, str_compare),
+                                      files, workers, [str_compare]):
         file_origin = join(origin_path, file)
-        str_target = get_nested(data, acr_fields[field])
-        if str_compare in str(str_target).lower() and \
-                (file_origin not in dest_path):
+        if found and (file_origin not in dest_path):
             copy_files(file_origin, dest_path)
 
 
-def allocate_img(str_compare, field, procd_txt, procd_img, model_db):
+def allocate_img(str_compare, field, procd_txt, procd_img, model_db,
+                 workers=CLASSIFY_WORKERS):
     """
     Allocate images related to JSON files that contains the specific label.
 
@@ -45,31 +221,73 @@ def allocate_img(str_compare, field, procd_txt, procd_img, model_db):
         procd_txt: the processed jsons path.
         procd_img: the processed images path.
         model_db: path that the images will be copied.
+        workers: number of processes parsing the JSON files.
     """
-    txt_files = read_files(procd_txt)
     img_files = read_files(procd_img)
-    for file in txt_files:
-        acr = file.split('.')[0].split('_')[0]
-        acr_fields = getattr(constants, f'{acr}_FIELDS')
-        data = load_json(procd_txt, file)
-        str_target = get_nested(data, acr_fields[field])
+    match = partial(match_labels, labels=((str_compare, model_db),))
+    for file, found in classify_files(procd_txt, field, match,
+                                      workers=workers):
+        if not found:
+            continue
         txt_name = file.split('.')[0]
-        imgs = [i for i in img_files if txt_name in i]
+        imgs = [i for i in img_files if image_item_id(i) == txt_name]
         for item in imgs:
-            img_path = join(procd_img, item)
-            tgt = str(str_target).lower()
-            if (str_compare in tgt) and (not any(tgt in i for i in TL_BW[str_compare])) and (not any(i in tgt for i in  TL_BW[str_compare])):
-                copy_files(img_path, model_db)
+            copy_files(join(procd_img, item), model_db)
+
+
+def build_model_db(labels: list, field: str, procd_txt: str, procd_img: str,
+                   model_db: str, workers: int = CLASSIFY_WORKERS):
+    """
+    Allocate the images of every label folder in a single pass.
+
+    Each JSON file is read once, from the catalogue or parsed when not
+    catalogued, and checked against all labels, then its images are placed
+    in every matching label folder, the same as calling allocate_img once
+    per label.
+    Args:
+        labels: list of (label, folder) tuples, as TL_JOINED.
+        field: the specific field inside the json that will be the target,
+        for example "classification", "denomination".
+        procd_txt: the processed jsons path.
+        procd_img: the processed images path.
+        model_db: path where the label folders will be created.
+        workers: number of processes parsing the JSON files.
+    """
+    for _, folder in labels:
+        makedirs(join(model_db, folder), exist_ok=True)
+    img_index = defaultdict(list)
+    for item in read_files(procd_img):
+        img_index[image_item_id(item)].append(item)
+
+    txt_files = read_files(procd_txt)
+    match = partial(match_labels, labels=tuple(map(tuple, labels)))
+    for file, folders in tqdm(classify_files(procd_txt, field, match,
+                                             txt_files, workers),
+                              total=len(txt_files)):
+        imgs = img_index.get(file.split('.')[0], [])
+        for folder in folders:
+            for item in imgs:
+                copy_files(join(procd_img, item), join(model_db, folder))
 
 
-def through_labels(target_list: list, field: str):
+def through_labels(target_list: list, field: str,
+                   workers: int = CLASSIFY_WORKERS):
     """
     Go through all labels to get the related file.
 
+    Every file is read once and all labels are found in a single pass, the
+    file is copied when any of them matches. Only the catalogued files that
+    contain one of the labels are matched.
     Args:
         target_list: list of the target labels.
         field: specific JSON field that will be used, for example denomination.
+        workers: number of processes parsing the JSON files.
 
     """
-    for label in target_list:
-        allocate(label, field, DATA_INTERIM_TEXT, DATA_PROCD_TEXT)
+    match = partial(match_labels,
+                    labels=tuple((label, label) for label in target_list),
+                    bad_words=False)
+    for file, found in classify_files(DATA_INTERIM_TEXT, field, match,
+                                      workers=workers, patterns=target_list):
+        if found:
+            copy_files(join(DATA_INTERIM_TEXT, file), DATA_PROCD_TEXT)
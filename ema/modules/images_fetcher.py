@@ -1,17 +1,38 @@
 """Download all images from museum's website."""
-from json import dumps, load
-from os.path import exists, isdir, join
-from os import listdir, makedirs
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from json import dumps
+from os.path import basename, dirname, exists, getsize, isdir, join
+from os import listdir, makedirs, remove, replace
+from threading import Condition
+from urllib.parse import urlparse
 import re
 import time
+import cv2
+import numpy as np
 from tqdm import tqdm
 import requests
-from helpers.constants import (HEADERS, DATA_RAW_IMAGES, DATA_RAW_JSONS,
-                               WORKSPACE)
-from helpers.auxiliar import read_files
+from helpers.constants import (DATA_RAW_IMAGES, DATA_RAW_JSONS,
+                               DATA_INTERIM_IMAGES, DATA_PROCD_IMAGES,
+                               DATA_PROCD_MODEL, IMAGES_NUMBERING,
+                               WORKSPACE, IMAGE_WORKERS, CHUNK_SIZE,
+                               MAX_CONNECTIONS_PER_HOST, PART_EXT,
+                               VERIFY_IMAGES)
+from helpers.auxiliar import load_json, read_files
+from helpers import transport
+from modules.classify_images import image_item_id
 from modules.jsons_fetcher import get_jsons
 
 
+IMAGE_URL = re.compile(r'(?:http\:|https\:)?\/\/.[^\s"]+\.(?:jpg|jpeg|png|bmp)')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+HTML_LINK = re.compile(r'(?:href|src)="([^"]+)"')
+CONTENT_RANGE = re.compile(r'bytes (\d+)-\d+/(\d+|\*)')
+# types some servers give to images besides image/*
+IMAGE_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+
 def url_regex(file: str) -> list:
     """
     Find all image urls in a JSON file.
@@ -19,24 +40,72 @@ def url_regex(file: str) -> list:
     Args:
         file: JSON file to find image urls.
     """
-    urls = re.findall(
-            r'(?:http\:|https\:)?\/\/.[^\s"]+\.(?:jpg|jpeg|png|bmp)',
-            dumps(file)
-            )
+    urls = IMAGE_URL.findall(dumps(file))
 
     return urls
 
 
-def __request(url, try_count=10):
-    s = requests.Session()
-    for error_count in range(0, try_count):
-        try:
-            return s.get(url, headers=HEADERS)
-        except requests.exceptions.ConnectionError as e:
-            print(f'Cannot connect to url {url} trying again \
-                    ({error_count}/{try_count} - {e}')
-            time.sleep(60)
-            continue
+def is_image_url(url) -> bool:
+    """
+    Check if an url points to an image file.
+
+    Args:
+        url: url to be checked.
+    """
+    return isinstance(url, str) and \
+        urlparse(url).path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def best_thumbnail(thumbnail) -> str:
+    """
+    Get the largest image of the Tainacan thumbnail sizes.
+
+    Each size is a [url, width, height, is_intermediate] list, the original
+    image being the "full" one.
+    Args:
+        thumbnail: the item's thumbnail dictionary.
+    """
+    if not isinstance(thumbnail, dict):
+        return None
+    sizes = [(int(size[1] or 0) * int(size[2] or 0), name == 'full', size[0])
+             for name, size in thumbnail.items()
+             if isinstance(size, list) and len(size) > 2 and
+             is_image_url(size[0])]
+
+    return max(sizes)[2] if sizes else None
+
+
+def image_urls(item: dict) -> list:
+    """
+    Find the image urls of a Tainacan item.
+
+    The media is read from where Tainacan keeps it: the largest thumbnail
+    size, the document and the attachments. The urls are deduplicated in a
+    stable order, so the images numbering does not change between runs.
+    Unknown layouts fall back to url_regex.
+    Args:
+        item: the item JSON.
+    """
+    urls = [best_thumbnail(item.get('thumbnail'))]
+    document = item.get('document')
+    if item.get('document_type') == 'url':
+        urls.append(document)
+    html = item.get('document_as_html')
+    if isinstance(html, str):
+        urls.extend(HTML_LINK.findall(html)[:1])
+    attachments = item.get('attachments')
+    if isinstance(attachments, list):
+        for attachment in attachments:
+            if isinstance(attachment, dict):
+                urls.append(attachment.get('url') or attachment.get('guid') or
+                            attachment.get('source_url'))
+            else:
+                urls.append(attachment)
+    urls = [url for url in urls if is_image_url(url)]
+    if not urls:
+        urls = url_regex(item)
+
+    return list(dict.fromkeys(urls))
 
 
 def save_bad_requests(broken_link):
@@ -50,72 +119,550 @@ def save_bad_requests(broken_link):
         f.write(broken_link)
 
 
-def fetcher(url: str, filename: str):
+def content_range(response) -> tuple:
+    """
+    Read the Content-Range header as (start, total), None when missing.
+
+    Args:
+        response: a 206 response.
+    """
+    match = CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+    if not match:
+        return None
+    start, total = match.groups()
+
+    return int(start), None if total == '*' else int(total)
+
+
+def is_image_type(response) -> bool:
+    """
+    Check if the Content-Type of a response can be an image.
+
+    Servers that do not tell the type, or answer a generic binary, are
+    trusted, the error pages in text or JSON are not.
+    Args:
+        response: the server response.
+    """
+    content_type = response.headers.get('Content-Type', '')
+    content_type = content_type.split(';')[0].strip().lower()
+    return not content_type or content_type in IMAGE_TYPES or \
+        content_type.startswith('image/')
+
+
+def decodes(filename: str) -> bool:
+    """
+    Check if an image file can be decoded.
+
+    Args:
+        filename: image file.
+    """
+    data = np.fromfile(filename, dtype=np.uint8)
+    return data.size > 0 and cv2.imdecode(data, cv2.IMREAD_UNCHANGED) is not None
+
+
+def intact(filename: str, verify: bool = False) -> bool:
+    """
+    Check if an image was saved whole.
+
+    The images saved by older versions were written straight to their name,
+    so an interrupted one may be empty or cut. An empty image is never kept
+    and, when verifying, neither is one that cannot be decoded.
+    Args:
+        filename: image file.
+        verify: also check that the image can be decoded.
+    """
+    return exists(filename) and getsize(filename) > 0 and \
+        (not verify or decodes(filename))
+
+
+def transfer(url: str, part: str) -> tuple:
+    """
+    Download an url into a partial file, resuming it when it exists.
+
+    The partial file is requested from its size on with a Range header and
+    written from scratch when the server ignores it.
+    Args:
+        url: url to download the image.
+        part: path of the partial file.
+    Returns:
+        the response, None when the server could not be reached, and the
+        expected size of the complete file, None when unknown.
+    """
+    offset = getsize(part) if exists(part) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else None
+    r = transport.get(url, headers=headers, stream=True)
+    if r is not None and r.status_code == 416 and offset:
+        r.close()
+        remove(part)
+        offset = 0
+        r = transport.get(url, stream=True)
+    if r is None or r.status_code not in (200, 206) or not is_image_type(r):
+        return r, None
+
+    mode, expected = 'wb', None
+    if r.status_code == 206:
+        start, total = content_range(r) or (None, None)
+        if start != offset:
+            r.close()
+            remove(part)
+            return r, None
+        mode, expected = 'ab', total
+    elif r.headers.get('Content-Length', '').isdigit():
+        expected = int(r.headers['Content-Length'])
+    with open(part, mode) as file:
+        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+            file.write(chunk)
+
+    return r, expected
+
+
+def fetcher(url: str, filename: str, verify: bool = False) -> int:
     """
     Download images.
 
+    The body is streamed to a PART_EXT file next to the image, checked and
+    then renamed to the image name, so an image file is always complete.
+    An interrupted transfer keeps its partial file and is resumed by the
+    next run.
     Args:
         url: url to download the image.
         filename: path of the file containing the images URL.
+        verify: also check that the image can be decoded.
     """
-    r = __request(url)
-    if r is not None and r.status_code == 200:
-        with open(filename, "wb") as file:
-            file.write(r.content)
-    elif r is not None:
-        bad_r = f"Image could not be saved - {r.status_code} - {url}"
-        print(bad_r)
-        save_bad_requests(bad_r + '\n')
+    part = f'{filename}{PART_EXT}'
+    try:
+        r, expected = transfer(url, part)
+    except requests.exceptions.RequestException as e:
+        r, bad_r = None, f"Image could not be saved - {e} - {url}"
     else:
-        bad_r = f"Image could not be saved - None - {url}"
-        print(bad_r)
-        save_bad_requests(bad_r + '\n')
+        size = getsize(part) if exists(part) else 0
+        if r is None:
+            bad_r = f"Image could not be saved - None - {url}"
+        elif r.status_code not in (200, 206):
+            bad_r = f"Image could not be saved - {r.status_code} - {url}"
+        elif not is_image_type(r):
+            bad_r = (f"Image could not be saved - "
+                     f"{r.headers.get('Content-Type')} - {url}")
+        elif not size or (expected is not None and size != expected):
+            if expected is not None and size > expected:
+                remove(part)
+            bad_r = (f"Image could not be saved - {size} of {expected} "
+                     f"bytes - {url}")
+        elif verify and not decodes(part):
+            remove(part)
+            bad_r = f"Image could not be saved - not decoded - {url}"
+        else:
+            replace(part, filename)
+            return size
+    if r is not None:
+        r.close()
+    print(bad_r)
+    save_bad_requests(bad_r + '\n')
+    return 0
+
+
+class HostScheduler:
+    """
+    Hand out download tasks round-robin across hosts.
+
+    A host is skipped while it already has `per_host` transfers in flight, so
+    a slow museum server cannot take every worker of the pool.
+    """
+
+    def __init__(self, tasks: list, per_host: int = MAX_CONNECTIONS_PER_HOST):
+        self.queues = {}
+        for url, filename in tasks:
+            host = urlparse(url).netloc
+            self.queues.setdefault(host, deque()).append((url, filename))
+        self.hosts = deque(self.queues)
+        self.inflight = dict.fromkeys(self.queues, 0)
+        self.per_host = per_host
+        self.cond = Condition()
+
+    def acquire(self):
+        """Block until a task of an available host exists, None when done."""
+        with self.cond:
+            while self.hosts:
+                for _ in range(len(self.hosts)):
+                    host = self.hosts[0]
+                    self.hosts.rotate(-1)
+                    if self.inflight[host] < self.per_host:
+                        task = self.queues[host].popleft()
+                        if not self.queues[host]:
+                            self.hosts.remove(host)
+                        self.inflight[host] += 1
+                        return host, task
+                self.cond.wait()
+            return None
+
+    def release(self, host: str):
+        """Free a transfer slot of the host."""
+        with self.cond:
+            self.inflight[host] -= 1
+            self.cond.notify_all()
+
+
+def download_all(tasks: list, workers: int = IMAGE_WORKERS,
+                 per_host: int = MAX_CONNECTIONS_PER_HOST,
+                 verify: bool = VERIFY_IMAGES) -> dict:
+    """
+    Download images with a bounded pool of workers.
+
+    Args:
+        tasks: list of (url, filename) tuples to be downloaded.
+        workers: number of simultaneous transfers.
+        per_host: maximum number of simultaneous transfers per host.
+        verify: check that every image can be decoded.
+    """
+    scheduler = HostScheduler(tasks, per_host)
+    stats = {'images': 0, 'bytes': 0, 'failed': 0}
+    progress = tqdm(total=len(tasks), unit='img')
+    start = time.monotonic()
+
+    def worker():
+        while True:
+            acquired = scheduler.acquire()
+            if acquired is None:
+                return
+            host, (url, filename) = acquired
+            try:
+                size = fetcher(url, filename, verify)
+            finally:
+                scheduler.release(host)
+            with scheduler.cond:
+                if size:
+                    stats['images'] += 1
+                    stats['bytes'] += size
+                else:
+                    stats['failed'] += 1
+                elapsed = max(time.monotonic() - start, 1e-9)
+                progress.set_postfix(
+                        {'MB/s': f"{stats['bytes'] / elapsed / 1e6:.2f}"})
+                progress.update()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(worker) for _ in range(workers)]:
+            future.result()
+    progress.close()
+
+    stats['seconds'] = time.monotonic() - start
+    stats['bytes_per_sec'] = stats['bytes'] / max(stats['seconds'], 1e-9)
+    stats['images_per_sec'] = stats['images'] / max(stats['seconds'], 1e-9)
+    print(f"Downloaded {stats['images']} images ({stats['failed']} failed) "
+          f"- {stats['bytes_per_sec']:.0f} bytes/s - "
+          f"{stats['images_per_sec']:.2f} images/s")
+
+    return stats
+
+
+def collect_tasks(jsons_path: str, images_path: str, files=None,
+                  keep=None, verify: bool = False) -> list:
+    """
+    Gather the images URLs that were not downloaded yet.
+
+    The images already saved are checked by intact, the broken ones are
+    downloaded again.
+    Args:
+        json_path: file path containing all JSON files.
+        images_path: path where the images will be saved.
+        files: only these JSON files, all of them by default.
+        keep: function of the file name and its JSON that tells if the item
+        images are downloaded, all of them by default.
+        verify: check that the saved images can be decoded.
+    """
+    tasks = []
+    for file in read_files(jsons_path) if files is None else files:
+        data = load_json(jsons_path, file)
+        if keep is not None and not keep(file, data):
+            continue
+        tasks.extend(image_tasks(file.split('.')[0], data, images_path))
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        saved = list(executor.map(partial(intact, verify=verify),
+                                  [img for _, img in tasks]))
+
+    return [task for task, ok in zip(tasks, saved) if not ok]
+
+
+def image_files(name_id: str, urls: list, images_path: str) -> list:
+    """
+    Get the files the images URLs of an item are saved to.
+
+    Args:
+        name_id: item acronym and id, as MINC_9999.
+        urls: the item images URLs, from image_urls.
+        images_path: path where the images will be saved.
+    """
+    return [f'{join(images_path, name_id)}_{i}.'
+            f'{urlparse(url).path.split(".")[-1]}'
+            for i, url in enumerate(urls)]
+
+
+def image_tasks(name_id: str, data: dict, images_path: str) -> list:
+    """
+    Get the images URLs of an item and the files they are saved to.
+
+    Args:
+        name_id: item acronym and id, as MINC_9999.
+        data: the item JSON.
+        images_path: path where the images will be saved.
+    """
+    urls = image_urls(data)
+
+    return list(zip(urls, image_files(name_id, urls, images_path)))
+
+
+def placed_folders(images_path: str) -> list:
+    """
+    Get the folders where the images of an images path are placed.
+
+    Args:
+        images_path: path where the images are saved.
+    """
+    folders = [images_path, DATA_INTERIM_IMAGES, DATA_PROCD_IMAGES]
+    if isdir(DATA_PROCD_MODEL):
+        folders.extend(join(DATA_PROCD_MODEL, label)
+                       for label in listdir(DATA_PROCD_MODEL))
+
+    return [folder for folder in folders if isdir(folder)]
+
+
+def thumbnail_sizes(item: dict) -> dict:
+    """
+    Get the width and height of every Tainacan thumbnail size by its url.
+
+    Args:
+        item: the item JSON.
+    """
+    thumbnail = item.get('thumbnail')
+    if not isinstance(thumbnail, dict):
+        return {}
+    sizes = {}
+    for size in thumbnail.values():
+        if isinstance(size, list) and len(size) > 2 and is_image_url(size[0]):
+            try:
+                sizes[size[0]] = (int(size[1]), int(size[2]))
+            except (TypeError, ValueError):
+                continue
+
+    return sizes
+
+
+def image_size(filename: str) -> tuple:
+    """
+    Get the width and height of an image file, None when it does not decode.
+
+    Args:
+        filename: image file.
+    """
+    image = cv2.imdecode(np.fromfile(filename, dtype=np.uint8),
+                         cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+
+    return image.shape[1], image.shape[0]
+
+
+def saved_url(filename: str, urls: list, sizes: dict) -> str:
+    """
+    Find the url an image of an item was downloaded from.
+
+    The older versions numbered the images in the order of a set of every
+    url found in the item, so the number tells nothing. The extension comes
+    from the url, so the url is found when it is the only one with that
+    extension, or else the only thumbnail size with the image dimensions.
+    Args:
+        filename: image file.
+        urls: every url the image can come from.
+        sizes: width and height of the thumbnail sizes by url.
+    Returns:
+        the url, None when the image cannot be mapped to a single one.
+    """
+    ext = filename.split('.')[-1]
+    urls = [url for url in urls if urlparse(url).path.split('.')[-1] == ext]
+    if len(urls) == 1:
+        return urls[0]
+    size = image_size(filename)
+    urls = [url for url in urls if size is not None and sizes.get(url) == size]
+
+    return urls[0] if len(urls) == 1 else None
+
+
+def item_renumbering(name_id: str, data: dict, names: list,
+                     images_path: str) -> tuple:
+    """
+    Map the saved images of an item to the names image_tasks gives them.
+
+    Args:
+        name_id: item acronym and id, as MINC_9999.
+        data: the item JSON.
+        names: names of the saved images of the item.
+        images_path: path where the images are saved.
+    Returns:
+        the new name of every image that is renamed, by its name, and the
+        names of the stale images.
+    """
+    wanted = {url: basename(img)
+              for url, img in image_tasks(name_id, data, images_path)}
+    urls = list(dict.fromkeys(url_regex(data) + list(wanted)))
+    sizes = thumbnail_sizes(data)
+    mapped, stale = defaultdict(list), []
+    for name in sorted(names):
+        target = wanted.get(saved_url(join(images_path, name), urls, sizes))
+        if target is None:
+            stale.append(name)
+        else:
+            mapped[target].append(name)
+    renames = {}
+    for target, mapped_names in mapped.items():
+        kept = target if target in mapped_names else mapped_names[0]
+        if kept != target:
+            renames[kept] = target
+        stale.extend(name for name in mapped_names if name != kept)
+
+    return renames, stale
+
+
+def renumbering(jsons_path: str, images_path: str) -> tuple:
+    """
+    Map the saved images to the names image_tasks gives them.
+
+    Each image is mapped to its url by saved_url and renamed to the name of
+    that url. The images that cannot be mapped, the ones of an url that is
+    not downloaded anymore, as the smaller thumbnail sizes, and the extra
+    copies of an url are stale.
+    Args:
+        jsons_path: file path containing all JSON files.
+        images_path: path where the images are saved.
+    Returns:
+        the new name of every image that is renamed, by its name, and the
+        names of the stale images.
+    """
+    saved = defaultdict(list)
+    if isdir(images_path):
+        for name in listdir(images_path):
+            if not name.endswith(PART_EXT):
+                saved[image_item_id(name)].append(name)
+    renames, stale = {}, []
+    for file in read_files(jsons_path) if saved and isdir(jsons_path) else []:
+        name_id = file.split('.')[0]
+        if name_id in saved:
+            item_renames, item_stale = item_renumbering(
+                name_id, load_json(jsons_path, file), saved[name_id],
+                images_path)
+            renames.update(item_renames)
+            stale.extend(item_stale)
+
+    return renames, stale
+
+
+def renumber(renames: dict, stale: list, images_path: str,
+             marker: str = IMAGES_NUMBERING):
+    """
+    Rename the images of a renumbering in every folder they were placed in.
+
+    The stale images are removed first and the others are moved through a
+    temporary name, since an image may take the name of another one. A marker
+    file records that the images path follows the stable numbering.
+    Args:
+        renames: new name of every image that is renamed, by its name.
+        stale: names of the images that are removed.
+        images_path: path where the images are saved.
+        marker: file that records that the images were renumbered.
+    """
+    stale = set(stale)
+    for folder in placed_folders(images_path):
+        present = set(listdir(folder))
+        for name in stale & present:
+            remove(join(folder, name))
+        moving = {old: new for old, new in renames.items() if old in present}
+        for old in moving:
+            replace(join(folder, old), join(folder, f'{old}.renumber'))
+        for old, new in moving.items():
+            replace(join(folder, f'{old}.renumber'), join(folder, new))
+    mark_numbering(marker)
+
+
+def mark_numbering(marker: str = IMAGES_NUMBERING):
+    """
+    Record that the images follow the stable numbering.
+
+    Args:
+        marker: file that records that the images were renumbered.
+    """
+    makedirs(dirname(marker), exist_ok=True)
+    with open(marker, 'w', encoding='utf8') as f:
+        f.write('stable\n')
+
+
+def check_numbering(images_path: str, marker: str = IMAGES_NUMBERING) -> bool:
+    """
+    Check if the saved images follow the stable numbering.
+
+    An empty images path does, and the marker is written then, so only the
+    images saved by older versions warn to run renumber_images.
+    Args:
+        images_path: path where the images are saved.
+        marker: file that records that the images were renumbered.
+    """
+    if exists(marker):
+        return True
+    if isdir(images_path) and listdir(images_path):
+        print("===> NOTE: The images may be numbered as older versions did, "
+              "run renumber_images once to rename them.")
+        return False
+    mark_numbering(marker)
+
+    return True
 
 
-def iterate_all(jsons_path: str, images_path: str):
+def iterate_all(jsons_path: str, images_path: str,
+                workers: int = IMAGE_WORKERS, files=None,
+                verify: bool = VERIFY_IMAGES, keep=None):
     """
     Go throught all JSON files and download the images.
 
     Args:
         json_path: file path containing all JSON files.
         images_path: path where the images will be saved.
+        workers: number of simultaneous transfers.
+        files: only these JSON files, all of them by default.
+        verify: check that every image can be decoded.
+        keep: function of the file name and its JSON that tells if the item
+        images are downloaded, all of them by default.
     """
     if not isdir(DATA_RAW_IMAGES):
         makedirs(DATA_RAW_IMAGES, exist_ok=True)
+    check_numbering(images_path)
 
-    allfiles = read_files(jsons_path)
-    for file in tqdm(allfiles):
-        with open(join(jsons_path, file), encoding='utf-8') as filename:
-            data = load(filename)
-            name_id = re.split(r'[/.]', filename.name)[-2]
-            i = 0
-            if url_regex(data):
-                for item in list(set(url_regex(data))):
-                    ext = item.split('.')[-1].rstrip('\n')
-                    img = f'{join(images_path, name_id)}_{i}.{ext}'
-                    if not exists(img):
-                        fetcher(item, img)
-                    i += 1
+    return download_all(collect_tasks(jsons_path, images_path, files, keep,
+                                      verify),
+                        workers, verify=verify)
 
 
-def get_images():
+def get_images(workers: int = IMAGE_WORKERS, verify: bool = VERIFY_IMAGES,
+               keep=None):
     """
     Download images from all JSON files.
 
     Args:
-        jsons_path: directory with all JSON files.
-        images_path: directory where all images will be stored.
+        workers: number of simultaneous transfers.
+        verify: check that every image can be decoded.
+        keep: function of the file name and its JSON that tells if the item
+        images are downloaded, all of them by default.
     """
     if not isdir(DATA_RAW_JSONS):
         makedirs(DATA_RAW_JSONS, exist_ok=True)
         print("===> NOTE: It was necessary to download the JSON files first.")
         get_jsons()
         print('===> JSON files download has been completed.')
-        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES)
+        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES, workers, verify=verify,
+                    keep=keep)
     elif listdir(DATA_RAW_JSONS) == []:
         print("===> NOTE: It was necessary to download the JSON files first.")
         get_jsons()
         print('===> JSON files download has been completed.')
-        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES)
+        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES, workers, verify=verify,
+                    keep=keep)
     else:
-        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES)
+        iterate_all(DATA_RAW_JSONS, DATA_RAW_IMAGES, workers, verify=verify,
+                    keep=keep)
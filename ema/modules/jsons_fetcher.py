@@ -1,13 +1,17 @@
 """Download text data from museum's website."""
 
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import json
 from os import makedirs
 from os.path import exists, isdir, join
-import time
+from urllib.parse import urlparse
 from tqdm import tqdm
-import requests
-from helpers.constants import MUSEUM_DICT, DATA_RAW_JSONS
-from helpers import auxiliar
+from helpers.constants import (MUSEUM_DICT, DATA_RAW_JSONS, MAX_CONNECTIONS,
+                               MAX_CONNECTIONS_PER_HOST, HARVEST_STATE)
+from helpers import auxiliar, packstore, transport
 
 
 def savefile(filename: str, data: dict):
@@ -29,18 +33,6 @@ def savefile(filename: str, data: dict):
                     )
 
 
-def __request(url, try_count=10):
-    s = requests.Session()
-    for error_count in range(0, try_count):
-        try:
-            return s.get(url)
-        except requests.exceptions.ConnectionError as e:
-            print(f'Cannot connect to url {url} trying again \
-                    ({error_count}/{try_count} - {e})...')
-            time.sleep(60)
-            continue
-
-
 def fetcher_perpage(base_url: str, acr: str, page_num: int):
     """
     Go throught every page and download the JSON file.
@@ -52,24 +44,265 @@ def fetcher_perpage(base_url: str, acr: str, page_num: int):
     if not isdir(DATA_RAW_JSONS):
         makedirs(DATA_RAW_JSONS, exist_ok=True)
 
-    r = __request(f'{base_url}{page_num}')
-    assert r.status_code == 200, (f"Não foi possível acessar o acervo \
-            {r.content} - {f'{base_url}{page_num}'}/{r.content}")
-    for item in range(0, len(r.json()['items'])):
-        data = r.json()['items'][item]
-        object_id = r.json()['items'][item]['id']
-        filename = join(DATA_RAW_JSONS, f'{acr}_{object_id}.json')
+    save_items(acr, fetch_page(base_url, page_num))
+
+    return True
+
+
+def fetch_page(base_url: str, page_num: int) -> list:
+    """
+    Download the items of a page.
+
+    Args:
+        base_url: url of the museum.
+        page_num: number of the page.
+    """
+    r = transport.get(f'{base_url}{page_num}')
+    assert r is not None and r.status_code == 200, (
+            f"Não foi possível acessar o acervo - {base_url}{page_num}")
+
+    return r.json()['items']
+
+
+def save_items(acr: str, items: list):
+    """
+    Save every item of a page as its own JSON file.
+
+    When the packed storage is enabled the items are appended to the museum
+    shard instead, see helpers.packstore.
+    Args:
+        acr: museum acronym used as the file name prefix.
+        items: list of items from the museum's page response.
+    """
+    if packstore.enabled():
+        packstore.append(DATA_RAW_JSONS, acr, items)
+        return
+    for data in items:
+        filename = join(DATA_RAW_JSONS, f'{acr}_{data["id"]}.json')
         savefile(filename, data)
 
+
+async def __fetch_page(executor, limits, base_url, acr, page_num):
+    global_limit, host_limits = limits
+    async with global_limit, host_limits[urlparse(base_url).netloc]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+                executor, fetcher_perpage, base_url, acr, page_num)
+
+
+async def harvest(museum_dict: dict, npages: dict,
+                  max_connections: int = MAX_CONNECTIONS,
+                  max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+                  first_pages: dict = None):
+    """
+    Download the pages of every museum concurrently.
+
+    Each page is written to disk as soon as its response arrives. The number
+    of simultaneous requests is capped globally and per museum host, since
+    some museums share the same server.
+    Args:
+        museum_dict: a dictionary with the Museum acronym and base url.
+        npages: total number of pages of each museum acronym.
+        max_connections: maximum number of requests in flight.
+        max_per_host: maximum number of requests in flight to the same host.
+        first_pages: items of the first page already downloaded by acronym.
+    """
+    first_pages = first_pages or {}
+    for acr, items in first_pages.items():
+        save_items(acr, items)
+    limits = (asyncio.Semaphore(max_connections),
+              defaultdict(lambda: asyncio.Semaphore(max_per_host)))
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        tasks = [__fetch_page(executor, limits, url, acr, page)
+                 for acr, url in museum_dict.items()
+                 for page in range(2 if acr in first_pages else 1,
+                                   int(npages[acr]) + 1)]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+            await task
+
     return True
 
 
-def get_jsons():
-    """Download JSON files from IBRAM Museums."""
-    npages = auxiliar.pages(MUSEUM_DICT)
+def load_state() -> dict:
+    """Load the high-water mark of every museum from the last refresh."""
+    if not exists(HARVEST_STATE):
+        return {}
+    with open(HARVEST_STATE, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_state(state: dict):
+    """
+    Save the high-water mark of every museum.
+
+    Args:
+        state: dictionary with the museum acronym and its mark.
+    """
+    with open(HARVEST_STATE, 'w', encoding='utf-8') as file:
+        json.dump(state, file, sort_keys=True, indent=4)
+
+
+def parse_date(value) -> datetime:
+    """
+    Parse an ISO date, as the creation_date of the items.
+
+    Args:
+        value: the date, the aware ones are converted to naive UTC.
+    Returns:
+        the date, None when it is missing or cannot be parsed.
+    """
+    try:
+        date = datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
+
+
+def is_known(acr: str, item: dict, mark: dict) -> bool:
+    """
+    Check if an item was already harvested, by its file or the mark id.
+
+    Args:
+        acr: museum acronym.
+        item: item from the museum's page response.
+        mark: high-water mark of the museum, newest id and date seen.
+    """
+    file = f'{acr}_{item["id"]}.json'
+    if exists(join(DATA_RAW_JSONS, file)) or \
+            packstore.contains(DATA_RAW_JSONS, file):
+        return True
+    return bool(mark) and item['id'] == mark.get('id')
+
+
+def is_older(item: dict, mark: dict) -> bool:
+    """
+    Check if an item was created before the high-water mark.
+
+    The items created at the same time as the mark are not older, and
+    neither are the ones whose date is missing or cannot be parsed.
+    Args:
+        item: item from the museum's page response.
+        mark: high-water mark of the museum, newest id and date seen.
+    """
+    date = parse_date(item.get('creation_date'))
+    mark_date = parse_date(mark.get('date')) if mark else None
+
+    return date is not None and mark_date is not None and date < mark_date
+
+
+def refresh_museum(base_url: str, acr: str, mark: dict) -> dict:
+    """
+    Download only the items added since the last refresh.
+
+    The collections are ordered by date, newest first, so the paging stops
+    at the first page whose items were all harvested, by their file or the
+    mark id, or created before the mark date. Items created before the mark
+    date are not downloaded, the ones without a date always are, so a refresh
+    after the raw files were removed still ends at the mark. The first page
+    is requested
+    with the ETag/Last-Modified of the last refresh and a 304 answer ends
+    the museum with one request. Items edited after being harvested are not
+    downloaded again, the same as a full harvest.
+    Args:
+        base_url: url of the museum.
+        acr: museum acronym.
+        mark: high-water mark of the museum from the last refresh.
+    """
+    headers = {}
+    if mark.get('etag'):
+        headers['If-None-Match'] = mark['etag']
+    if mark.get('last_modified'):
+        headers['If-Modified-Since'] = mark['last_modified']
+    r = transport.get(f'{base_url}1', headers=headers)
+    assert r is not None and r.status_code in (200, 304), (
+            f"Não foi possível acessar o acervo {acr} - {base_url}1")
+    if r.status_code == 304:
+        return mark
+
+    items = r.json()['items']
+    new_mark = dict(mark)
+    if items:
+        new_mark['id'] = items[0]['id']
+        new_mark['date'] = str(items[0].get('creation_date', ''))
+    new_mark['etag'] = r.headers.get('ETag')
+    new_mark['last_modified'] = r.headers.get('Last-Modified')
+    total = int(r.headers.get('x-wp-totalpages', 1))
+    page_num = 1
+    while True:
+        known = [is_known(acr, i, mark) or is_older(i, mark) for i in items]
+        save_items(acr, [i for i, k in zip(items, known) if not k])
+        page_num += 1
+        if all(known) or page_num > total:
+            break
+        r = transport.get(f'{base_url}{page_num}')
+        assert r is not None and r.status_code == 200, (
+                f"Não foi possível acessar o acervo {acr} - "
+                f"{base_url}{page_num}")
+        items = r.json()['items']
+
+    return new_mark
+
+
+def refresh(museum_dict: dict, max_connections: int = MAX_CONNECTIONS):
+    """
+    Download the new items of every museum since the last refresh.
+
+    Args:
+        museum_dict: a dictionary with the Museum acronym and base url.
+        max_connections: number of museums refreshed at once.
+    """
+    if not isdir(DATA_RAW_JSONS):
+        makedirs(DATA_RAW_JSONS, exist_ok=True)
+    state = load_state()
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        futures = {acr: executor.submit(refresh_museum, url, acr,
+                                        state.get(acr, {}))
+                   for acr, url in museum_dict.items()}
+        for acr, future in tqdm(futures.items()):
+            state[acr] = future.result()
+            save_state(state)
+
+    return True
+
+
+def get_jsons(concurrent: bool = False,
+              max_connections: int = MAX_CONNECTIONS,
+              max_per_host: int = MAX_CONNECTIONS_PER_HOST,
+              incremental: bool = False):
+    """
+    Download JSON files from IBRAM Museums.
+
+    Args:
+        concurrent: fetch the pages of all museums at once instead of one
+        page at a time.
+        max_connections: maximum number of requests in flight when concurrent.
+        max_per_host: maximum number of requests in flight to the same host
+        when concurrent.
+        incremental: download only the items added since the last refresh.
+    """
+    if concurrent:
+        transport.configure(per_host=max_per_host)
+    if incremental:
+        return refresh(MUSEUM_DICT, max_connections if concurrent else 1)
+
+    first_pages = {}
+    npages = auxiliar.pages(MUSEUM_DICT, first_pages)
+    if not isdir(DATA_RAW_JSONS):
+        makedirs(DATA_RAW_JSONS, exist_ok=True)
+    if concurrent:
+        return asyncio.run(harvest(MUSEUM_DICT, npages, max_connections,
+                                   max_per_host, first_pages))
+
     for acr, url in MUSEUM_DICT.items():
         print('Museum ACR:', acr)
-        for page in tqdm(range(1, int(npages[acr]) + 1)):
+        start = 1
+        if acr in first_pages:
+            save_items(acr, first_pages[acr])
+            start = 2
+        for page in tqdm(range(start, int(npages[acr]) + 1)):
             fetcher_perpage(url, acr, page)
 
     return True
@@ -0,0 +1,347 @@
+"""Export the model database as training shards."""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from hashlib import sha1
+from io import BytesIO
+from json import dump, dumps, load
+import os
+from os.path import isdir, isfile, join
+import tarfile
+import cv2
+import numpy as np
+from tqdm import tqdm
+from helpers.auxiliar import load_json
+from helpers.constants import (CLASSIFY_WORKERS, DATA_EXPORT, DATA_PROCD_MODEL,
+                               DATA_PROCD_TEXT, EXPORT_SIZE, JPEG_QUALITY,
+                               PART_EXT, SHARD_SAMPLES, SPLIT_TEST, SPLIT_VAL)
+from modules.classify_images import image_item_id
+from modules import catalogue
+
+SPLITS = ['train', 'val', 'test']
+
+# options of an export, see export
+OPTIONS = {
+        'size': EXPORT_SIZE,
+        'shard_samples': SHARD_SAMPLES,
+        'val': SPLIT_VAL,
+        'test': SPLIT_TEST,
+        'workers': CLASSIFY_WORKERS
+        }
+
+
+def split_of(item_id: str, val: float = SPLIT_VAL,
+             test: float = SPLIT_TEST) -> str:
+    """
+    Get the split of an item from the hash of its id.
+
+    The same item always falls in the same split, whatever the other items,
+    so all images of an item are in one split.
+    Args:
+        item_id: item acronym and id, as MINC_9999.
+        val: share of the items in the validation split.
+        test: share of the items in the test split.
+    """
+    bucket = int(sha1(item_id.encode('utf-8')).hexdigest()[:8], 16) / 2 ** 32
+    if bucket < test:
+        return 'test'
+    if bucket < test + val:
+        return 'val'
+    return 'train'
+
+
+def fit(image, size: int):
+    """
+    Resize an image to a square, scaling its shorter side and cropping.
+
+    Args:
+        image: image array.
+        size: side of the square image.
+    """
+    height, width = image.shape[:2]
+    scale = size / min(height, width)
+    resized = cv2.resize(image, (max(size, round(width * scale)),
+                                 max(size, round(height * scale))),
+                         interpolation=cv2.INTER_AREA if scale < 1
+                         else cv2.INTER_LINEAR)
+    top = (resized.shape[0] - size) // 2
+    left = (resized.shape[1] - size) // 2
+
+    return resized[top:top + size, left:left + size]
+
+
+def prepare(path: str, size: int, encode: bool) -> tuple:
+    """
+    Decode, resize and convert an image to RGB.
+
+    Args:
+        path: image file.
+        size: side of the square image.
+        encode: give the image as JPEG bytes instead of an array.
+    Returns:
+        the image and the sum and squared sum of its channels, None when it
+        cannot be decoded.
+    """
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    image = fit(image, size)
+    pixels = image.reshape(-1, 3)[:, ::-1].astype(np.float64) / 255
+    sums = (pixels.sum(axis=0), (pixels ** 2).sum(axis=0))
+    if encode:
+        _, data = cv2.imencode('.jpg', image,
+                               [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return data.tobytes(), sums
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), sums
+
+
+def caption(item_id: str, fields: dict) -> str:
+    """
+    Get the caption of an item, its title or else its denomination.
+
+    Args:
+        item_id: item acronym and id, as MINC_9999.
+        fields: catalogued texts by field and file.
+    """
+    file = f'{item_id}.json'
+    texts = [fields[field].get(file) for field in ('title', 'denomination')]
+    if None in texts and isfile(join(DATA_PROCD_TEXT, file)):
+        data = load_json(DATA_PROCD_TEXT, file)
+        acr = item_id.split('_')[0]
+        texts = [catalogue.field_text(data, acr, field)
+                 for field in ('title', 'denomination')]
+
+    return next((text for text in texts if text), '')
+
+
+def label_images(model_db: str, labels: list) -> dict:
+    """
+    Get the path and the label ids of each image of the label folders.
+
+    Args:
+        model_db: path with the label folders.
+        labels: label folders, whose position is the label id.
+    """
+    images = {}
+    for label_id, label in enumerate(labels):
+        for file in sorted(os.listdir(join(model_db, label))):
+            path = join(model_db, label, file)
+            if isfile(path) and not file.endswith(PART_EXT):
+                images.setdefault(file, {'path': path, 'labels': []})
+                images[file]['labels'].append(label_id)
+
+    return images
+
+
+def collect_samples(model_db: str, val: float = SPLIT_VAL,
+                    test: float = SPLIT_TEST) -> tuple:
+    """
+    Gather the images of the label folders with their labels and split.
+
+    An image placed in many label folders is a single sample with all of
+    them. The samples of each split are ordered by the hash of their name,
+    the same on every export.
+    Args:
+        model_db: path with the label folders.
+        val: share of the items in the validation split.
+        test: share of the items in the test split.
+    Returns:
+        the label names, whose position is the label id, and the samples of
+        each split.
+    """
+    labels = sorted(f for f in os.listdir(model_db) if isdir(join(model_db, f)))
+    images = label_images(model_db, labels)
+    items = {image_item_id(file) for file in images}
+    files = [f'{item}.json' for item in items]
+    fields = {field: catalogue.lookup(field, files)
+              for field in ('title', 'denomination')}
+    captions = {item: caption(item, fields) for item in items}
+    samples = {split: [] for split in SPLITS}
+    for file, image in images.items():
+        item = image_item_id(file)
+        samples[split_of(item, val, test)].append({
+            'key': file.rsplit('.', 1)[0], 'item': item, 'path': image['path'],
+            'labels': image['labels'], 'caption': captions[item]})
+    for split in SPLITS:
+        samples[split].sort(key=lambda s: sha1(s['key'].encode()).hexdigest())
+
+    return labels, samples
+
+
+def add_member(tar: tarfile.TarFile, name: str, data: bytes):
+    """Add a file to a tar with fixed metadata, so shards are reproducible."""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0
+    tar.addfile(info, BytesIO(data))
+
+
+def write_webdataset(dest: str, split: str, samples: list, results,
+                     shard_samples: int) -> tuple:
+    """
+    Write the samples of a split as WebDataset tar shards.
+
+    Each sample has its resized image as .jpg, its first label id as .cls,
+    its caption as .txt and its item, labels and caption as .json.
+    Args:
+        dest: export folder.
+        split: split name.
+        samples: samples of the split.
+        results: prepared images of the samples, in order.
+        shard_samples: samples per shard.
+    Returns:
+        the exported samples and the shard file names.
+    """
+    exported, shards, tar = [], [], None
+    for sample, result in zip(samples, results):
+        if result is None:
+            continue
+        if len(exported) % shard_samples == 0:
+            if tar:
+                tar.close()
+            shards.append(f'{split}-{len(shards):06d}.tar')
+            tar = tarfile.open(join(dest, shards[-1]), 'w')
+        key = sample['key']
+        add_member(tar, f'{key}.jpg', result[0])
+        add_member(tar, f'{key}.cls', str(sample['labels'][0]).encode())
+        add_member(tar, f'{key}.txt', sample['caption'].encode('utf-8'))
+        add_member(tar, f'{key}.json', dumps(
+            {k: sample[k] for k in ('item', 'labels', 'caption')},
+            ensure_ascii=False).encode('utf-8'))
+        exported.append((sample, result[1]))
+    if tar:
+        tar.close()
+
+    return exported, shards
+
+
+def write_memmap(dest: str, split: str, samples: list, results,
+                 size: int) -> tuple:
+    """
+    Write the samples of a split as an uint8 array and an index.
+
+    The images are a (samples, size, size, 3) RGB .npy file, which can be
+    opened with numpy.load(mmap_mode='r') without copies, and the index has
+    a JSON line per row with its key, item, labels and caption.
+    Args:
+        dest: export folder.
+        split: split name.
+        samples: samples of the split.
+        results: prepared images of the samples, in order.
+        size: side of the square images.
+    Returns:
+        the exported samples and the array and index file names.
+    """
+    files = [f'{split}_images.npy', f'{split}_index.jsonl']
+    array = np.lib.format.open_memmap(join(dest, files[0]), mode='w+',
+                                      dtype=np.uint8,
+                                      shape=(len(samples), size, size, 3))
+    exported = []
+    with open(join(dest, files[1]), 'w', encoding='utf-8') as index:
+        for sample, result in zip(samples, results):
+            if result is None:
+                continue
+            array[len(exported)] = result[0]
+            index.write(dumps({k: sample[k] for k in
+                               ('key', 'item', 'labels', 'caption')},
+                              ensure_ascii=False) + '\n')
+            exported.append((sample, result[1]))
+    array.flush()
+    del array
+    if len(exported) < len(samples):
+        # drop the rows of the images that could not be decoded
+        full = np.load(join(dest, files[0]), mmap_mode='r')
+        np.save(join(dest, f'{files[0]}.tmp.npy'), full[:len(exported)])
+        del full
+        os.replace(join(dest, f'{files[0]}.tmp.npy'), join(dest, files[0]))
+
+    return exported, files
+
+
+def remove_previous(dest: str):
+    """
+    Remove the files of the previous export at a folder.
+
+    Args:
+        dest: export folder.
+    """
+    if not isfile(join(dest, 'meta.json')):
+        return
+    with open(join(dest, 'meta.json'), encoding='utf-8') as f:
+        previous = load(f)
+    for split in previous['splits'].values():
+        for file in split['files']:
+            if isfile(join(dest, file)):
+                os.remove(join(dest, file))
+
+
+def normalization(exported: list, size: int) -> dict:
+    """
+    Get the RGB mean and standard deviation of the exported samples.
+
+    Args:
+        exported: samples and the channel sums of their images.
+        size: side of the square images.
+    """
+    pixels = len(exported) * size * size
+    total = sum(sums for _, (sums, _) in exported)
+    squares = sum(sq for _, (_, sq) in exported)
+    mean = total / pixels
+
+    return {'mean': mean.tolist(),
+            'std': np.sqrt(squares / pixels - mean ** 2).tolist()}
+
+
+def export(fmt: str = 'webdataset', dest: str = DATA_EXPORT,
+           model_db: str = DATA_PROCD_MODEL, options: dict = None) -> dict:
+    """
+    Export the model database as training shards.
+
+    The images are decoded, resized and converted in a process pool and
+    written in order by this process. A meta.json file at the export folder
+    has the label names, the files and size of each split and the RGB mean
+    and standard deviation of the train split, to normalize the images. The
+    files of the previous export at the folder are replaced.
+    Args:
+        fmt: one of EXPORT_FORMATS.
+        dest: export folder.
+        model_db: path with the label folders.
+        options: any of OPTIONS, the others keep their default.
+            size: side of the square images.
+            shard_samples: samples per tar shard.
+            val: share of the items in the validation split.
+            test: share of the items in the test split.
+            workers: number of processes preparing the images.
+    """
+    assert not set(options or {}) - set(OPTIONS), 'Unknown export options'
+    options = {**OPTIONS, **(options or {})}
+    assert 0 <= options['val'] and 0 <= options['test'] and \
+        options['val'] + options['test'] < 1, 'Invalid split shares'
+    labels, samples = collect_samples(model_db, options['val'],
+                                      options['test'])
+    os.makedirs(dest, exist_ok=True)
+    remove_previous(dest)
+    worker = partial(prepare, size=options['size'],
+                     encode=fmt == 'webdataset')
+    meta = {'format': fmt, 'size': options['size'], 'labels': labels,
+            'splits': {}}
+    with ProcessPoolExecutor(options['workers']) as executor:
+        for split in SPLITS:
+            results = tqdm(executor.map(worker, [s['path'] for s in
+                                                  samples[split]],
+                                        chunksize=16),
+                           total=len(samples[split]), desc=split)
+            if fmt == 'webdataset':
+                exported, files = write_webdataset(
+                    dest, split, samples[split], results,
+                    options['shard_samples'])
+            else:
+                exported, files = write_memmap(dest, split, samples[split],
+                                               results, options['size'])
+            meta['splits'][split] = {'samples': len(exported), 'files': files}
+            if split == 'train' and exported:
+                meta.update(normalization(exported, options['size']))
+    with open(join(dest, 'meta.json'), 'w', encoding='utf-8') as f:
+        dump(meta, f, indent=4, ensure_ascii=False)
+
+    return meta
@@ -0,0 +1,259 @@
+"""Streaming database creation, each item goes through all stages at once."""
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from os import makedirs
+from os.path import getsize, join
+from queue import Empty, Full, Queue
+from threading import Event, Lock
+import time
+from tqdm import tqdm
+from helpers.auxiliar import copy_files, pages
+from helpers.constants import (DATA_INTERIM_IMAGES, DATA_INTERIM_TEXT,
+                               DATA_PROCD_IMAGES, DATA_PROCD_MODEL,
+                               DATA_PROCD_TEXT, DATA_RAW_IMAGES,
+                               DATA_RAW_JSONS, IMAGE_WORKERS, MAX_CONNECTIONS,
+                               STREAM_QUEUE, VERIFY_IMAGES)
+from modules.classify_jsons import classify_item
+from modules.images_fetcher import fetcher, image_tasks, intact
+from modules.jsons_fetcher import fetch_page, save_items
+
+# sentinel that ends a queue consumer
+DONE = None
+
+# settings of a streaming run, see stream
+SETTINGS = {
+        'max_connections': MAX_CONNECTIONS,
+        'workers': IMAGE_WORKERS,
+        'verify': VERIFY_IMAGES,
+        'queue_size': STREAM_QUEUE,
+        'only_model': False
+        }
+
+
+def put(queue: Queue, item, stop: Event):
+    """
+    Put an item in a bounded queue, waiting while it is full.
+
+    Args:
+        queue: the queue.
+        item: the item.
+        stop: event set when another stage failed, the wait is abandoned.
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return
+        except Full:
+            continue
+    raise RuntimeError('Streaming stopped')
+
+
+def get(queue: Queue, stop: Event):
+    """
+    Get an item from a queue, waiting while it is empty.
+
+    Args:
+        queue: the queue.
+        stop: event set when another stage failed, the wait is abandoned.
+    """
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            continue
+    raise RuntimeError('Streaming stopped')
+
+
+def route(acr: str, data: dict, thesauro: str, field: str,
+          labels: list) -> list:
+    """
+    Get the folders an item and its images are placed in.
+
+    The item goes through the same filters as the staged database creation:
+    the thesaurus, the target labels and the model labels.
+    Args:
+        acr: museum acronym.
+        data: the item JSON.
+        thesauro: thesaurus compared with the classification field.
+        field: text field compared with the labels.
+        labels: list of (label, folder) tuples of the model database.
+    Returns:
+        list of (JSON folder, images folder) tuples, the JSON folder is None
+        for the model database.
+    """
+    thesaurus, targets, model = classify_item(acr, data, thesauro, field,
+                                              labels)
+    folders = []
+    if thesaurus:
+        folders.append((DATA_INTERIM_TEXT, DATA_INTERIM_IMAGES))
+    if targets:
+        folders.append((DATA_PROCD_TEXT, DATA_PROCD_IMAGES))
+    folders.extend((None, join(DATA_PROCD_MODEL, folder)) for folder in model)
+
+    return folders
+
+
+class Flow:
+    """
+    Queues and counters shared by the stages of a streaming run.
+
+    The items queue joins the page downloads to the classification and the
+    images queue joins the classification to the image transfers. The stop
+    event is set when a stage fails, so the others stop waiting on them.
+    """
+
+    def __init__(self, settings: dict):
+        self.settings = settings
+        self.items = Queue(settings['queue_size'])
+        self.images = Queue(settings['queue_size'])
+        self.stop = Event()
+        self.lock = Lock()
+        self.stats = {'items': 0, 'classified': 0, 'images': 0, 'failed': 0}
+        self.progress = tqdm(unit='item')
+
+    def put(self, queue: Queue, item):
+        """Put an item in one of the queues, see put."""
+        put(queue, item, self.stop)
+
+    def get(self, queue: Queue):
+        """Get an item from one of the queues, see get."""
+        return get(queue, self.stop)
+
+    def count(self, **counts):
+        """Add to the run counters and show them on the progress bar."""
+        with self.lock:
+            for key, amount in counts.items():
+                self.stats[key] += amount
+            self.progress.update(counts.get('items', 0))
+            self.progress.set_postfix({'images': self.stats['images']})
+
+
+def harvest(flow: Flow, museum_dict: dict, npages: dict, first_pages: dict):
+    """
+    Download the museum pages and queue their items.
+
+    Args:
+        flow: the streaming run.
+        museum_dict: a dictionary with the Museum acronym and base url.
+        npages: number of pages of each museum.
+        first_pages: first page items of the museums, already downloaded.
+    """
+    def fetch(acr, url, page):
+        items = first_pages[acr] if page == 1 and acr in first_pages \
+            else fetch_page(url, page)
+        save_items(acr, items)
+        for data in items:
+            flow.put(flow.items, (acr, data))
+
+    try:
+        with ThreadPoolExecutor(
+                max_workers=flow.settings['max_connections']) as executor:
+            futures = [executor.submit(fetch, acr, url, page)
+                       for acr, url in museum_dict.items()
+                       for page in range(1, int(npages[acr]) + 1)]
+            for future in futures:
+                future.result()
+    finally:
+        flow.put(flow.items, DONE)
+
+
+def classify(flow: Flow, predicates: dict):
+    """
+    Save, classify and place the queued items and queue their images.
+
+    Args:
+        flow: the streaming run.
+        predicates: thesauro, field and labels, see route.
+    """
+    try:
+        while (entry := flow.get(flow.items)) is not DONE:
+            acr, data = entry
+            folders = route(acr, data, **predicates)
+            file = f'{acr}_{data["id"]}.json'
+            for text_folder, _ in folders:
+                if text_folder:
+                    copy_files(join(DATA_RAW_JSONS, file), text_folder)
+            tasks = image_tasks(file.split('.')[0], data, DATA_RAW_IMAGES)
+            if flow.settings['only_model'] and \
+                    all(text for text, _ in folders):
+                tasks = []
+            for url, img in tasks:
+                flow.put(flow.images, (url, img, folders))
+            flow.count(items=1, classified=int(bool(folders)))
+    finally:
+        for _ in range(flow.settings['workers']):
+            flow.put(flow.images, DONE)
+
+
+def download(flow: Flow):
+    """
+    Download the queued images and place them in the folders of their item.
+
+    Args:
+        flow: the streaming run.
+    """
+    verify = flow.settings['verify']
+    while (entry := flow.get(flow.images)) is not DONE:
+        url, img, folders = entry
+        size = getsize(img) if intact(img, verify) \
+            else fetcher(url, img, verify)
+        if size:
+            for _, images_folder in folders:
+                copy_files(img, images_folder)
+        flow.count(**{'images' if size else 'failed': 1})
+
+
+def stream(museum_dict: dict, predicates: dict, settings: dict = None) -> dict:
+    """
+    Create the database with all stages running at the same time.
+
+    The museum pages are downloaded concurrently and every item is saved,
+    classified and placed as soon as it arrives, and its images are queued
+    for download right away and placed when they finish. The stages are
+    joined by bounded queues, so a slow stage holds back the ones before it
+    instead of piling up items in memory.
+    Args:
+        museum_dict: a dictionary with the Museum acronym and base url.
+        predicates: the item filters, see route.
+            thesauro: thesaurus compared with the classification field.
+            field: text field compared with the labels.
+            labels: list of (label, folder) tuples of the model database.
+        settings: any of SETTINGS, the others keep their default.
+            max_connections: number of pages downloaded at once.
+            workers: number of simultaneous image transfers.
+            verify: check that every image can be decoded.
+            queue_size: maximum number of items and images waiting in each
+            queue.
+            only_model: download only the images of the items that end up
+            in the model database.
+    """
+    assert not set(settings or {}) - set(SETTINGS), 'Unknown stream settings'
+    flow = Flow({**SETTINGS, **(settings or {})})
+    for folder in (DATA_RAW_JSONS, DATA_RAW_IMAGES, DATA_INTERIM_TEXT,
+                   DATA_INTERIM_IMAGES, DATA_PROCD_TEXT, DATA_PROCD_IMAGES):
+        makedirs(folder, exist_ok=True)
+    for _, folder in predicates['labels']:
+        makedirs(join(DATA_PROCD_MODEL, folder), exist_ok=True)
+
+    first_pages = {}
+    npages = pages(museum_dict, first_pages)
+    start = time.monotonic()
+    workers = flow.settings['workers']
+    with ThreadPoolExecutor(max_workers=workers + 2) as executor:
+        futures = [executor.submit(harvest, flow, museum_dict, npages,
+                                   first_pages),
+                   executor.submit(classify, flow, predicates)]
+        futures.extend(executor.submit(download, flow) for _ in range(workers))
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [f for f in done if f.exception()]
+        if failed:
+            flow.stop.set()
+            raise failed[0].exception()
+    flow.progress.close()
+
+    stats = flow.stats
+    stats['seconds'] = time.monotonic() - start
+    print(f"Streamed {stats['items']} items ({stats['classified']} "
+          f"classified) and {stats['images']} images ({stats['failed']} "
+          f"failed) in {stats['seconds']:.1f}s")
+
+    return stats
@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+import unittest
+from functools import partial
+from os.path import join
+from unittest import mock
+
+from modules import catalogue
+from modules.classify_jsons import (classify_files, contains, in_model_db,
+                                    texts_in_model_db)
+
+
+def item(number, denomination):
+    """Item of the MRCO museum with the given denomination and an image."""
+    return {'id': number, 'title': f'Item {number}',
+            'thumbnail': {'full': [f'https://museu.example/{number}.jpg',
+                                   600, 400, False]},
+            'metadata': {'denominacao': {'value_as_string': denomination},
+                         'classificacao-2': {
+                             'value_as_string': '05 - Mobiliário'}}}
+
+
+class TestCatalogue(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.jsons = join(folder.name, 'jsons')
+        self.db_path = join(folder.name, 'catalogue.sqlite')
+        for name, function in (('lookup', catalogue.lookup),
+                               ('select', catalogue.select)):
+            patcher = mock.patch.object(
+                catalogue, name, partial(function, db_path=self.db_path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def save(self, number, denomination):
+        os.makedirs(self.jsons, exist_ok=True)
+        with open(join(self.jsons, f'MRCO_{number}.json'), 'w',
+                  encoding='utf-8') as f:
+            json.dump(item(number, denomination), f)
+
+    def classify(self, pattern):
+        return dict(classify_files(self.jsons, 'denomination',
+                                   partial(contains, pattern), workers=1,
+                                   patterns=[pattern]))
+
+    def test_lookup_reads_the_catalogued_files(self):
+        """The catalogued files give their text, the others are left out."""
+        self.save(1, 'Cadeira')
+        catalogue.ingest(self.jsons, self.db_path)
+        self.assertEqual(catalogue.lookup('denomination',
+                                          ['MRCO_1.json', 'MRCO_2.json']),
+                         {'MRCO_1.json': 'Cadeira'})
+
+    def test_select_scans_for_the_patterns(self):
+        """Only the texts that contain a pattern, lowercased, are selected."""
+        self.save(1, 'Cadeira')
+        self.save(2, 'Mesa')
+        catalogue.ingest(self.jsons, self.db_path)
+        self.assertEqual(catalogue.select('denomination', ['CADEIRA']),
+                         {'MRCO_1.json': 'Cadeira'})
+
+    def test_select_without_catalogue(self):
+        """No catalogue gives None, so the caller parses the files."""
+        self.assertIsNone(catalogue.select('denomination', ['cadeira']))
+
+    def test_classify_skips_the_catalogued_non_candidates(self):
+        """The catalogued files without the pattern are not matched."""
+        self.save(1, 'Cadeira')
+        self.save(2, 'Mesa')
+        catalogue.ingest(self.jsons, self.db_path)
+        self.assertEqual(self.classify('cadeira'), {'MRCO_1.json': ['cadeira']})
+
+    def test_classify_parses_the_files_not_catalogued(self):
+        """Files saved after the last ingest are still classified."""
+        self.save(1, 'Cadeira')
+        catalogue.ingest(self.jsons, self.db_path)
+        self.save(2, 'Cadeira de balanço')
+        self.save(3, 'Mesa')
+        self.assertEqual(self.classify('cadeira'),
+                         {'MRCO_1.json': ['cadeira'],
+                          'MRCO_2.json': ['cadeira'], 'MRCO_3.json': []})
+
+    def test_missing_images(self):
+        """Items whose images are not saved are missing."""
+        self.save(1, 'Cadeira')
+        self.save(2, 'Mesa')
+        catalogue.ingest(self.jsons, self.db_path)
+        images = join(os.path.dirname(self.jsons), 'images')
+        os.makedirs(images)
+        with open(join(images, 'MRCO_2_0.jpg'), 'wb'):
+            pass
+        self.assertEqual(catalogue.missing_images(images, db_path=self.db_path),
+                         ['MRCO_1.json'])
+
+    def test_missing_images_left_out_on_purpose(self):
+        """Items that the filter leaves out are not missing."""
+        self.save(1, 'Cadeira')
+        self.save(2, 'Tapeçaria')
+        catalogue.ingest(self.jsons, self.db_path)
+        images = join(os.path.dirname(self.jsons), 'images')
+        self.assertEqual(
+            catalogue.missing_images(images, texts_in_model_db,
+                                     db_path=self.db_path), ['MRCO_1.json'])
+
+    def test_texts_as_the_item(self):
+        """The catalogued texts give the same answer as the JSON file."""
+        for number, denomination in enumerate(['Cadeira', 'Tapeçaria',
+                                               'Prato raso', ''], 1):
+            self.save(number, denomination)
+        catalogue.ingest(self.jsons, self.db_path)
+        con = catalogue.connect(self.db_path)
+        rows = con.execute(f'SELECT file, {", ".join(catalogue.FIELDS)} '
+                           'FROM items').fetchall()
+        con.close()
+        for file, *texts in rows:
+            with open(join(self.jsons, file), encoding='utf-8') as f:
+                data = json.load(f)
+            self.assertEqual(
+                texts_in_model_db(dict(zip(catalogue.FIELDS, texts))),
+                in_model_db(file, data), file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import random
+import tempfile
+import unittest
+from functools import partial
+from os.path import join, samefile
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from helpers import dedup
+from helpers.dedup import (BKTree, find_duplicates, hamming, label_folders,
+                           remove_duplicates)
+
+
+def pattern(seed, shift=0):
+    """Image of random blocks, brighter by the shift."""
+    blocks = np.random.default_rng(seed).integers(0, 200, (8, 8, 3))
+    image = np.kron(blocks, np.ones((16, 16, 1))) + shift
+
+    return image.astype(np.uint8)
+
+
+class TestBKTree(unittest.TestCase):
+    def test_search_as_brute_force(self):
+        """The tree finds the same hashes as comparing every pair."""
+        rng = random.Random(0)
+        values = [rng.getrandbits(64) for _ in range(300)]
+        values += [value ^ (1 << rng.randrange(64)) for value in values[:50]]
+        tree = BKTree()
+        for number, value in enumerate(values):
+            tree.add(value, number)
+        for query in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            for radius in (0, 1, 4, 24):
+                expected = sorted((hamming(query, value), number)
+                                  for number, value in enumerate(values)
+                                  if hamming(query, value) <= radius)
+                self.assertEqual(tree.search(query, radius), expected)
+
+    def test_empty_tree(self):
+        """Nothing is found before a hash is added."""
+        self.assertEqual(BKTree().search(0, 64), [])
+
+
+class TestFindDuplicates(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.model = join(folder.name, 'modeldb')
+        self.cache = join(folder.name, 'phash_cache.json')
+        patcher = mock.patch.object(
+            dedup, 'hash_images',
+            partial(dedup.hash_images, cache_path=self.cache))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def save(self, label, name, image):
+        os.makedirs(join(self.model, label), exist_ok=True)
+        path = join(self.model, label, name)
+        cv2.imwrite(path, image)
+        return path
+
+    def find(self, scope='label'):
+        return find_duplicates(label_folders(self.model, scope), workers=1)
+
+    def test_near_duplicates_in_a_label(self):
+        """A brighter copy is a duplicate of the first image by name."""
+        kept = self.save('vase', 'A_1_0.png', pattern(1))
+        duplicate = self.save('vase', 'B_2_0.png', pattern(1, shift=3))
+        self.save('vase', 'C_3_0.png', pattern(2))
+        found = self.find()
+        self.assertEqual([(d['kept'], d['duplicate']) for d in found],
+                         [(kept, duplicate)])
+
+    def test_labels_are_searched_on_their_own(self):
+        """The same image in two labels is not a duplicate by label."""
+        self.save('vase', 'A_1_0.png', pattern(1))
+        self.save('cup', 'B_2_0.png', pattern(1))
+        self.assertEqual(self.find(), [])
+        self.assertEqual(len(self.find('all')), 1)
+
+    def test_copies_of_an_item_across_labels(self):
+        """An item image placed in several labels is not a duplicate."""
+        self.save('vase', 'A_1_0.png', pattern(1))
+        self.save('cup', 'A_1_0.png', pattern(1))
+        self.assertEqual(self.find('all'), [])
+
+    def test_hashes_are_cached(self):
+        """The images already hashed are not decoded again."""
+        self.save('vase', 'A_1_0.png', pattern(1))
+        self.find()
+        self.assertTrue(os.path.isfile(self.cache))
+        with mock.patch.object(dedup, 'ProcessPoolExecutor',
+                               side_effect=AssertionError('decoded again')):
+            self.assertEqual(self.find(), [])
+
+    def test_remove_duplicates(self):
+        """Duplicates are deleted or replaced by a link to the kept one."""
+        kept = self.save('vase', 'A_1_0.png', pattern(1))
+        linked = self.save('vase', 'B_2_0.png', pattern(1, shift=3))
+        removed = self.save('vase', 'C_3_0.png', pattern(1, shift=6))
+        remove_duplicates([{'kept': kept, 'duplicate': linked}], 'hardlink')
+        remove_duplicates([{'kept': kept, 'duplicate': removed}])
+        self.assertTrue(samefile(kept, linked))
+        self.assertFalse(os.path.exists(removed))
+
+
+if __name__ == '__main__':
+    unittest.main()
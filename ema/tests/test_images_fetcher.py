@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+import unittest
+from os.path import join
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from modules import images_fetcher
+from modules.images_fetcher import (image_size, image_urls, renumber,
+                                    renumbering)
+
+SITE = 'https://museu.example/wp-content/uploads'
+
+
+def item():
+    """Tainacan item with three thumbnail sizes and an attachment."""
+    return {
+        'id': 1,
+        'thumbnail': {
+            'thumbnail': [f'{SITE}/vaso-150x150.jpg', 150, 150, True],
+            'medium': [f'{SITE}/vaso-300x200.jpg', 300, 200, True],
+            'full': [f'{SITE}/vaso.jpg', 600, 400, False],
+            'tainacan-medium-full': [f'{SITE}/vaso.jpg', 600, 400, False],
+        },
+        'document_type': 'attachment',
+        'document': '42',
+        'attachments': [{'url': f'{SITE}/verso.png'}, f'{SITE}/vaso.jpg'],
+    }
+
+
+def save_image(path, width, height):
+    """Write a black image of the given dimensions."""
+    cv2.imwrite(path, np.zeros((height, width, 3), dtype=np.uint8))
+
+
+class TestImageUrls(unittest.TestCase):
+    def test_largest_thumbnail_and_attachments(self):
+        """The full size comes first, then the attachments, once each."""
+        self.assertEqual(image_urls(item()),
+                         [f'{SITE}/vaso.jpg', f'{SITE}/verso.png'])
+
+    def test_document_url_and_html(self):
+        """A document url and the first link of its html are kept."""
+        data = {'document_type': 'url', 'document': f'{SITE}/doc.jpeg',
+                'document_as_html': f'<img src="{SITE}/html.png">'}
+        self.assertEqual(image_urls(data),
+                         [f'{SITE}/doc.jpeg', f'{SITE}/html.png'])
+
+    def test_not_images_are_left_out(self):
+        """Urls that do not end with an image extension are not kept."""
+        data = {'document_type': 'url', 'document': f'{SITE}/doc.pdf',
+                'attachments': [{'url': f'{SITE}/a.bmp'}, None]}
+        self.assertEqual(image_urls(data), [f'{SITE}/a.bmp'])
+
+    def test_unknown_layout_falls_back_to_regex(self):
+        """Items without the Tainacan fields are searched by the regex."""
+        data = {'media': {'images': [f'{SITE}/a.jpg', f'{SITE}/b.png',
+                                     f'{SITE}/a.jpg']}}
+        self.assertEqual(image_urls(data), [f'{SITE}/a.jpg', f'{SITE}/b.png'])
+
+    def test_same_order_every_time(self):
+        """The order does not depend on the run, unlike a set."""
+        self.assertEqual(image_urls(item()), image_urls(json.loads(
+            json.dumps(item()))))
+
+
+class TestRenumbering(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.root = folder.name
+        self.jsons = join(self.root, 'raw', 'jsons')
+        self.images = join(self.root, 'raw', 'images')
+        self.model = join(self.root, 'processed', 'modeldb')
+        for path in (self.jsons, self.images, join(self.model, 'vase')):
+            os.makedirs(path)
+        for name, path in (('DATA_INTERIM_IMAGES', 'interim'),
+                           ('DATA_PROCD_IMAGES', 'procd'),
+                           ('DATA_PROCD_MODEL', 'processed/modeldb')):
+            patcher = mock.patch.object(images_fetcher, name,
+                                        join(self.root, path))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with open(join(self.jsons, 'MRCO_1.json'), 'w', encoding='utf-8') as f:
+            json.dump(item(), f)
+        # numbered in the order of a set of every url by an older version
+        save_image(join(self.images, 'MRCO_1_0.jpg'), 300, 200)
+        save_image(join(self.images, 'MRCO_1_1.png'), 80, 120)
+        save_image(join(self.images, 'MRCO_1_2.jpg'), 600, 400)
+        save_image(join(self.images, 'MRCO_1_3.jpg'), 150, 150)
+        save_image(join(self.images, 'MRCO_1_4.jpg'), 50, 50)
+        save_image(join(self.model, 'vase', 'MRCO_1_2.jpg'), 600, 400)
+        save_image(join(self.model, 'vase', 'MRCO_1_0.jpg'), 300, 200)
+
+    def test_maps_the_images_to_their_urls(self):
+        """Images are renamed by their url, the rest is stale."""
+        renames, stale = renumbering(self.jsons, self.images)
+        self.assertEqual(renames, {'MRCO_1_2.jpg': 'MRCO_1_0.jpg'})
+        self.assertEqual(sorted(stale),
+                         ['MRCO_1_0.jpg', 'MRCO_1_3.jpg', 'MRCO_1_4.jpg'])
+
+    def test_renames_in_every_folder(self):
+        """The placed copies are renamed too and the marker is written."""
+        marker = join(self.root, 'raw', 'images_numbering')
+        renumber(*renumbering(self.jsons, self.images), self.images, marker)
+        self.assertEqual(sorted(os.listdir(self.images)),
+                         ['MRCO_1_0.jpg', 'MRCO_1_1.png'])
+        self.assertEqual(image_size(join(self.images, 'MRCO_1_0.jpg')),
+                         (600, 400))
+        self.assertEqual(os.listdir(join(self.model, 'vase')),
+                         ['MRCO_1_0.jpg'])
+        self.assertEqual(image_size(join(self.model, 'vase', 'MRCO_1_0.jpg')),
+                         (600, 400))
+        self.assertTrue(os.path.isfile(marker))
+
+    def test_stable_images_are_kept(self):
+        """Images that already follow the stable numbering are untouched."""
+        renumber(*renumbering(self.jsons, self.images), self.images,
+                 join(self.root, 'marker'))
+        self.assertEqual(renumbering(self.jsons, self.images), ({}, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import tempfile
+import unittest
+from os import listdir
+from unittest import mock
+
+from modules import jsons_fetcher
+
+
+class Response:
+    """Page of a museum answered by the stand-in transport."""
+
+    def __init__(self, items, pages):
+        self.status_code = 200
+        self.headers = {'x-wp-totalpages': str(pages)}
+        self.items = items
+
+    def json(self):
+        return {'items': self.items}
+
+
+def item(number):
+    """Item created on the given day of January."""
+    return {'id': number, 'creation_date': f'2024-01-{number:02d}T10:00:00'}
+
+
+class TestRefreshMuseum(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        patcher = mock.patch.object(jsons_fetcher, 'DATA_RAW_JSONS',
+                                    self.folder.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # newest first, three items per page
+        items = [item(number) for number in range(30, 0, -1)]
+        self.pages = [items[i:i + 3] for i in range(0, len(items), 3)]
+        self.requested = []
+
+    def get(self, url, headers=None):
+        page = int(url.rsplit('=', 1)[-1])
+        self.requested.append(page)
+        return Response(self.pages[page - 1], len(self.pages))
+
+    def refresh(self, mark):
+        with mock.patch.object(jsons_fetcher.transport, 'get', self.get):
+            return jsons_fetcher.refresh_museum('https://museum/?page=',
+                                                'ACR', mark)
+
+    def test_stops_at_the_mark_without_raw_files(self):
+        """Items older than the mark end the paging as the known ones do."""
+        mark = {'id': 24, 'date': '2024-01-24T10:00:00'}
+        new_mark = self.refresh(mark)
+        self.assertEqual(self.requested, [1, 2, 3])
+        self.assertEqual(sorted(listdir(self.folder.name)),
+                         sorted(f'ACR_{n}.json' for n in range(25, 31)))
+        self.assertEqual(new_mark['id'], 30)
+
+    def test_stops_at_the_first_known_page(self):
+        """A page whose files were all saved ends the paging."""
+        jsons_fetcher.save_items('ACR', self.pages[1])
+        self.refresh({})
+        self.assertEqual(self.requested, [1, 2])
+
+    def test_without_mark_walks_every_page(self):
+        """The first refresh saves every item."""
+        self.refresh({})
+        self.assertEqual(len(self.requested), len(self.pages))
+        self.assertEqual(len(listdir(self.folder.name)), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+
+from helpers.constants import TARGET_LABELS, TL_BW, TL_JOINED
+from helpers.matcher import compiled
+
+
+def labels_in(text, labels):
+    """Folders of the labels found by the `in` checks of through_labels."""
+    tgt = str(text).lower()
+    return [folder for label, folder in labels if label in tgt]
+
+
+def labels_in_without_bad_words(text, labels):
+    """Folders of the labels found by the `in` checks of allocate_img."""
+    tgt = str(text).lower()
+    return [folder for label, folder in labels
+            if label in tgt and
+            not any(tgt in bw for bw in TL_BW.get(label, [])) and
+            not any(bw in tgt for bw in TL_BW.get(label, []))]
+
+
+def corpus():
+    """Denominations built from the real labels and bad words."""
+    words = [label for label, _ in TL_JOINED] + list(TARGET_LABELS)
+    words += [bw for bws in TL_BW.values() for bw in bws]
+    texts = ['', 'None', 'objeto', 'estaca de madeira', 'Taça de vidro',
+             'TAÇA', 'xícara', 'Cadeira de balanço', 'mesa-de-cabeceira']
+    for word in words:
+        texts += [word, word.upper(), word.capitalize(), f'{word} de madeira',
+                  f'par de {word}s', word[1:], word[:-1], f'{word}{word[::-1]}']
+    texts += [f'{a} e {b}' for a, b in zip(words, reversed(words))]
+
+    return texts
+
+
+class TestLabelMatcher(unittest.TestCase):
+    def test_target_labels_as_in(self):
+        """The target labels match as the `in` checks of through_labels."""
+        labels = tuple((label, label) for label in TARGET_LABELS)
+        matcher = compiled(labels, False)
+        for text in corpus():
+            self.assertEqual(sorted(matcher.match(text)),
+                             sorted(labels_in(text, labels)), text)
+
+    def test_model_labels_as_in(self):
+        """The model labels and bad words match as allocate_img did."""
+        labels = tuple(map(tuple, TL_JOINED))
+        matcher = compiled(labels)
+        for text in corpus():
+            self.assertEqual(sorted(matcher.match(text)),
+                             sorted(labels_in_without_bad_words(text, labels)),
+                             text)
+
+    def test_accents_are_kept(self):
+        """A label with an accent is not found in the same word without it."""
+        matcher = compiled((('taça', 'glass'),), False)
+        self.assertEqual(matcher.match('estaca de madeira'), [])
+        self.assertEqual(matcher.match('Taça de vidro'), ['glass'])
+
+
+if __name__ == '__main__':
+    unittest.main()
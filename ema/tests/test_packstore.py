@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import unittest
+from os.path import join
+
+from helpers import packstore
+
+
+def items(*numbers):
+    """Items of a museum page."""
+    return [{'id': number, 'title': f'Vaso {number}'} for number in numbers]
+
+
+class TestPackstore(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+
+    def forget_indexes(self):
+        """Read the indexes from disk again, as another process does."""
+        packstore._INDEXES.clear()  # pylint: disable=protected-access
+
+    def test_append_and_read(self):
+        """Every appended item is read back by its file name."""
+        self.assertEqual(packstore.append(self.folder, 'MRCO', items(1, 2)), 2)
+        self.assertEqual(packstore.append(self.folder, 'MRCO', items(3)), 1)
+        self.forget_indexes()
+        self.assertEqual(sorted(packstore.names(self.folder)),
+                         ['MRCO_1.json', 'MRCO_2.json', 'MRCO_3.json'])
+        self.assertEqual(json.loads(packstore.read(self.folder, 'MRCO_3.json')),
+                         items(3)[0])
+
+    def test_packed_items_are_skipped(self):
+        """Items already in the shard or repeated in a page are not added."""
+        packstore.append(self.folder, 'MRCO', items(1))
+        self.assertEqual(packstore.append(self.folder, 'MRCO',
+                                          items(1, 2, 2)), 1)
+        self.assertEqual(len(packstore.names(self.folder)), 2)
+
+    def test_index_follows_other_writers(self):
+        """The cached index is read again when a shard index changes."""
+        packstore.append(self.folder, 'MRCO', items(1))
+        packstore.index(self.folder)
+        shard = packstore.shard_path(self.folder, 'MRCO')
+        with open(shard + packstore.INDEX_EXT, encoding='utf-8') as f:
+            line = f.read()
+        with open(shard + packstore.INDEX_EXT, 'a', encoding='utf-8') as f:
+            f.write(line.replace('MRCO_1.json', 'MRCO_9.json', 1))
+        self.assertTrue(packstore.contains(self.folder, 'MRCO_9.json'))
+
+    def test_interrupted_frame_is_ignored(self):
+        """A frame written without its index lines leaves no item."""
+        packstore.append(self.folder, 'MRCO', items(1))
+        with open(packstore.shard_path(self.folder, 'MRCO'), 'ab') as f:
+            f.write(b'\x28\xb5\x2f\xfd cut frame')
+        self.forget_indexes()
+        packstore.append(self.folder, 'MRCO', items(2))
+        self.forget_indexes()
+        self.assertEqual(sorted(packstore.names(self.folder)),
+                         ['MRCO_1.json', 'MRCO_2.json'])
+        self.assertEqual(json.loads(packstore.read(self.folder, 'MRCO_2.json')),
+                         items(2)[0])
+
+    def test_cut_index_line_is_recovered(self):
+        """A half-written index line does not hide the next items."""
+        packstore.append(self.folder, 'MRCO', items(1))
+        with open(packstore.shard_path(self.folder, 'MRCO') +
+                  packstore.INDEX_EXT, 'a', encoding='utf-8') as f:
+            f.write('MRCO_2.json\t12')
+        self.forget_indexes()
+        self.assertEqual(packstore.names(self.folder), ['MRCO_1.json'])
+        packstore.append(self.folder, 'MRCO', items(2, 3))
+        self.forget_indexes()
+        self.assertEqual(sorted(packstore.names(self.folder)),
+                         ['MRCO_1.json', 'MRCO_2.json', 'MRCO_3.json'])
+        self.assertEqual(json.loads(packstore.read(self.folder, 'MRCO_2.json')),
+                         items(2)[0])
+
+    def test_entries_and_export(self):
+        """The fingerprints change with the items and export writes files."""
+        packstore.append(self.folder, 'MRCO', items(1, 2))
+        entries = packstore.entries(self.folder)
+        self.assertEqual(set(entries), {'MRCO_1.json', 'MRCO_2.json'})
+        dest = join(self.folder, 'jsons')
+        self.assertEqual(packstore.export(self.folder, dest), 2)
+        self.assertEqual(packstore.export(self.folder, dest), 0)
+        with open(join(dest, 'MRCO_1.json'), encoding='utf-8') as f:
+            self.assertEqual(json.load(f), items(1)[0])
+        self.assertFalse(any(packstore.is_pack_file(name)
+                             for name in os.listdir(dest)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from os.path import join
+
+from helpers.pipeline import Pipeline, Stage
+
+
+def write(path, text='x'):
+    """Write a small file."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.root = folder.name
+        self.src = join(self.root, 'src')
+        self.out = join(self.root, 'out')
+        os.makedirs(self.src)
+        self.manifests = join(self.root, 'manifests')
+        self.calls = []
+
+    def pipeline(self, *stages):
+        return Pipeline(list(stages), self.manifests)
+
+    def execute(self, *stages):
+        """Run the stages quietly and get what each one did."""
+        with redirect_stdout(io.StringIO()):
+            return self.pipeline(*stages).run()
+
+    def place(self, files=None):
+        """Copy the source files to the output folder."""
+        self.calls.append(('place', files))
+        for name in files if files is not None else os.listdir(self.src):
+            shutil.copy(join(self.src, name), join(self.out, name))
+
+    def place_stage(self, **options):
+        return Stage('place', self.place, inputs=[self.src],
+                     outputs=[self.out], **options)
+
+    def test_second_run_skips_every_stage(self):
+        """A stage that removes the outputs of another makes neither rerun."""
+        write(join(self.src, 'a.jpg'))
+        write(join(self.src, 'a_dup.jpg'))
+
+        def dedup():
+            self.calls.append(('dedup', None))
+            os.remove(join(self.out, 'a_dup.jpg'))
+
+        stages = (self.place_stage(),
+                  Stage('dedup', dedup, inputs=[self.out], outputs=[self.out]))
+        self.assertEqual(self.execute(*stages),
+                         {'place': 'run', 'dedup': 'run'})
+        self.assertEqual(self.execute(*stages),
+                         {'place': 'skipped', 'dedup': 'skipped'})
+        self.assertEqual(os.listdir(self.out), ['a.jpg'])
+
+    def test_update_receives_the_changed_files(self):
+        """Only the new and changed inputs are given to update."""
+        write(join(self.src, 'a.jpg'))
+        stage = self.place_stage(
+            update=lambda changed: self.place(sorted(changed[self.src])))
+        self.execute(stage)
+        write(join(self.src, 'b.jpg'))
+        self.assertEqual(self.execute(stage), {'place': 'update'})
+        self.assertEqual(self.calls[-1], ('place', ['b.jpg']))
+
+    def test_removed_input_runs_in_full(self):
+        """An update cannot remove outputs, so a removed input runs it all."""
+        write(join(self.src, 'a.jpg'))
+        write(join(self.src, 'b.jpg'))
+        stage = self.place_stage(update=self.place)
+        self.execute(stage)
+        os.remove(join(self.src, 'b.jpg'))
+        self.assertEqual(self.execute(stage), {'place': 'run'})
+
+    def test_removed_output_runs_in_full(self):
+        """An output file removed since the last run is built again."""
+        write(join(self.src, 'a.jpg'))
+        self.execute(self.place_stage())
+        os.remove(join(self.out, 'a.jpg'))
+        self.assertEqual(self.execute(self.place_stage()),
+                         {'place': 'run'})
+        self.assertEqual(os.listdir(self.out), ['a.jpg'])
+
+    def test_changed_params_run_in_full(self):
+        """The outputs depend on the params too."""
+        write(join(self.src, 'a.jpg'))
+        self.execute(self.place_stage(params={'size': 1}))
+        self.assertEqual(self.execute(self.place_stage(params={'size': 1})),
+                         {'place': 'skipped'})
+        self.assertEqual(self.execute(self.place_stage(params={'size': 2})),
+                         {'place': 'run'})
+
+    def test_pending_work_is_updated(self):
+        """A stage with work left is updated although nothing changed."""
+        write(join(self.src, 'a.jpg'))
+        stage = self.place_stage(update=lambda _: self.place([]),
+                                 pending=lambda: True)
+        self.execute(stage)
+        self.assertEqual(self.execute(stage), {'place': 'update'})
+
+    def test_unfinished_stage_runs_again(self):
+        """A stage that failed has no manifest."""
+        write(join(self.src, 'a.jpg'))
+
+        def fail():
+            raise RuntimeError('interrupted')
+
+        with self.assertRaises(RuntimeError):
+            self.execute(Stage('place', fail, inputs=[self.src],
+                           outputs=[self.out]))
+        self.assertEqual(self.execute(self.place_stage()),
+                         {'place': 'run'})
+
+    def test_stage_without_inputs_is_never_skipped(self):
+        """An outside source is updated on every run."""
+        stage = Stage('fetch', lambda: write(join(self.src, 'a.jpg')),
+                      outputs=[self.src], update=lambda _: None)
+        self.assertEqual(self.execute(stage), {'fetch': 'run'})
+        self.assertEqual(self.execute(stage), {'fetch': 'update'})
+
+    def test_stages_run_after_their_inputs(self):
+        """A stage waits for the ones writing its inputs, the rest do not."""
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+
+        def source(folder):
+            def run():
+                barrier.wait()
+                write(join(folder, 'a.jpg'))
+                order.append(folder)
+            return run
+
+        left, right = join(self.root, 'left'), join(self.root, 'right')
+        stages = [Stage('join', lambda: order.append('join'),
+                        inputs=[left, right], outputs=[self.out]),
+                  Stage('left', source(left), outputs=[left]),
+                  Stage('right', source(right), outputs=[right])]
+        self.execute(*stages)
+        self.assertEqual(order[-1], 'join')
+        self.assertEqual(self.pipeline(*stages).deps['join'],
+                         ['left', 'right'])
+
+    def test_circular_stages(self):
+        """Stages reading each other's outputs cannot run."""
+        stages = [Stage('a', lambda: None, inputs=[self.out],
+                        outputs=[self.src]),
+                  Stage('b', lambda: None, inputs=[self.src],
+                        outputs=[self.out])]
+        with self.assertRaises(AssertionError):
+            self.execute(*stages)
+
+    def test_unknown_option(self):
+        """A misspelled option is not ignored."""
+        with self.assertRaises(AssertionError):
+            Stage('a', lambda: None, updates=lambda _: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
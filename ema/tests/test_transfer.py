@@ -0,0 +1,165 @@
+import io
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from os.path import exists, join
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from helpers.constants import PART_EXT
+from modules import images_fetcher
+from modules.images_fetcher import fetcher, intact, transfer
+
+BODY = bytes(range(256)) * 40
+
+
+class Response:
+    """Answer of the stand-in image server."""
+
+    def __init__(self, status, body=b'', headers=None):
+        self.status_code = status
+        self.body = body
+        self.headers = {'Content-Type': 'image/jpeg', **(headers or {})}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class Server:
+    """Serve a body honouring or ignoring the Range header."""
+
+    def __init__(self, body=BODY, ranges=True, content_type='image/jpeg'):
+        self.body = body
+        self.ranges = ranges
+        self.content_type = content_type
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False):
+        self.requests.append(dict(headers or {}))
+        headers = {'Content-Type': self.content_type}
+        offset = 0
+        if self.ranges and 'Range' in self.requests[-1]:
+            offset = int(self.requests[-1]['Range'][6:-1])
+            if offset >= len(self.body):
+                return Response(416, headers=headers)
+            headers['Content-Range'] = \
+                f'bytes {offset}-{len(self.body) - 1}/{len(self.body)}'
+            return Response(206, self.body[offset:], headers)
+        headers['Content-Length'] = str(len(self.body))
+        return Response(200, self.body[offset:], headers)
+
+
+class TestTransfer(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.image = join(folder.name, 'MRCO_1_0.jpg')
+        self.part = self.image + PART_EXT
+        patcher = mock.patch.object(images_fetcher, 'save_bad_requests')
+        self.bad_requests = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, server, verify=False):
+        with mock.patch.object(images_fetcher.transport, 'get', server.get), \
+                redirect_stdout(io.StringIO()):
+            return fetcher('https://museu.example/vaso.jpg', self.image,
+                           verify)
+
+    def save_part(self, data):
+        with open(self.part, 'wb') as f:
+            f.write(data)
+
+    def read(self):
+        with open(self.image, 'rb') as f:
+            return f.read()
+
+    def test_complete_download(self):
+        """A whole body is renamed from the partial file to the image."""
+        self.assertEqual(self.fetch(Server()), len(BODY))
+        self.assertEqual(self.read(), BODY)
+        self.assertFalse(exists(self.part))
+
+    def test_resume_with_range(self):
+        """A partial file is completed from its size on."""
+        self.save_part(BODY[:1000])
+        server = Server()
+        self.assertEqual(self.fetch(server), len(BODY))
+        self.assertEqual(server.requests, [{'Range': 'bytes=1000-'}])
+        self.assertEqual(self.read(), BODY)
+
+    def test_range_ignored(self):
+        """A server that ignores the Range sends it all, written anew."""
+        self.save_part(b'stale bytes')
+        self.assertEqual(self.fetch(Server(ranges=False)), len(BODY))
+        self.assertEqual(self.read(), BODY)
+
+    def test_range_not_satisfiable(self):
+        """A 416 drops the partial file and downloads the image again."""
+        self.save_part(BODY + b'extra')
+        server = Server()
+        self.assertEqual(self.fetch(server), len(BODY))
+        self.assertEqual(server.requests, [{'Range': f'bytes={len(BODY) + 5}-'},
+                                           {}])
+        self.assertEqual(self.read(), BODY)
+
+    def test_wrong_range_start(self):
+        """A range that does not start at the partial size is discarded."""
+        self.save_part(BODY[:1000])
+        response = Response(206, BODY[10:], {
+            'Content-Range': f'bytes 10-{len(BODY) - 1}/{len(BODY)}'})
+        with mock.patch.object(images_fetcher.transport, 'get',
+                               return_value=response):
+            result, expected = transfer('https://museu.example/vaso.jpg',
+                                        self.part)
+        self.assertEqual((result.status_code, expected), (206, None))
+        self.assertFalse(exists(self.part))
+
+    def test_short_body_is_kept_for_resume(self):
+        """A body shorter than its length stays partial."""
+        server = Server()
+        server.get = lambda *args, **kwargs: Response(
+            200, BODY[:1000], {'Content-Length': str(len(BODY))})
+        self.assertEqual(self.fetch(server), 0)
+        self.assertFalse(exists(self.image))
+        self.assertEqual(os.path.getsize(self.part), 1000)
+        self.bad_requests.assert_called_once()
+
+    def test_not_an_image(self):
+        """An error page is not saved as an image."""
+        self.assertEqual(self.fetch(Server(content_type='text/html')), 0)
+        self.assertFalse(exists(self.image))
+
+    def test_verify_discards_undecodable(self):
+        """With verify, a body that does not decode is dropped."""
+        self.assertEqual(self.fetch(Server(), verify=True), 0)
+        self.assertFalse(exists(self.image) or exists(self.part))
+
+    def test_verify_keeps_images(self):
+        """With verify, a real image is kept."""
+        _, body = cv2.imencode('.jpg', np.zeros((8, 8, 3), dtype=np.uint8))
+        self.assertEqual(self.fetch(Server(body.tobytes()), verify=True),
+                         len(body.tobytes()))
+        self.assertEqual(self.read(), body.tobytes())
+
+    def test_intact(self):
+        """Empty images are never kept and broken ones are not when verifying."""
+        self.assertFalse(intact(self.image))
+        with open(self.image, 'wb'):
+            pass
+        self.assertFalse(intact(self.image))
+        with open(self.image, 'wb') as f:
+            f.write(BODY)
+        self.assertTrue(intact(self.image))
+        self.assertFalse(intact(self.image, verify=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
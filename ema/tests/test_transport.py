@@ -0,0 +1,37 @@
+import threading
+import unittest
+
+from helpers import transport
+from helpers.constants import MAX_CONNECTIONS_PER_HOST
+
+
+class TestSession(unittest.TestCase):
+    def tearDown(self):
+        transport.configure(per_host=MAX_CONNECTIONS_PER_HOST)
+
+    def test_per_host_sizes_the_pool(self):
+        """The host pools hold as many connections as configured."""
+        transport.configure(per_host=8)
+        adapter = transport.session().get_adapter('https://example.org')
+        self.assertEqual(adapter._pool_maxsize, 8)  # pylint: disable=protected-access
+
+    def test_one_session_for_all_threads(self):
+        """Threads asking for the session at once share the same one."""
+        transport.configure()
+        barrier = threading.Barrier(8)
+        sessions = []
+
+        def worker():
+            barrier.wait()
+            sessions.append(transport.session())
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(s) for s in sessions}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,60 +1,66 @@
-import json
-import os
 import time
-import requests
+from europeana.client import CONCURRENCY, RATE_LIMITER, SESSION, retry_after
+from europeana.state import state_store
 from helpers.constants import (
-    CURSOR_FILE,
     SEARCH_URL,
     EXCLUDED_DC_TYPES,
     RECORD_URL,
     API_PARAMS,
+    FACET_LIMIT,
 )
 from requests.exceptions import RequestException, ChunkedEncodingError
 
 
-def save_cursor(cursor):
-    """Save the current cursor to a file so downloads can resume."""
+class SearchError(Exception):
+    """The search API gave no valid response, even after the retries."""
+
+
+def save_cursor(cursor, partition=""):
+    """Save the current cursor to the state store so downloads can resume."""
     if cursor and cursor not in ["*", None]:  # ✅ Ensure cursor is valid before saving
-        with open(CURSOR_FILE, "w", encoding="utf-8") as f:
-            json.dump({"cursor": cursor}, f)
+        state_store().set_cursor(cursor, partition)
         print(f"💾 Cursor saved: {cursor}")  # ✅ Debugging
     else:
         print("⚠️ Not saving cursor because it is empty or invalid.")
 
 
-def load_cursor():
-    """Load the last saved cursor from file and ensure it's valid."""
-    if os.path.exists(CURSOR_FILE):
-        try:
-            with open(CURSOR_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                cursor = data.get("cursor")
-                if cursor and cursor not in ["*", None]:  # ✅ Ensure cursor is valid
-                    print(f"🔄 Resuming from cursor: {cursor}")
-                    return cursor
-                else:
-                    print("⚠️ Cursor file is empty or invalid. Resetting cursor.")
-                    return None  # ✅ Reset if the cursor is invalid
-        except (json.JSONDecodeError, FileNotFoundError):
-            print("⚠️ Cursor file corrupted. Resetting cursor.")
-            return None  # ✅ Reset cursor if corrupted
-    return None  # ✅ No cursor file exists yet, start fresh
+def load_cursor(partition=""):
+    """Load the last saved cursor from the state store and ensure it's valid."""
+    cursor = state_store().cursor(partition)
+    if cursor and cursor not in ["*", None]:  # ✅ Ensure cursor is valid
+        print(f"🔄 Resuming from cursor: {cursor}")
+        return cursor
+    return None  # ✅ No cursor saved yet, start fresh
 
 
 def fetch_with_retries(url, params, max_retries=5):
-    """Fetch API data with retry logic to handle rate limits and server failures."""
+    """Fetch API data with retry logic to handle rate limits and server failures.
+
+    Every thread shares a pooled session, a global rate limiter and an
+    adaptive concurrency limit (see europeana.client), so a 429 with
+    `Retry-After` holds all requests and overload errors lower the number of
+    requests in flight.
+    """
     retries = 0
     while retries < max_retries:
         try:
-            response = requests.get(url, params=params, timeout=15)
+            with CONCURRENCY:
+                RATE_LIMITER.acquire()
+                response = SESSION.get(url, params=params, timeout=15)
             if response.status_code == 200:
+                CONCURRENCY.success()
                 return response.json()
             elif response.status_code in [429, 502, 503, 504, 520]:  # Handle failures
-                wait_time = 2**retries  # Exponential backoff
+                CONCURRENCY.backoff()
+                wait_time = retry_after(response)
+                if wait_time is None:
+                    wait_time = 2**retries  # Exponential backoff
+                    time.sleep(wait_time)
+                else:
+                    RATE_LIMITER.pause(wait_time)  # ✅ Every thread waits
                 print(
                     f"⚠️ API Error {response.status_code}. Retrying in {wait_time}s..."
                 )
-                time.sleep(wait_time)
                 retries += 1
             else:
                 print(
@@ -62,6 +68,7 @@ def fetch_with_retries(url, params, max_retries=5):
                 )
                 return None  # Don't retry for other errors
         except (RequestException, ChunkedEncodingError) as e:
+            CONCURRENCY.backoff()
             wait_time = 2**retries
             print(f"⚠️ Network Error: {e}. Retrying in {wait_time}s...")
             time.sleep(wait_time)
@@ -100,21 +107,35 @@ def find_excluded_dctype(data, path=""):
     return False
 
 
-def fetch_item_ids(cursor=None):
-    """Fetch item IDs using cursor-based pagination with retries."""
+def fetch_item_ids(cursor=None, checkpoint=True, profile=None, partition=""):
+    """Fetch item IDs using cursor-based pagination with retries.
+
+    With `checkpoint=False` the next cursor is not saved, the caller saves it
+    once the items of the page are stored. A `profile` such as `rich` makes
+    the search API embed more metadata in each item. A `partition`, a query
+    filter such as `TYPE:"IMAGE"` (see fetch_partitions), restricts the
+    search and has its own cursor.
+
+    Returns the items and the next cursor. The items are None when the API
+    gave no valid response, so a failure is not taken for the last page.
+    """
     if cursor is None:  # ✅ Always try to load the last saved cursor
-        cursor = load_cursor()
+        cursor = load_cursor(partition)
 
     print(f"🔍 Querying API with cursor: {cursor}")
 
     # 🔥 Use the full API_PARAMS dictionary directly
     params = API_PARAMS.copy()  # Make a copy to avoid mutating the global dictionary
     params["cursor"] = cursor
+    if profile:
+        params["profile"] = profile
+    if partition:
+        params["qf"] = partition
 
     data = fetch_with_retries(SEARCH_URL, params)
     if not data:
         print("❌ API returned no valid response. Stopping download.")
-        return [], None
+        return None, None
 
     raw_items = data.get("items", [])
     filtered_items = [item for item in raw_items if not find_excluded_dctype(item)]
@@ -122,15 +143,56 @@ def fetch_item_ids(cursor=None):
 
     print(f"📊 API Returned: {len(filtered_items)} items")  # 🔍 Debugging line
 
-    if next_cursor:
+    if next_cursor and checkpoint:
         print(f"💾 Saving next cursor: {next_cursor}")  # ✅ Debugging
-        save_cursor(next_cursor)  # ✅ Always save the next cursor
-    else:
+        save_cursor(next_cursor, partition)  # ✅ Always save the next cursor
+    elif not next_cursor:
         print("✅ No more pages to fetch.")
 
     return filtered_items, next_cursor
 
 
+def quote(value):
+    """Quote a facet value for a query filter."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def fetch_partitions(facet):
+    """Split the search into disjoint partitions, one per value of a facet.
+
+    Returns the query filter of each value, the largest first, such as
+    `DATA_PROVIDER:"Name"`, and the query filter of the remainder, the items
+    in no partition, or None when the partitions cover every item of the
+    search. Items without a value, or whose value is past the first
+    `FACET_LIMIT` ones, are in no partition. The remainder excludes the
+    values of the partitions, such as `-DATA_PROVIDER:("A" OR "B")`, so it
+    is harvested as one more partition instead of paging the whole search.
+    """
+    params = API_PARAMS.copy()
+    params.update(
+        {"rows": 0, "profile": "facets", "facet": facet, f"f.{facet}.facet.limit": FACET_LIMIT}
+    )
+    data = fetch_with_retries(SEARCH_URL, params)
+    if not data:
+        print(f"❌ Could not get the {facet} facet.")
+        return [], None
+
+    fields = next(
+        (f.get("fields", []) for f in data.get("facets", []) if f.get("name") == facet), []
+    )
+    fields.sort(key=lambda field: field.get("count", 0), reverse=True)
+    covered = sum(field.get("count", 0) for field in fields)
+    total = data.get("totalResults", 0)
+    print(f"🧩 {len(fields)} {facet} partitions with {covered} of {total} items.")
+    values = [quote(field["label"]) for field in fields]
+    remainder = None
+    if covered < total:
+        print(f"⚠️ {total - covered} items have no {facet} in the first {FACET_LIMIT} values.")
+        remainder = f"-{facet}:(" + " OR ".join(values) + ")" if values else "*:*"
+
+    return [f"{facet}:{value}" for value in values], remainder
+
+
 def fetch_item_metadata(item_id):
     """Fetch full metadata for a specific item with retry logic."""
     url = f"{RECORD_URL}{item_id}.json"
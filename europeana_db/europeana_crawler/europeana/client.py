@@ -0,0 +1,124 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from helpers.constants import (
+    FETCH_WORKERS,
+    MAX_FETCH_WORKERS,
+    REQUEST_BURST,
+    REQUEST_RATE,
+)
+
+
+class TokenBucket:
+    """Global rate limiter shared by every thread talking to the API."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate  # Tokens added per second
+        self.burst = burst  # Maximum tokens kept
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token, and for the end of any pause asked by the API."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = max(
+                    self.paused_until - now, (1 - self.tokens) / self.rate
+                )
+            time.sleep(wait_time)
+
+    def pause(self, seconds):
+        """Hold every request for `seconds`, as asked by a `Retry-After`."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class AdaptiveConcurrency:
+    """Limit of requests in flight, adjusted AIMD-style.
+
+    The limit grows by one after a full window of healthy responses and is
+    halved when the API answers 429/5xx or fails, at most once per window so
+    a burst of errors from the same requests counts once.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=MAX_FETCH_WORKERS):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.window = 0  # Requests started since the last decrease
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            self.window += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+        return False
+
+    def success(self):
+        """Additive increase after `limit` healthy responses in a row."""
+        with self.condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                self.condition.notify_all()
+
+    def backoff(self):
+        """Multiplicative decrease when the API is overloaded."""
+        with self.condition:
+            self.successes = 0
+            if self.window >= self.limit:
+                self.limit = max(self.minimum, self.limit // 2)
+                self.window = 0
+
+
+def retry_after(response):
+    """Seconds to wait from the `Retry-After` header, None if it is missing."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def create_session():
+    """Session keeping a connection per worker open to the API."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_FETCH_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# ✅ Shared by every request to the API
+SESSION = create_session()
+RATE_LIMITER = TokenBucket(REQUEST_RATE, REQUEST_BURST)
+CONCURRENCY = AdaptiveConcurrency(FETCH_WORKERS)
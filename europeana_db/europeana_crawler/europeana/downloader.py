@@ -1,67 +1,25 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, as_completed, wait
 import json
 import os
+from queue import Empty, Full, Queue
+from threading import Event
 from tqdm import tqdm
-from europeana.api import fetch_item_ids, fetch_item_metadata, load_cursor, save_cursor
-from helpers.constants import BATCH_SIZE, JSON_DIR, LOG_FILE, CACHE_FILE
-
-
-def load_existing_ids():
-    """Load existing item IDs from the log file to avoid duplicates."""
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, "r", encoding="utf-8") as f:
-            return set(line.strip() for line in f.readlines())
-    return set()
-
-
-def load_cache():
-    """Load cache from JSON file, ensuring `item_ids` is always a list."""
-    if not os.path.exists(CACHE_FILE):
-        return {"downloaded_count": 0, "item_ids": []}  # ✅ Ensure it's a list
-
-    with open(CACHE_FILE, "r", encoding="utf-8") as f:
-        cache = json.load(f)
-
-    # ✅ Ensure `item_ids` is a list before returning
-    if "item_ids" not in cache:
-        cache["item_ids"] = []
-    elif isinstance(cache["item_ids"], set):
-        cache["item_ids"] = list(cache["item_ids"])
-
-    return cache
-
-
-def save_cache(cache_data):
-    """Ensure item_ids is converted to a list before saving."""
-    cache_data["item_ids"] = list(cache_data.get("item_ids", []))  # ✅ Convert to list
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump(cache_data, f, indent=4)
-
-
-def save_ids_log(downloaded_ids):
-    """Append only successfully downloaded item IDs to the log file."""
-    cache = load_cache()  # Load cache from file
-    existing_ids = set(load_existing_ids())  # Convert existing IDs to a set
-    new_ids = [item_id for item_id in downloaded_ids if item_id not in existing_ids]
-
-    if new_ids:
-        # Append to ids.log
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            for item_id in new_ids:
-                f.write(f"{item_id}\n")
-        print(f"📝 Added {len(new_ids)} new item IDs to log.")
-
-        # ✅ Ensure item_ids is stored as a **list**
-        if "item_ids" not in cache:
-            cache["item_ids"] = []  # Initialize if missing
-        elif isinstance(cache["item_ids"], set):
-            cache["item_ids"] = list(cache["item_ids"])  # Convert to list if it's a set
-
-        cache["item_ids"].extend(new_ids)  # ✅ Use .extend() for lists
-        save_cache(cache)  # Persist changes
-
-    else:
-        print("✅ No new IDs to add. Skipping log update.")
+from europeana.api import (
+    SearchError,
+    fetch_item_ids,
+    fetch_item_metadata,
+    fetch_partitions,
+    load_cursor,
+)
+from europeana.state import DOWNLOADED, FAILED, state_store
+from helpers.constants import (
+    BATCH_SIZE,
+    JSON_DIR,
+    MAX_FETCH_WORKERS,
+    PARTITION_WORKERS,
+    REQUIRED_FIELDS,
+    RICH_PROFILE,
+)
 
 
 def item_json_exists(item_id):
@@ -94,192 +52,284 @@ def fetch_and_save(item_id):
     return None
 
 
-def collect_data(limit=10, force_download=False):
+def put(queue, item, stop):
+    """Put an item in a bounded queue, giving up if another task failed."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return
+        except Full:
+            continue
+    raise RuntimeError("Harvest stopped")
+
+
+def get(queue, stop):
+    """Get an item from a queue, giving up if another task failed."""
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            continue
+    raise RuntimeError("Harvest stopped")
+
+
+def harvest(
+    cursor, store, limit=None, workers=MAX_FETCH_WORKERS, rich=False, partition=""
+):
+    """Download new items with pagination, fetching and saving overlapped.
+
+    A pager task follows the search cursor and feeds the new item IDs to a
+    bounded queue, so it runs ahead of the record fetches by up to
+    `BATCH_SIZE` IDs. A pool of `workers` fetches the records as they arrive,
+    as many at once as the API sustains (see europeana.client), and a single
+    writer saves them. With `rich` the search pages embed the metadata of
+    their items, which is saved as is, and only the items missing any of
+    `REQUIRED_FIELDS` are fetched from the record API. The writer commits a
+    page (its items and next cursor) to the state `store` once all of its
+    items and the ones of the pages before it are saved, so an interrupted
+    harvest resumes without gaps. A `partition` query filter restricts the
+    search and keeps its own cursor.
+
+    Returns the number of items saved.
+    """
+    ids_queue = Queue(BATCH_SIZE)
+    results_queue = Queue(BATCH_SIZE)
+    stop = Event()
+    queued_ids = set()  # Items of this harvest, not committed yet
+    errors = []  # A failed search, raised once the pages before it are saved
+
+    def pager():
+        page, current, queued = 0, cursor, 0
+        try:
+            while current and (limit is None or queued < limit):
+                items, next_cursor = fetch_item_ids(
+                    current,
+                    checkpoint=False,
+                    profile=RICH_PROFILE if rich else None,
+                    partition=partition,
+                )
+                if items is None:
+                    errors.append(SearchError(f"The search failed at cursor {current}"))
+                    break
+                if not items and not next_cursor:
+                    break
+                new_items = [
+                    item
+                    for item in items
+                    if "id" in item
+                    and item["id"] not in queued_ids
+                    and not store.contains(item["id"])
+                ]
+                queued_ids.update(item["id"] for item in new_items)
+                if limit is not None and queued + len(new_items) > limit:
+                    # the rest of the page is left for the next run
+                    new_items, next_cursor = new_items[: limit - queued], None
+                queued += len(new_items)
+                # the page goes to the writer before its IDs to the fetchers
+                put(results_queue, ("page", page, len(new_items), next_cursor), stop)
+                for item in new_items:
+                    if rich and all(item.get(field) for field in REQUIRED_FIELDS):
+                        put(results_queue, ("item", page, item["id"], item), stop)
+                    else:
+                        put(ids_queue, (page, item["id"]), stop)
+                page, current = page + 1, next_cursor
+        finally:
+            for _ in range(workers):
+                put(ids_queue, None, stop)
+
+    def fetcher():
+        try:
+            while (entry := get(ids_queue, stop)) is not None:
+                page, item_id = entry
+                put(results_queue, ("item", page, item_id, fetch_item_metadata(item_id)), stop)
+        finally:
+            put(results_queue, None, stop)
+
+    def writer():
+        pages, done, saved = {}, 0, 0
+        next_page, downloaded_ids, failed_ids = 0, [], []
+        label = partition if len(partition) <= 40 else partition[:37] + "..."
+        progress = tqdm(
+            total=limit,
+            desc=f"🚀 {label or 'Fetching new metadata'}...",
+            ncols=80,
+            ascii=" ░▒▓█",
+        )
+        while done < workers:
+            entry = get(results_queue, stop)
+            if entry is None:
+                done += 1
+                continue
+            if entry[0] == "page":
+                _, page, count, next_cursor = entry
+                pages[page] = [count, next_cursor]
+            else:
+                _, page, item_id, metadata = entry
+                pages[page][0] -= 1
+                if not metadata:
+                    failed_ids.append(item_id)
+                elif save_metadata(item_id, metadata) or item_json_exists(item_id):
+                    downloaded_ids.append(item_id)
+                    saved += 1
+                progress.update()
+            while next_page in pages and pages[next_page][0] == 0:
+                store.commit_batch(
+                    downloaded_ids, failed_ids, pages.pop(next_page)[1], partition
+                )
+                next_page, downloaded_ids, failed_ids = next_page + 1, [], []
+        store.commit_batch(downloaded_ids, failed_ids)
+        progress.close()
+        return saved
+
+    with ThreadPoolExecutor(max_workers=workers + 2) as executor:
+        futures = [executor.submit(pager), executor.submit(writer)]
+        futures.extend(executor.submit(fetcher) for _ in range(workers))
+        finished, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [future for future in finished if future.exception()]
+        if failed:
+            stop.set()
+            raise failed[0].exception()
+    if errors:
+        raise errors[0]
+
+    return futures[1].result()
+
+
+def harvest_partitions(store, facet, rich=False, workers=PARTITION_WORKERS):
+    """Harvest the partitions of a facet concurrently, each with its own cursor.
+
+    The search is split by the values of `facet` (see fetch_partitions) and
+    `workers` partitions are harvested at once, sharing the API limits of
+    europeana.client. When the partitions do not cover every item, the items
+    in none of them are harvested as one more partition, whose filter
+    excludes the values of the others. A partition that fails, including a
+    search request that fails for good, is reported and the others go on;
+    the next run resumes every partition from its own cursor.
+
+    Returns the number of items saved.
+    """
+    partitions, remainder = fetch_partitions(facet)
+    if remainder:
+        partitions.append(remainder)
+    fetchers = max(4, MAX_FETCH_WORKERS // max(1, min(workers, len(partitions))))
+    saved, failed = 0, []
+
+    def run(partition):
+        cursor = load_cursor(partition) or "*"
+        return harvest(cursor, store, workers=fetchers, rich=rich, partition=partition)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, partition): partition for partition in partitions}
+        for future in as_completed(futures):
+            try:
+                saved += future.result()
+            except Exception as e:
+                name = "remainder" if futures[future] == remainder else futures[future]
+                failed.append(name)
+                print(f"❌ Partition {name} failed: {e}")
+
+    if failed:
+        print(f"⚠️ {len(failed)} partition(s) failed, run again to resume them.")
+
+    return saved
+
+
+def collect_data(limit=10, force_download=False, rich=False, partition_facet=None):
     """Ensure dataset consistency first, re-download missing JSON files, then fetch more items."""
 
-    cursor = None if force_download else load_cursor() or "*"
+    store = state_store()  # ✅ Imports the former log, cache and cursor files once
+    bound = store.bind(JSON_DIR)
 
     if not os.listdir(JSON_DIR):  # If the JSON directory is empty
-        print("⚠️ Data folder is empty! Resetting cache...")
-        cache = {"downloaded_count": 0, "item_ids": []}  # ✅ Use list instead of set
-        save_cache(cache)  # Ensure it's saved immediately
-    saved_files = []
-    downloaded_ids = []  # Track only IDs of successfully downloaded files
-
-    # Load cache to see total downloaded count & stored IDs
-    cache = load_cache()
-    cached_ids = set(cache.get("item_ids", []))  # Get stored IDs
-    existing_ids = load_existing_ids()
-    total_downloaded = cache["downloaded_count"]
+        if bound == os.path.realpath(JSON_DIR):
+            print("⚠️ Data folder is empty! Resetting state...")
+            store.reset()
+        elif store.count():
+            # ✅ The store was not filled into this folder, its items are re-downloaded instead
+            print("⚠️ Data folder is empty but the state store was not filled into it, keeping it.")
+
+    cursor = None if force_download else load_cursor() or "*"
+    total_downloaded = store.count()
 
     print("\n🛠️ **Pre-Download Check: Ensuring dataset consistency...**")
 
-    items, cursor = fetch_item_ids(cursor)  # Now fetch_item_ids() always returns a list
+    items, _ = fetch_item_ids(cursor, checkpoint=False)  # None when the API failed
     if not items:  # Ensure items is not empty
         print("✅ No new items found in API response. Stopping download.")
         return
 
     json_files = set(os.listdir(JSON_DIR))  # Check JSON files in storage
 
-    missing_log_entries = 0
-    missing_json_items = []
-    missing_in_log = []
-
-    # Step 1: Fix missing logs & detect missing JSON files
-    all_logged_and_cached_ids = existing_ids | cached_ids  # Combine both sets
-
-    for item_id in all_logged_and_cached_ids:
-        safe_item_id = item_id.replace("/", "_") + ".json"
-        json_exists = safe_item_id in json_files
-        log_exists = item_id in existing_ids
-
-        # Fix missing log entries (if JSON exists but ID is missing from log)
-        if json_exists and not log_exists:
-            missing_in_log.append(item_id)
-            downloaded_ids.append(item_id)
-            missing_log_entries += 1
-
-        # If JSON is missing but in cache/logs, mark it for re-download
-        if not json_exists and item_id in cached_ids:
-            missing_json_items.append(item_id)
-
-    total_log_count = len(existing_ids)  # Define total_log_count before condition
-
-    # Display missing log entries if any exist
-    if missing_in_log:
-        print(f"🔸 **{len(missing_in_log)} missing item(s) found in `ids.log`.**")
-        print("❌ **Missing Log IDs:**")
-        for item_id in missing_in_log:
-            print(f"      - {item_id}")
-        print("\n🛠️ Fixing missing IDs in `ids.log`...\n")
-
-        save_ids_log(
-            set(missing_in_log) | (cached_ids - existing_ids)
-        )  # Ensure all types are sets
+    # Step 1: Detect downloaded items whose JSON file is missing and failed items
+    missing_json_items = [
+        item_id
+        for item_id in store.ids(DOWNLOADED)
+        if item_id.replace("/", "_") + ".json" not in json_files
+    ]
+    failed_items = store.ids(FAILED)
 
-        json_files = set(os.listdir(JSON_DIR))  # Re-check JSON files after re-download
-        total_json_count = len(json_files)
+    print(f"📊 **Total items in the state store now: {total_downloaded}**\n")
 
-        print(f"✅ Finished re-adding {len(missing_in_log)} missing IDs to `ids.log`.")
-        print(f"📊 **Total items in `ids.log` now: {total_log_count}**\n")
-    else:
-        total_log_count = len(existing_ids)
-        print(f"✅ IDs log is ok. No new IDs to add. Skipping log update.")
-        print(f"📊 **Total items in `ids.log` now: {total_log_count}**\n")
-
-    # Step 2: Detect and print missing JSON files before downloading
-    if missing_json_items:
-        print(f"🔸 **{len(missing_json_items)} missing JSON file(s) detected.**")
-        print("❌ **Missing JSON file IDs:**")
-        for item_id in missing_json_items:
+    # Step 2: Re-download them before downloading new items
+    retry_items = missing_json_items + failed_items
+    if retry_items:
+        print(
+            f"🔸 **{len(missing_json_items)} missing JSON file(s) and "
+            f"{len(failed_items)} failed item(s) detected.**"
+        )
+        print("❌ **Item IDs to download again:**")
+        for item_id in retry_items:
             print(f"      - {item_id}")
         print("\n🛠️ Re-downloading missing JSON files...")
 
-        with ThreadPoolExecutor(max_workers=5) as executor:
+        with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
             results = list(
                 tqdm(
-                    executor.map(fetch_and_save, missing_json_items),
-                    total=len(missing_json_items),
+                    executor.map(fetch_and_save, retry_items),
+                    total=len(retry_items),
                     desc="🔄 Fetching missing metadata...",
                     ncols=80,
                     ascii=" ░▒▓█",
                 )
             )
 
-        saved_files = [file for file in results if file]
+        saved_ids = [item_id for item_id, file in zip(retry_items, results) if file]
+        store.commit_batch(saved_ids)
 
         total_json_count = len(os.listdir(JSON_DIR))  # Updated JSON file count
-        print(f"✅ Finished re-downloading {len(saved_files)} JSON files.")
+        print(f"✅ Finished re-downloading {len(saved_ids)} JSON files.")
         print(f"📊 **Total items in the `json` folder now: {total_json_count}**\n")
     else:
         total_json_count = len(json_files)
         print(f"✅ JSON files are up-to-date. No missing files detected.")
         print(f"📊 **Total items in the `json` folder now: {total_json_count}**\n")
 
-    # Step 3: Ask the user before downloading the first batch
-    first_run = True  # Track if it's the first batch
-
-    cursor = load_cursor()  # Load previous cursor if exists
-
-    while True:
-        if first_run and limit is not None:
-            user_input = (
-                input("\n🔹 Do you want to download more new items? (yes/no): ")
-                .strip()
-                .lower()
-            )
-            download_more = user_input in ["yes", "y"]
-            if not download_more:
-                print(
-                    f"✅ No new downloads requested. **Total items downloaded (tracked in cache): {total_downloaded}**\n"
-                )
-                return
-
-        print("\n🔍 Fetching new items...")
-
-        items, next_cursor = fetch_item_ids(cursor)  # Fetch new items using pagination
-        if not items:
-            print("✅ No more new items found. Stopping download.")
-            return
-        cursor = next_cursor  # ✅ Ensure cursor is updated
-        new_download_items = [
-            item["id"]
-            for item in items
-            if "id" in item
-            and item["id"] not in existing_ids
-            and item["id"] not in cached_ids
-        ]
-
-        if not new_download_items:
-            print("✅ No new items available for download.")
-            return
-
-        # Apply batch size: BATCH_SIZE for --all, otherwise use limit
-        batch_size = BATCH_SIZE if limit is None else limit
-        new_download_items = new_download_items[:batch_size]
-
-        print(
-            f"🚀 Fetching metadata for **{len(new_download_items)}** new items in parallel...\n"
+    # Step 3: Ask the user before downloading new items
+    if limit is not None:
+        user_input = (
+            input("\n🔹 Do you want to download more new items? (yes/no): ")
+            .strip()
+            .lower()
         )
-
-        # Step 4: Fetch new items in parallel
-        downloaded_ids = []  # Reset this list to track only new downloads
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            results = list(
-                tqdm(
-                    executor.map(fetch_and_save, new_download_items),
-                    total=len(new_download_items),
-                    desc="🚀 Fetching new metadata...",
-                    ncols=80,
-                    ascii=" ░▒▓█",
-                )
+        if user_input not in ["yes", "y"]:
+            print(
+                f"✅ No new downloads requested. **Total items downloaded (tracked in state): {total_downloaded}**\n"
             )
+            return
 
-        saved_files = [file for file in results if file]
-        downloaded_ids.extend(
-            [item_id for item_id, result in zip(new_download_items, results) if result]
-        )
-
-        # ✅ Log new downloaded IDs
-        save_ids_log(downloaded_ids)
-
-        # ✅ Step 5: Properly Update Cache
-        cache["downloaded_count"] += len(downloaded_ids)  # ✅ Increment count
-        cache["item_ids"] = list(
-            set(cache.get("item_ids", [])) | set(downloaded_ids)
-        )  # ✅ Merge and ensure a list
-        save_cache(cache)  # ✅ Save immediately after update
+    print("\n🔍 Fetching new items...")
 
-        print(f"✅ Finished fetching metadata for **{len(saved_files)}** new items!")
-        print(
-            f"📊 **Total items downloaded so far (tracked in cache): {cache['downloaded_count']}**\n"
-        )
-
-        # ✅ Save the cursor after a successful batch fetch
-        if next_cursor:
-            save_cursor(next_cursor)  # ✅ Save the next cursor
-            cursor = next_cursor  # ✅ Update the cursor for the next fetch
-        else:
-            print("✅ No more items to fetch.")
+    # Step 4: Page through the search API while fetching and saving the items
+    if partition_facet:
+        downloaded = harvest_partitions(store, partition_facet, rich=rich)
+    else:
+        try:
+            downloaded = harvest(load_cursor() or "*", store, limit=limit, rich=rich)
+        except SearchError as e:
+            print(f"❌ {e}, run again to resume from the last saved page.")
             return
+
+    print(f"✅ Finished fetching metadata for **{downloaded}** new items!")
+    print(
+        f"📊 **Total items downloaded so far (tracked in state): {store.count()}**\n"
+    )
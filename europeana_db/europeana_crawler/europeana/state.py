@@ -0,0 +1,186 @@
+import json
+import os
+import sqlite3
+import threading
+from functools import lru_cache
+from helpers.constants import CACHE_FILE, CURSOR_FILE, LOG_FILE, STATE_DB
+
+DOWNLOADED = "downloaded"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS items_status ON items (status);
+CREATE TABLE IF NOT EXISTS counts (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS cursors (partition TEXT PRIMARY KEY, cursor TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class StateStore:
+    """Harvest state: item IDs with their status, counts and cursors.
+
+    Everything lives in one SQLite database in WAL mode, so checking an ID is
+    a primary key lookup and a batch (its items, count and next cursor) is
+    saved in a single transaction: a crash leaves either all of it or none.
+    The store is shared by the harvest threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = path = path or STATE_DB
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def contains(self, item_id):
+        """Check if an item was already downloaded."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT status FROM items WHERE id = ?", (item_id,)
+            ).fetchone()
+        return row is not None and row[0] == DOWNLOADED
+
+    def ids(self, status=DOWNLOADED):
+        """Get the IDs of the items with a status."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM items WHERE status = ?", (status,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self, name="downloaded_count"):
+        """Get a counter, such as the total of downloaded items."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM counts WHERE name = ?", (name,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def cursor(self, partition=""):
+        """Get the cursor the harvest of a partition resumes from."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT cursor FROM cursors WHERE partition = ?", (partition,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def commit_batch(
+        self, downloaded_ids=(), failed_ids=(), cursor=None, partition=""
+    ):
+        """Save a batch of items and the cursor that follows it atomically.
+
+        Returns the number of items that were not downloaded before.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            added = self.connection.executemany(
+                "INSERT INTO items (id, status) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET status = excluded.status "
+                "WHERE status != excluded.status",
+                [(item_id, DOWNLOADED) for item_id in downloaded_ids],
+            ).rowcount
+            self.connection.executemany(
+                "INSERT INTO items (id, status) VALUES (?, ?) "
+                "ON CONFLICT (id) DO NOTHING",
+                [(item_id, FAILED) for item_id in failed_ids],
+            )
+            if added > 0:
+                self.connection.execute(
+                    "INSERT INTO counts (name, value) VALUES ('downloaded_count', ?) "
+                    "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                    (added,),
+                )
+            if cursor:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO cursors (partition, cursor) VALUES (?, ?)",
+                    (partition, cursor),
+                )
+        return max(added, 0)
+
+    def set_cursor(self, cursor, partition=""):
+        """Save the cursor of a partition on its own."""
+        self.commit_batch(cursor=cursor, partition=partition)
+
+    def bind(self, json_dir):
+        """Record the JSON folder the items are saved to.
+
+        Returns the folder recorded before, None when the store had none.
+        """
+        json_dir = os.path.realpath(json_dir)
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'json_dir'"
+            ).fetchone()
+            if row is None:
+                self.connection.execute(
+                    "INSERT INTO meta (key, value) VALUES ('json_dir', ?)", (json_dir,)
+                )
+        return row[0] if row else None
+
+    def reset(self):
+        """Forget every item, count and cursor, to harvest from scratch."""
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for table in ("items", "counts", "cursors"):
+                self.connection.execute(f"DELETE FROM {table}")
+
+    def migrate(self, log_file=None, cache_file=None, cursor_file=None):
+        """Import `ids.log`, `cache.json` and `cursor_state.json` once.
+
+        The files are left in place but no longer read or written.
+        """
+        log_file = log_file or LOG_FILE
+        cache_file = cache_file or CACHE_FILE
+        cursor_file = cursor_file or CURSOR_FILE
+        with self.lock:
+            done = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'migrated'"
+            ).fetchone()
+        if done:
+            return
+
+        item_ids = set()
+        if os.path.exists(log_file):
+            with open(log_file, "r", encoding="utf-8") as f:
+                item_ids.update(line.strip() for line in f if line.strip())
+        legacy = {}
+        for name, path in (("cache", cache_file), ("cursor", cursor_file)):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    legacy[name] = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                legacy[name] = {}
+        item_ids.update(legacy["cache"].get("item_ids", []))
+        cursor = legacy["cursor"].get("cursor")
+
+        self.commit_batch(item_ids, cursor=cursor if cursor != "*" else None)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', '1')"
+            )
+        if item_ids or cursor:
+            print(f"📦 Migrated {len(item_ids)} item IDs and the cursor to the state store.")
+
+
+@lru_cache(maxsize=None)
+def open_store(path, log_file, cache_file, cursor_file):
+    """Open a state store once per path, migrating the former files first."""
+    store = StateStore(path)
+    store.migrate(log_file, cache_file, cursor_file)
+    return store
+
+
+def state_store():
+    """The state store of the harvest.
+
+    The paths are read on every call, so a store opened before they were
+    changed, as by the benchmarks, is not reused.
+    """
+    return open_store(STATE_DB, LOG_FILE, CACHE_FILE, CURSOR_FILE)
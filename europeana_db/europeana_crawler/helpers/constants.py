@@ -10,7 +10,16 @@ DEFAULT_ROWS = 100  # Number of items per API request
 DEFAULT_REUSABILITY = "open"  # Retrieve only open-license records
 DEFAULT_MEDIA = "true"  # Ensure media items are retrieved
 DEFAULT_QUERY = "*"  # Required query parameter
-BATCH_SIZE = 1000
+RICH_PROFILE = "rich"  # Search profile that embeds the item metadata
+REQUIRED_FIELDS = ["edmIsShownBy"]  # Else the item record is fetched
+PARTITION_FACETS = ["DATA_PROVIDER", "TYPE", "COUNTRY", "YEAR"]  # To split --all
+FACET_LIMIT = 1000  # Maximum number of partitions of a facet
+PARTITION_WORKERS = 8  # Number of partitions harvested at once
+BATCH_SIZE = 1000  # Maximum number of item IDs queued ahead of the fetchers
+FETCH_WORKERS = 5  # Initial number of simultaneous record requests
+MAX_FETCH_WORKERS = 32  # The concurrency grows up to this while the API keeps up
+REQUEST_RATE = 50  # Maximum requests per second to the API
+REQUEST_BURST = 50  # Requests allowed at once after an idle period
 
 API_PARAMS = {
     "wskey": EUROPEANA_API_KEY,
@@ -48,6 +57,9 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "../data")
 JSON_DIR = os.path.join(DATA_DIR, "json")  # JSON metadata storage
 LOGS_DIR = os.path.join(DATA_DIR, "logs")  # Logs directory
+STATE_DB = os.path.join(LOGS_DIR, "state.sqlite")  # Item IDs, counts and cursors
+
+# Former state files, imported once into STATE_DB
 LOG_FILE = os.path.join(LOGS_DIR, "ids.log")  # Log file path
 CACHE_FILE = os.path.join(
     LOGS_DIR, "cache.json"
@@ -57,8 +69,3 @@ CURSOR_FILE = os.path.join(LOGS_DIR, "cursor_state.json")  # File to store curso
 # Ensure directories exist
 os.makedirs(JSON_DIR, exist_ok=True)
 os.makedirs(LOGS_DIR, exist_ok=True)
-
-# Ensure cache file exists
-if not os.path.exists(CACHE_FILE):
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-        f.write('{"downloaded_count": 0}')
@@ -1,5 +1,6 @@
 import argparse
 from europeana.downloader import collect_data
+from helpers.constants import PARTITION_FACETS
 
 
 def main():
@@ -20,12 +21,30 @@ def main():
         help="Download all available files (ignores --limit)",
     )
 
+    # Argument to take the metadata from the search results
+    parser.add_argument(
+        "--rich",
+        action="store_true",
+        help="Save the metadata embedded in the rich search results, fetching "
+        "records only for items without an image link",
+    )
+
+    # Argument to harvest disjoint parts of the dataset concurrently
+    parser.add_argument(
+        "--partition",
+        choices=PARTITION_FACETS,
+        help="With --all, split the download by the values of this facet and "
+        "download the parts concurrently",
+    )
+
     args = parser.parse_args()
+    if args.partition and not args.all:
+        parser.error("--partition can only be used with --all")
 
     # If --all is used, set limit to None (i.e., download everything)
     download_limit = None if args.all else args.limit
 
-    collect_data(limit=download_limit)
+    collect_data(limit=download_limit, rich=args.rich, partition_facet=args.partition)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+import time
+import unittest
+
+import requests
+
+from europeana.client import AdaptiveConcurrency, TokenBucket, retry_after
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        """Tokens beyond the burst are handed out at the bucket rate."""
+        bucket = TokenBucket(rate=50, burst=5)
+        start = time.monotonic()
+        for _ in range(10):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_pause_holds_requests(self):
+        """A pause from `Retry-After` delays the next token."""
+        bucket = TokenBucket(rate=1000, burst=10)
+        bucket.pause(0.2)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_additive_increase(self):
+        """The limit grows by one after a window of successes."""
+        concurrency = AdaptiveConcurrency(4, maximum=5)
+        for _ in range(4):
+            concurrency.success()
+        self.assertEqual(concurrency.limit, 5)
+        for _ in range(10):
+            concurrency.success()
+        self.assertEqual(concurrency.limit, 5)
+
+    def test_multiplicative_decrease_once_per_window(self):
+        """Errors of the same window halve the limit only once."""
+        concurrency = AdaptiveConcurrency(8)
+        for _ in range(8):
+            with concurrency:
+                pass
+        concurrency.backoff()
+        concurrency.backoff()
+        self.assertEqual(concurrency.limit, 4)
+
+    def test_minimum(self):
+        """The limit never drops below the minimum."""
+        concurrency = AdaptiveConcurrency(1, minimum=1)
+        with concurrency:
+            pass
+        concurrency.backoff()
+        self.assertEqual(concurrency.limit, 1)
+
+
+class TestRetryAfter(unittest.TestCase):
+    def response(self, headers):
+        response = requests.Response()
+        response.headers.update(headers)
+        return response
+
+    def test_seconds(self):
+        self.assertEqual(retry_after(self.response({"Retry-After": "3"})), 3.0)
+
+    def test_http_date(self):
+        value = retry_after(
+            self.response({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        )
+        self.assertEqual(value, 0.0)
+
+    def test_missing(self):
+        self.assertIsNone(retry_after(self.response({})))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import unittest
+
+from europeana import state
+from europeana.state import FAILED, StateStore
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        """Open a store in a temporary folder before each test."""
+        self.folder = tempfile.TemporaryDirectory()
+        self.store = StateStore(os.path.join(self.folder.name, "state.sqlite"))
+
+    def tearDown(self):
+        self.store.connection.close()
+        self.folder.cleanup()
+
+    def test_commit_batch(self):
+        """A batch saves its items, count and cursor together."""
+        added = self.store.commit_batch(["/1/a", "/1/b"], ["/1/c"], cursor="next")
+        self.assertEqual(added, 2)
+        self.assertTrue(self.store.contains("/1/a"))
+        self.assertFalse(self.store.contains("/1/c"))
+        self.assertEqual(self.store.ids(FAILED), ["/1/c"])
+        self.assertEqual(self.store.count(), 2)
+        self.assertEqual(self.store.cursor(), "next")
+
+    def test_count_new_items_only(self):
+        """Items saved again are not counted twice, failed ones once saved are."""
+        self.store.commit_batch(["/1/a"], ["/1/b"])
+        added = self.store.commit_batch(["/1/a", "/1/b"])
+        self.assertEqual(added, 1)
+        self.assertEqual(self.store.count(), 2)
+        self.assertEqual(self.store.ids(FAILED), [])
+
+    def test_failed_does_not_replace_downloaded(self):
+        self.store.commit_batch(["/1/a"])
+        self.store.commit_batch(failed_ids=["/1/a"])
+        self.assertTrue(self.store.contains("/1/a"))
+
+    def test_partition_cursors(self):
+        self.store.set_cursor("one", "DATA_PROVIDER:A")
+        self.store.set_cursor("two", "DATA_PROVIDER:B")
+        self.assertEqual(self.store.cursor("DATA_PROVIDER:A"), "one")
+        self.assertEqual(self.store.cursor("DATA_PROVIDER:B"), "two")
+        self.assertIsNone(self.store.cursor())
+
+    def test_migrate_once(self):
+        """The former log, cache and cursor files are imported only once."""
+        paths = [os.path.join(self.folder.name, name) for name in ("ids.log", "cache.json", "cursor.json")]
+        with open(paths[0], "w", encoding="utf-8") as f:
+            f.write("/1/a\n/1/b\n")
+        with open(paths[1], "w", encoding="utf-8") as f:
+            json.dump({"downloaded_count": 3, "item_ids": ["/1/b", "/1/c"]}, f)
+        with open(paths[2], "w", encoding="utf-8") as f:
+            json.dump({"cursor": "resume"}, f)
+
+        self.store.migrate(*paths)
+        self.assertEqual(sorted(self.store.ids()), ["/1/a", "/1/b", "/1/c"])
+        self.assertEqual(self.store.count(), 3)
+        self.assertEqual(self.store.cursor(), "resume")
+
+        self.store.reset()
+        self.store.migrate(*paths)
+        self.assertEqual(self.store.ids(), [])
+
+    def test_bind_first_folder(self):
+        """The store keeps the first JSON folder it was bound to."""
+        self.assertIsNone(self.store.bind(self.folder.name))
+        other = os.path.join(self.folder.name, "other")
+        self.assertEqual(self.store.bind(other), os.path.realpath(self.folder.name))
+
+
+class TestOpenStore(unittest.TestCase):
+    def test_state_store_follows_path(self):
+        """state_store reads the paths when called, not when imported."""
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            previous = state.STATE_DB, state.LOG_FILE, state.CACHE_FILE, state.CURSOR_FILE
+            try:
+                stores = []
+                for folder in (first, second):
+                    state.STATE_DB, state.LOG_FILE, state.CACHE_FILE, state.CURSOR_FILE = (
+                        os.path.join(folder, name)
+                        for name in ("state.sqlite", "ids.log", "cache.json", "cursor.json")
+                    )
+                    stores.append(state.state_store())
+                self.assertEqual(stores[0].path, os.path.join(first, "state.sqlite"))
+                self.assertEqual(stores[1].path, os.path.join(second, "state.sqlite"))
+                for store in stores:
+                    store.connection.close()
+            finally:
+                state.STATE_DB, state.LOG_FILE, state.CACHE_FILE, state.CURSOR_FILE = previous
+                state.open_store.cache_clear()
+
+
+if __name__ == "__main__":
+    unittest.main()